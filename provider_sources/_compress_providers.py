@@ -8,13 +8,19 @@ The compressed JSON is shipped with the package.
 """
 
 import json
+import math
 import warnings
 from datetime import date
 
 import requests
 import xmltodict
 
+from xyzservices.lib import _from_dict
+from xyzservices.probe import BROKEN, probe_providers
+
 # list of providers known to be broken and should be marked as broken in the JSON
+# even though they respond to requests (all providers are also probed below and
+# those not serving tiles are marked automatically)
 # last update: 23 Apr 2026
 BROKEN_PROVIDERS = [
     "JusticeMap.income",
@@ -95,6 +101,48 @@ response = requests.get(ign_wmts_url)
 response_dict = xmltodict.parse(response.content)
 layers_list = response_dict["Capabilities"]["Contents"]["Layer"] # 556 layers
 
+
+# Tile matrix sets not using Web Mercator (e.g. Lambert-93), captured to let
+# xyzservices.wmts compute their tiles. Each matrix is stored as
+# [identifier, resolution, origin x, origin y, matrix width, matrix height].
+
+# meters per unit of the CRS, used to convert scale denominators to resolutions
+# (standardized rendering pixel size of 0.28 mm)
+METERS_PER_DEGREE = 2 * math.pi * 6378137 / 360
+
+
+def parse_tile_matrix_set(tile_matrix_set):
+    crs = tile_matrix_set["ows:SupportedCRS"]
+    crs = "EPSG:" + crs.replace("::", ":").split(":")[-1]  # urn:ogc:def:crs:EPSG::
+    geographic = crs == "EPSG:4326"
+    matrices = []
+    tile_matrices = tile_matrix_set["TileMatrix"]
+    if isinstance(tile_matrices, dict):  # a single matrix
+        tile_matrices = [tile_matrices]
+    for matrix in tile_matrices:
+        corner = [float(v) for v in matrix["TopLeftCorner"].split()]
+        if geographic:  # latitude, longitude axis order
+            corner.reverse()
+        resolution = float(matrix["ScaleDenominator"]) * 0.28e-3
+        if geographic:
+            resolution /= METERS_PER_DEGREE
+        matrices.append(
+            [
+                int(matrix["ows:Identifier"]),
+                resolution,
+                *corner,
+                int(matrix["MatrixWidth"]),
+                int(matrix["MatrixHeight"]),
+            ]
+        )
+    return crs, matrices
+
+
+tile_matrix_sets = {
+    tms["ows:Identifier"]: tms
+    for tms in response_dict["Capabilities"]["Contents"]["TileMatrixSet"]
+}
+
 wmts_layers_list = []
 for i in range(len(layers_list)):
     layer = response_dict["Capabilities"]["Contents"]["Layer"][i]
@@ -140,9 +188,10 @@ for i in range(len(layers_list)):
     min_zoom = int(TileMatrixSetLimits[0]["TileMatrix"])
     max_zoom = int(TileMatrixSetLimits[-1]["TileMatrix"])
 
-    # Tile format
+    # Tile format, vector tiles (application/x-protobuf) are kept and can be
+    # identified by TileProvider.tile_format(), elevation grids are skipped
     output_format = layer.get("Format") # image/png...
-    if output_format == "application/x-protobuf" or output_format == "image/x-bil;bits=32":
+    if output_format == "image/x-bil;bits=32":
         continue
 
     # Layer extent
@@ -179,6 +228,13 @@ for i in range(len(layers_list)):
         "apikey": "your_api_key_here",
     }
 
+    crs, matrices = parse_tile_matrix_set(tile_matrix_sets[TileMatrixSet])
+    if crs not in ("EPSG:3857", "EPSG:900913"):
+        leaflet["GeoportailFrance"][name]["crs"] = crs
+        leaflet["GeoportailFrance"][name]["tile_matrices"] = [
+            m for m in matrices if min_zoom <= m[0] <= max_zoom
+        ]
+
     # Handle broken providers
     possibly_broken_providers = [
         "Ocsge_Constructions_2002",
@@ -201,5 +257,23 @@ for i in range(len(layers_list)):
     if name in possibly_broken_providers:
         leaflet["GeoportailFrance"][name]["status"] = "broken"
 
+# Probe all providers concurrently and mark those persistently not serving tiles
+# (HTTP 404, 410 or 5xx after retries) as broken. Timeouts and rate limiting of a
+# single CI run never mark a provider as broken.
+
+flat = {}
+for bunch in leaflet.values():
+    for provider in [bunch] if "url" in bunch else bunch.values():
+        flat[provider["name"]] = provider
+
+results = probe_providers(_from_dict(leaflet), retries=2, retry_delay=60)
+for name, result in results.items():
+    if result in BROKEN:
+        flat[name]["status"] = "broken"
+print(
+    "Probed providers: "
+    + ", ".join(f"{r}: {list(results.values()).count(r)}" for r in set(results.values()))
+)
+
 with open("../xyzservices/data/providers.json", "w") as f:
     json.dump(leaflet, f, indent=4)
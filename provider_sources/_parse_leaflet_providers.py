@@ -7,20 +7,28 @@ https://github.com/geopandas/contextily/blob/e0bb25741f9448c5b6b0e54d403b0d03d92
 
 Script to parse the tile providers defined by the leaflet-providers.js
 extension to Leaflet (https://github.com/leaflet-extras/leaflet-providers).
-It accesses the defined TileLayer.Providers objects through javascript
-using Selenium as JSON, and then processes this a fully specified
-javascript-independent dictionary and saves that final result as a JSON file.
+It statically parses the ``L.TileLayer.Provider.providers`` object literal from
+leaflet-providers.js (no browser or javascript engine is needed), and then processes
+this a fully specified javascript-independent dictionary and saves that final result
+as a JSON file.
+
+Usage::
+
+    python _parse_leaflet_providers.py [path/to/leaflet-providers]
+
+With a path to a local checkout of leaflet-providers, the script runs offline.
+Otherwise the repository is cloned into a temporary directory.
 """
 
 import datetime
+import functools
 import json
 import os
+import re
+import subprocess
+import sys
 import tempfile
 
-import git
-import html2text
-import selenium.webdriver
-
 GIT_URL = "https://github.com/leaflet-extras/leaflet-providers.git"
 
 
@@ -28,28 +36,176 @@ GIT_URL = "https://github.com/leaflet-extras/leaflet-providers.git"
 # Downloading and processing the json data
 
 
-def get_json_data():
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        repo = git.Repo.clone_from(GIT_URL, tmpdirname)
-        commit_hexsha = repo.head.object.hexsha
-        commit_message = repo.head.object.message
+def get_json_data(path=None):
+    if path is None:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            subprocess.run(
+                ["git", "clone", "--depth", "1", GIT_URL, tmpdirname], check=True
+            )
+            return get_json_data(tmpdirname)
 
-        index_path = "file://" + os.path.join(tmpdirname, "index.html")
+    with open(os.path.join(path, "leaflet-providers.js"), encoding="utf-8") as f:
+        data = parse_providers(f.read())
 
-        opts = selenium.webdriver.FirefoxOptions()
-        opts.add_argument("--headless")
+    commit = subprocess.run(
+        ["git", "-C", path, "log", "-1", "--format=%H (%s)"],
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    description = f"commit {commit}" if commit else "local copy"
 
-        driver = selenium.webdriver.Firefox(options=opts)
-        driver.get(index_path)
-        data = driver.execute_script(
-            "return JSON.stringify(L.TileLayer.Provider.providers)"
-        )
-        driver.close()
+    return data, description
 
-    data = json.loads(data)
-    description = f"commit {commit_hexsha} ({commit_message.strip()})"
 
-    return data, description
+# -----------------------------------------------------------------------------
+# Static parsing of the javascript object literal
+
+
+_PROVIDERS = re.compile(r"L\.TileLayer\.Provider\.providers\s*=\s*")
+_TOKEN = re.compile(
+    r"""
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<name>[A-Za-z_$][\w$]*)
+    |(?P<punct>[{}\[\]():,+.])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "b": "\b",
+    "f": "\f",
+    "v": "\v",
+    "0": "\0",
+    "\n": "",
+}
+_CONSTANTS = {"true": True, "false": False, "null": None}
+_UNDEFINED = object()
+
+
+def parse_providers(source):
+    """Return the ``L.TileLayer.Provider.providers`` object of leaflet-providers.js.
+
+    The result matches ``JSON.parse(JSON.stringify(L.TileLayer.Provider.providers))``
+    evaluated in a browser. Only literals (objects, arrays, strings joined with
+    ``+``, numbers, booleans, null and undefined) are supported, anything else raises
+    ValueError pointing at its position. The only exception is
+    ``new Date().getFullYear()`` (used in attributions), which is replaced by the
+    current year.
+    """
+    match = _PROVIDERS.search(source)
+    if match is None:
+        raise ValueError("L.TileLayer.Provider.providers not found.")
+    try:
+        return _parse_value(_tokenize(source, match.end()))
+    except StopIteration:
+        raise ValueError("Unexpected end of leaflet-providers.js.") from None
+
+
+def _tokenize(source, pos):
+    while pos < len(source):
+        match = _TOKEN.match(source, pos)
+        if match is None:
+            raise ValueError(f"Unexpected character {source[pos]!r} at {pos}.")
+        if match.lastgroup != "space":
+            yield match.lastgroup, match.group(), pos
+        pos = match.end()
+
+
+def _expect(tokens, text):
+    kind, value, pos = next(tokens)
+    if value != text:
+        raise ValueError(f"Expected {text!r} at {pos}, got {value!r}.")
+
+
+def _parse_value(tokens, token=None):
+    kind, value, pos = token or next(tokens)
+    if value == "{":
+        return _parse_object(tokens)
+    if value == "[":
+        return _parse_array(tokens)
+    if kind == "string":
+        return _unquote(value)
+    if kind == "number":
+        number = float(value)
+        return int(number) if number.is_integer() and "." not in value else number
+    if kind == "name" and value in _CONSTANTS:
+        return _CONSTANTS[value]
+    if kind == "name" and value == "undefined":
+        return _UNDEFINED
+    if kind == "name" and value == "new":
+        for text in ("Date", "(", ")", ".", "getFullYear", "(", ")"):
+            _expect(tokens, text)
+        return datetime.date.today().year
+    raise ValueError(f"Unsupported expression {value!r} at {pos}.")
+
+
+def _parse_object(tokens):
+    result = {}
+    token = next(tokens)
+    while token[1] != "}":
+        kind, key, pos = token
+        if kind == "string":
+            key = _unquote(key)
+        elif kind not in ("name", "number"):
+            raise ValueError(f"Unexpected {key!r} at {pos}.")
+        _expect(tokens, ":")
+        value, token = _parse_expression(tokens)
+        if value is not _UNDEFINED:  # dropped by JSON.stringify
+            result[key] = value
+        if token[1] == ",":
+            token = next(tokens)
+        elif token[1] != "}":
+            raise ValueError(f"Expected ',' or '}}' at {token[2]}, got {token[1]!r}.")
+    return result
+
+
+def _parse_array(tokens):
+    result = []
+    token = next(tokens)
+    while token[1] != "]":
+        value, token = _parse_expression(tokens, token)
+        result.append(None if value is _UNDEFINED else value)
+        if token[1] == ",":
+            token = next(tokens)
+        elif token[1] != "]":
+            raise ValueError(f"Expected ',' or ']' at {token[2]}, got {token[1]!r}.")
+    return result
+
+
+def _parse_expression(tokens, token=None):
+    """Parse a value optionally followed by ``+`` concatenations.
+
+    Returns the value and the token following it.
+    """
+    value = _parse_value(tokens, token)
+    token = next(tokens)
+    while token[1] == "+":
+        other = _parse_value(tokens)
+        if isinstance(value, str) and type(other) in (str, int):
+            value += str(other)
+        elif type(value) is int and isinstance(other, str):
+            value = str(value) + other
+        else:
+            raise ValueError(f"Only strings can be concatenated, at {token[2]}.")
+        token = next(tokens)
+    return value, token
+
+
+def _unquote(literal):
+    body = literal[1:-1]
+    return re.sub(
+        r"\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|[\s\S])",
+        lambda m: (
+            chr(int(m.group(1)[1:], 16))
+            if m.group(1)[0] in "ux" and len(m.group(1)) > 1
+            else _ESCAPES.get(m.group(1), m.group(1))
+        ),
+        body,
+    )
 
 
 def process_data(data):
@@ -95,6 +251,25 @@ def process_provider(data, name="OpenStreetMap"):
     return result
 
 
+@functools.lru_cache(maxsize=None)
+def _converter():
+    import html2text
+
+    converter = html2text.HTML2Text(bodywidth=1000)
+    converter.ignore_links = True
+    return converter
+
+
+@functools.lru_cache(maxsize=None)
+def html_to_text(html):
+    """Convert html attribution to plain text.
+
+    A single converter is shared by all attributions and the results are memoized,
+    as most variants repeat the attribution of their provider.
+    """
+    return _converter().handle(html).strip()
+
+
 def pythonize_data(data):
     """
     Clean-up the javascript based dictionary:
@@ -121,9 +296,7 @@ def pythonize_data(data):
                     raise ValueError(f"Attribution not known: {value}")
             new_data.append(("html_attribution", value))
             # convert html text to plain text
-            converter = html2text.HTML2Text(bodywidth=1000)
-            converter.ignore_links = True
-            value = converter.handle(value).strip()
+            value = html_to_text(value)
         elif key in rename_keys:
             key = rename_keys[key]
         elif key == "url" and any(k in value for k in rename_keys):
@@ -136,7 +309,7 @@ def pythonize_data(data):
 
 
 if __name__ == "__main__":
-    data, description = get_json_data()
+    data, description = get_json_data(sys.argv[1] if len(sys.argv) > 1 else None)
     with open("./leaflet-providers-raw.json", "w") as f:
         json.dump(data, f)
 
@@ -1,8 +1,21 @@
-from .lib import Bunch, TileProvider  # noqa
-from .providers import providers  # noqa
+from .lib import Bunch, TileProvider, use_credentials  # noqa
+from .providers import register_catalog  # noqa
 
 from importlib.metadata import version, PackageNotFoundError
 import contextlib
 
 with contextlib.suppress(PackageNotFoundError):
     __version__ = version("xyzservices")
+
+# ``xyzservices.providers`` is the catalog rather than the submodule, loaded on first
+# access by __getattr__ below
+del globals()["providers"]
+
+
+def __getattr__(name):
+    if name == "providers":
+        from .providers import providers
+
+        globals()["providers"] = providers
+        return providers
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,79 @@
+"""
+Command line interface of xyzservices
+
+Usage: ``python -m xyzservices serve --port 8080 --cache-dir tile_cache``
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m xyzservices")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser(
+        "serve",
+        help="run a local caching tile proxy",
+        description="Serve tiles of all providers under /{provider}/{z}/{x}/{y}.",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument(
+        "--cache-dir", help="directory of the disk cache (default: memory only)"
+    )
+    serve_parser.add_argument(
+        "--max-items", type=int, default=4096, help="tiles kept in memory"
+    )
+    serve_parser.add_argument(
+        "--timeout", type=float, default=30, help="upstream timeout in seconds"
+    )
+    serve_parser.add_argument(
+        "--token",
+        action="append",
+        default=[],
+        metavar="NAME:KEY=VALUE",
+        help="attribute filled into a provider or a group of providers, "
+        "e.g. Thunderforest:apikey=...; can be repeated",
+    )
+
+    args = parser.parse_args(argv)
+    try:
+        tokens = _parse_tokens(args.token)
+    except ValueError as err:
+        parser.error(str(err))
+
+    from .server import serve
+
+    print(
+        f"Serving tiles on http://{args.host}:{args.port}/{{provider}}/{{z}}/{{x}}/{{y}}"
+    )
+    with contextlib.suppress(KeyboardInterrupt):
+        serve(
+            host=args.host,
+            port=args.port,
+            cache_dir=args.cache_dir,
+            max_items=args.max_items,
+            tokens=tokens,
+            timeout=args.timeout,
+        )
+
+
+def _parse_tokens(values: list[str]) -> dict:
+    tokens = {}
+    for value in values:
+        name, _, assignment = value.partition(":")
+        key, _, token = assignment.partition("=")
+        if not name or not key or not token:
+            raise ValueError(
+                f"Invalid token '{value}'. Use the form NAME:KEY=VALUE, "
+                "e.g. Thunderforest:apikey=..."
+            )
+        tokens.setdefault(name, {})[key] = token
+    return tokens
+
+
+if __name__ == "__main__":
+    main()
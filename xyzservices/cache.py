@@ -0,0 +1,848 @@
+"""
+Caching, prefetching and zoom synthesis of tiles
+"""
+
+from __future__ import annotations
+
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+from array import array
+from io import BytesIO
+from urllib.parse import quote
+
+from .lib import (
+    VECTOR_FORMATS,
+    TileProvider,
+    _context_credentials,
+    _format_time,
+    _submit,
+)
+from .tiles import fetch_tile
+
+
+class TileCache:
+    """
+    Cache of tile contents in memory and optionally on disk
+
+    The most recently used tiles are kept in memory. If ``directory`` is given, all
+    tiles are also stored on disk as ``{directory}/{provider}/{z}/{x}/{y}{r}`` and
+    survive the process.
+
+    Tiles are identified by keys of ``(provider name, z, x, y, scale factor)``. For
+    providers with the ``{time}`` placeholder in the URL, the name is followed by
+    ``@`` and the time (e.g. ``"NASAGIBS.ModisTerraTrueColorCR@2024-06-01"``), so
+    tiles of different times never mix. Tiles fetched with credentials of
+    :func:`~xyzservices.use_credentials` filling the URL have the name followed by
+    ``#`` and a digest of those credentials, so tiles (and errors shared by
+    :class:`SingleFlight`) of different tenants never mix either.
+
+    Parameters
+    ----------
+    directory : str (optional)
+        Directory to store the tiles in. If None, tiles are cached only in memory.
+    max_items : int (optional, default 1024)
+        Maximum number of tiles kept in memory
+
+    Examples
+    --------
+    >>> from xyzservices.cache import TileCache
+    >>> cache = TileCache("tile_cache", max_items=4096)
+    >>> cache.put(("OpenStreetMap.Mapnik", 0, 0, 0, ""), png)
+    >>> cache.get(("OpenStreetMap.Mapnik", 0, 0, 0, ""))
+    """
+
+    def __init__(self, directory: str | None = None, max_items: int = 1024):
+        self.directory = directory
+        self.max_items = max_items
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        """Return the cached tile or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, key: tuple, data: bytes) -> None:
+        """Store the tile."""
+        self._remember(key, data)
+        if self.directory is not None:
+            path = self.path(key)
+            with contextlib.suppress(OSError):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self.directory is not None and os.path.exists(self.path(key))
+
+    def path(self, key: tuple) -> str:
+        """Return the path of the tile on disk."""
+        name, z, x, y, r = key
+        return os.path.join(
+            self.directory,
+            quote(name, safe=""),
+            str(z),
+            str(x),
+            f"{y}{quote(r, safe='@')}",
+        )
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+
+class NegativeCache:
+    """
+    Compact record of tiles known to be missing or empty
+
+    Regional providers answer ``404 Not Found`` or serve the same blank tile for
+    large parts of the world. Such tiles are remembered here, so they are not
+    requested again after being evicted from a :class:`TileCache`:
+
+    - tiles the server answered with ``404`` or ``410`` are *missing*,
+    - tiles whose content is byte-identical to that of at least ``threshold``
+      other tiles of the provider (and not larger than ``max_size``) are *empty*.
+      Only a single copy of the content is kept per provider.
+
+    Tiles are stored as ranges of consecutive tile numbers (row by row) per
+    provider and zoom level, so millions of neighbouring tiles take a few
+    kilobytes. All tiles of a zoom level of a provider are forgotten ``ttl``
+    seconds after the first of them was recorded.
+
+    Tiles are identified by the same keys as in :class:`TileCache`. Tiles outside
+    of the XYZ grid of their zoom level (e.g. ``x >= 2 ** z``) are not recorded.
+
+    Parameters
+    ----------
+    ttl : float (optional, default 3600)
+        Number of seconds the tiles are remembered for
+    threshold : int (optional, default 4)
+        Number of tiles with identical content that make it *empty*
+    max_size : int (optional, default 2048)
+        Maximum size in bytes of *empty* tiles
+
+    Examples
+    --------
+    >>> from xyzservices.cache import NegativeCache, TileCache, TileFetcher
+    >>> fetcher = TileFetcher(TileCache(), negative=NegativeCache(ttl=86400))
+    """
+
+    def __init__(self, ttl: float = 3600, threshold: int = 4, max_size: int = 2048):
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_size = max_size
+        # (name, scale factor, z) -> (expiry, {content or None: range set})
+        self._zooms = {}
+        # name -> {content: number of tiles}, content becomes empty at threshold
+        self._counts = collections.defaultdict(dict)
+        self._empty = collections.defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def add_missing(self, key: tuple) -> None:
+        """Record a tile the server does not have."""
+        index = _index(key)
+        if index is None:
+            return
+        with self._lock:
+            self._ranges(key, None).add(index)
+
+    def add(self, key: tuple, data: bytes) -> bool:
+        """
+        Record the content of a fetched tile
+
+        Returns
+        -------
+        bool
+            True if the tile is *empty* and does not need to be cached elsewhere
+        """
+        index = _index(key)
+        if index is None or len(data) > self.max_size:
+            return False
+        with self._lock:
+            known = self._empty[key[0]]
+            # a single copy of the content is kept for all its tiles
+            content = known.get(data)
+            if content is None:
+                counts = self._counts[key[0]]
+                count = counts.pop(data, 0) + 1
+                if count < self.threshold:
+                    if len(counts) >= 256:  # mostly unique small tiles, start over
+                        counts.clear()
+                    counts[data] = count
+                    return False
+                content = known[data] = data
+            self._ranges(key, content).add(index)
+        return True
+
+    def missing(self, key: tuple) -> bool:
+        """Return True if the tile is known to be missing."""
+        index = _index(key)
+        if index is None:
+            return False
+        with self._lock:
+            ranges = self._lookup(key)
+            return ranges is not None and index in ranges.get(None, ())
+
+    def empty(self, key: tuple) -> bytes | None:
+        """Return the content of a tile known to be empty or None."""
+        index = _index(key)
+        if index is None:
+            return None
+        with self._lock:
+            ranges = self._lookup(key)
+            if ranges is not None:
+                for content, tiles in ranges.items():
+                    if content is not None and index in tiles:
+                        return content
+        return None
+
+    def __contains__(self, key: tuple) -> bool:
+        return self.missing(key) or self.empty(key) is not None
+
+    def clear(self) -> None:
+        """Forget all tiles."""
+        with self._lock:
+            self._zooms.clear()
+            self._counts.clear()
+            self._empty.clear()
+
+    def _lookup(self, key):
+        name, z, _, _, r = key
+        zoom = self._zooms.get((name, r, z))
+        if zoom is None:
+            return None
+        if zoom[0] <= time.monotonic():
+            del self._zooms[(name, r, z)]
+            return None
+        return zoom[1]
+
+    def _ranges(self, key, content):
+        ranges = self._lookup(key)
+        if ranges is None:
+            name, z, _, _, r = key
+            ranges = {}
+            self._zooms[(name, r, z)] = (time.monotonic() + self.ttl, ranges)
+        tiles = ranges.get(content)
+        if tiles is None:
+            tiles = ranges[content] = _RangeSet()
+        return tiles
+
+
+# the row-major number of a tile has to fit the 64 bits of the range sets
+_MAX_ZOOM = 32
+
+
+class _RangeSet:
+    """Set of integers stored as sorted disjoint ranges ``[start, end)``."""
+
+    def __init__(self):
+        self._starts = array("Q")
+        self._ends = array("Q")
+
+    def add(self, value):
+        starts, ends = self._starts, self._ends
+        i = bisect.bisect_right(starts, value)
+        if i and ends[i - 1] > value:
+            return
+        if i and ends[i - 1] == value:
+            ends[i - 1] = value + 1
+            if i < len(starts) and starts[i] == value + 1:  # bridges two ranges
+                ends[i - 1] = ends[i]
+                del starts[i], ends[i]
+        elif i < len(starts) and starts[i] == value + 1:
+            starts[i] = value
+        else:
+            starts.insert(i, value)
+            ends.insert(i, value + 1)
+
+    def __contains__(self, value):
+        i = bisect.bisect_right(self._starts, value)
+        return i > 0 and self._ends[i - 1] > value
+
+    def __len__(self):
+        return len(self._starts)
+
+
+def _tile_key(provider, x, y, z, scale_factor, kwargs):
+    """Return the cache key of a tile.
+
+    The key includes the time and the credentials of the context if the URL depends
+    on them.
+    """
+    name = provider.name
+    url = provider["url"]
+    if "{time}" in url:
+        timestamp = kwargs.get("time", provider.get("time"))
+        if timestamp:
+            name = f"{name}@{_format_time(timestamp)}"
+    credentials = _context_credentials(provider)
+    if credentials:
+        used = sorted(
+            (key, str(kwargs.get(key, value)))
+            for key, value in credentials.items()
+            if f"{{{key}}}" in url
+        )
+        if used:
+            digest = hashlib.sha256(repr(used).encode()).hexdigest()[:16]
+            name = f"{name}#{digest}"
+    return (name, z, x, y, scale_factor or "")
+
+
+def _valid_tile(x: int, y: int, z: int) -> bool:
+    """Return True if ``x``, ``y`` and ``z`` are numbers of a tile of the XYZ grid."""
+    return 0 <= z <= _MAX_ZOOM and 0 <= x < 1 << z and 0 <= y < 1 << z
+
+
+def _index(key):
+    """Row-major number of the tile within its zoom level, None for invalid tiles."""
+    _, z, x, y, _ = key
+    if not _valid_tile(x, y, z):
+        return None
+    return (y << z) + x
+
+
+class SingleFlight:
+    """
+    Share a single call among concurrent callers asking for the same key
+
+    The first caller of :meth:`do` for a key runs the function. Callers arriving
+    while it is still running wait for it and receive the same result (or
+    exception) instead of running the function again.
+
+    Examples
+    --------
+    >>> from xyzservices.cache import SingleFlight
+    >>> flights = SingleFlight()
+    >>> flights.do(("OpenStreetMap.Mapnik", 0, 0, 0, ""), fetch_tile, provider, 0, 0, 0)
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """Return ``function(*args, **kwargs)``, called once per concurrent key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = concurrent.futures.Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as err:
+            call.set_exception(err)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class TileFetcher:
+    """
+    Fetch tiles through a :class:`TileCache`
+
+    Concurrent requests for the same tile share a single upstream request.
+
+    Parameters
+    ----------
+    cache : TileCache (optional)
+        Cache of tiles. If None, a new in-memory :class:`TileCache` is created.
+    timeout : float (optional, default 30)
+        Timeout of a single request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+    negative : NegativeCache (optional)
+        Record of missing and empty tiles. Missing tiles raise
+        :class:`urllib.error.HTTPError` and empty tiles are returned without any
+        request. Empty tiles are not stored in ``cache``.
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.cache import TileCache, TileFetcher
+    >>> fetcher = TileFetcher(TileCache("tile_cache"))
+    >>> png = fetcher.fetch(xyz.OpenStreetMap.Mapnik, x=0, y=0, z=0)
+    """
+
+    def __init__(
+        self,
+        cache: TileCache | None = None,
+        timeout: float = 30,
+        headers: dict | None = None,
+        negative: NegativeCache | None = None,
+    ):
+        self.cache = TileCache() if cache is None else cache
+        self.timeout = timeout
+        self.headers = headers
+        self.negative = negative
+        self._flights = SingleFlight()
+
+    def fetch(
+        self,
+        provider: TileProvider,
+        x: int,
+        y: int,
+        z: int,
+        scale_factor: str | None = None,
+        **kwargs,
+    ) -> bytes:
+        """
+        Return the tile from the cache or fetch and cache it
+
+        Parameters
+        ----------
+        provider : TileProvider
+            provider of tiles
+        x, y, z : int
+            tile number
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`TileProvider.build_url`.
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider` (e.g. API
+            keys). Apart from ``time``, they are not part of the cache key.
+
+        Returns
+        -------
+        bytes
+            Content of the tile
+        """
+        key = _tile_key(provider, x, y, z, scale_factor, kwargs)
+        data = self.cache.get(key)
+        if data is None and self.negative is not None:
+            if self.negative.missing(key):
+                url = provider.build_url(
+                    x=x, y=y, z=z, scale_factor=scale_factor, **kwargs
+                )
+                raise urllib.error.HTTPError(url, 404, "Not Found", None, None)
+            data = self.negative.empty(key)
+        if data is None:
+            data = self._flights.do(
+                key, self._fetch, key, provider, x, y, z, scale_factor, kwargs
+            )
+        return data
+
+    def _fetch(self, key, provider, x, y, z, scale_factor, kwargs):
+        # another flight may have finished between the cache lookup and this one
+        data = self.cache.get(key)
+        if data is None:
+            try:
+                data = fetch_tile(
+                    provider,
+                    x,
+                    y,
+                    z,
+                    scale_factor=scale_factor,
+                    timeout=self.timeout,
+                    headers=self.headers,
+                    **kwargs,
+                )
+            except urllib.error.HTTPError as err:
+                if self.negative is not None and err.code in (404, 410):
+                    self.negative.add_missing(key)
+                raise
+            if self.negative is None or not self.negative.add(key, data):
+                self.cache.put(key, data)
+        return data
+
+
+class ZoomResolver:
+    """
+    Serve tiles beyond the zoom range of a provider from other zoom levels
+
+    Tiles deeper than ``max_zoom`` of the provider are cut out of their ancestor at
+    ``max_zoom`` and upscaled. The ancestor goes through the :class:`TileFetcher`
+    and its cache, so it is fetched only once for all its descendants. Tiles above
+    ``min_zoom`` are assembled from their descendants at ``min_zoom`` and
+    downsampled, if there are at most ``4 ** max_levels`` of them. Synthesised
+    tiles are stored in the cache as well. Tiles within the zoom range are passed
+    to the :class:`TileFetcher` unchanged.
+
+    Requires ``Pillow``.
+
+    Parameters
+    ----------
+    fetcher : TileFetcher (optional)
+        Fetcher of the original tiles. If None, a new :class:`TileFetcher` with an
+        in-memory cache is created.
+    max_levels : int (optional, default 2)
+        Maximum number of zoom levels below ``min_zoom`` to assemble tiles from
+    max_workers : int (optional, default 8)
+        Number of threads fetching the descendants of a tile above ``min_zoom``
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.cache import ZoomResolver
+    >>> resolver = ZoomResolver()
+    >>> xyz.OpenTopoMap.max_zoom
+    17
+    >>> png = resolver.fetch(xyz.OpenTopoMap, x=140000, y=90000, z=19)
+    """
+
+    def __init__(
+        self,
+        fetcher: TileFetcher | None = None,
+        max_levels: int = 2,
+        max_workers: int = 8,
+    ):
+        self.fetcher = TileFetcher() if fetcher is None else fetcher
+        self.max_levels = max_levels
+        self.max_workers = max_workers
+        self._flights = SingleFlight()
+
+    def fetch(
+        self,
+        provider: TileProvider,
+        x: int,
+        y: int,
+        z: int,
+        scale_factor: str | None = None,
+        **kwargs,
+    ) -> bytes:
+        """
+        Return the tile, synthesised from other zoom levels if needed
+
+        Parameters
+        ----------
+        provider : TileProvider
+            provider of tiles
+        x, y, z : int
+            tile number
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`TileProvider.build_url`.
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider`.
+
+        Returns
+        -------
+        bytes
+            Content of the tile
+
+        Raises
+        ------
+        ValueError
+            If the tile is too far above ``min_zoom`` or the provider serves vector
+            tiles
+        """
+        min_zoom = provider.get("min_zoom", 0)
+        max_zoom = provider.get("max_zoom")
+        if min_zoom <= z and (max_zoom is None or z <= max_zoom):
+            return self.fetcher.fetch(
+                provider, x, y, z, scale_factor=scale_factor, **kwargs
+            )
+
+        if provider.tile_format() in VECTOR_FORMATS:
+            raise ValueError("Vector tiles cannot be resampled to other zoom levels.")
+        if z < min_zoom and min_zoom - z > self.max_levels:
+            raise ValueError(
+                f"Zoom {z} is {min_zoom - z} levels above the minimum zoom "
+                f"{min_zoom} of the provider, at most {self.max_levels} are supported."
+            )
+
+        key = _tile_key(provider, x, y, z, scale_factor, kwargs)
+        data = self.fetcher.cache.get(key)
+        if data is None:
+            data = self._flights.do(
+                key, self._synthesise, key, provider, scale_factor, kwargs
+            )
+        return data
+
+    def _synthesise(self, key, provider, scale_factor, kwargs):
+        try:
+            from PIL import Image
+        except ImportError as err:
+            raise ImportError(
+                "Tiles outside of the zoom range of a provider require Pillow."
+            ) from err
+
+        _, z, x, y, _ = key
+        min_zoom = provider.get("min_zoom", 0)
+        max_zoom = provider.get("max_zoom")
+
+        def _open(tile_x, tile_y, tile_z):
+            data = self.fetcher.fetch(
+                provider, tile_x, tile_y, tile_z, scale_factor=scale_factor, **kwargs
+            )
+            with Image.open(BytesIO(data)) as image:
+                fmt = image.format
+                # palette images cannot be interpolated
+                image = image.convert("RGBA" if image.mode in ("P", "LA") else None)
+            return image, fmt
+
+        if z < min_zoom:
+            levels = min_zoom - z
+            n = 1 << levels
+            children = [
+                (i, j, (x << levels) + i, (y << levels) + j)
+                for j in range(n)
+                for i in range(n)
+            ]
+            with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+                futures = [
+                    _submit(executor, _open, c[2], c[3], min_zoom) for c in children
+                ]
+                images = [future.result() for future in futures]
+            (first, fmt), (width, height) = images[0], images[0][0].size
+            canvas = Image.new(first.mode, (width * n, height * n))
+            for (i, j, _, _), (image, _) in zip(children, images):
+                canvas.paste(image, (i * width, j * height))
+            image = canvas.resize((width, height), Image.LANCZOS)
+        else:
+            levels = z - max_zoom
+            n = 1 << levels
+            ancestor, fmt = _open(x >> levels, y >> levels, max_zoom)
+            width, height = ancestor.size
+            i, j = x % n, y % n
+            box = (
+                i * width / n,
+                j * height / n,
+                (i + 1) * width / n,
+                (j + 1) * height / n,
+            )
+            image = ancestor.resize((width, height), Image.BILINEAR, box=box)
+
+        buffer = BytesIO()
+        if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format=fmt or "PNG")
+        data = buffer.getvalue()
+        self.fetcher.cache.put(key, data)
+        return data
+
+
+class Prefetcher:
+    """
+    Speculatively warm the cache with tiles a map viewer is likely to request next
+
+    Demand requests of each session (e.g. a single map view in a browser) are passed
+    through :meth:`fetch`. Based on the recent requests of the session, the
+    prefetcher predicts the next ones:
+
+    - when panning, the tiles further in the direction of the movement,
+    - when zooming in, the children of the requested tile,
+    - when zooming out or with no movement, the parent of the requested tile.
+
+    The predicted tiles are fetched into the cache by background threads, but only
+    while no demand request is in progress, so prefetching never competes with
+    tiles that are actually needed. Each session can have at most ``budget``
+    predicted tiles waiting; older predictions are dropped in favour of newer ones.
+    Only the ``max_sessions`` most recently active sessions are tracked, so
+    sessions that are never :meth:`forget`-ed do not accumulate.
+
+    Parameters
+    ----------
+    fetcher : TileFetcher
+        Fetcher used for both demand and prefetched tiles
+    budget : int (optional, default 16)
+        Maximum number of predicted tiles waiting per session
+    max_workers : int (optional, default 2)
+        Number of background threads fetching predicted tiles
+    max_sessions : int (optional, default 1024)
+        Maximum number of sessions tracked. The history and predictions of the
+        least recently active sessions are dropped beyond it.
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.cache import Prefetcher, TileFetcher
+    >>> prefetcher = Prefetcher(TileFetcher(), budget=8)
+    >>> png = prefetcher.fetch("session-id", xyz.OpenStreetMap.Mapnik, 4, 5, 4)
+    """
+
+    def __init__(
+        self,
+        fetcher: TileFetcher,
+        budget: int = 16,
+        max_workers: int = 2,
+        max_sessions: int = 1024,
+    ):
+        self.fetcher = fetcher
+        self.budget = budget
+        self.max_sessions = max_sessions
+        self.prefetched = 0
+        self._history = collections.OrderedDict()
+        self._pending = collections.OrderedDict()
+        self._demand = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def fetch(
+        self,
+        session,
+        provider: TileProvider,
+        x: int,
+        y: int,
+        z: int,
+        scale_factor: str | None = None,
+        **kwargs,
+    ) -> bytes:
+        """
+        Fetch the tile on demand and schedule prefetching of the predicted ones
+
+        Parameters
+        ----------
+        session : hashable
+            Identifier of the session (map view) the request belongs to
+        provider : TileProvider
+            provider of tiles
+        x, y, z : int
+            tile number
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`TileProvider.build_url`.
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider`.
+
+        Returns
+        -------
+        bytes
+            Content of the tile
+        """
+        with self._condition:
+            self._demand += 1
+        try:
+            data = self.fetcher.fetch(
+                provider, x, y, z, scale_factor=scale_factor, **kwargs
+            )
+        finally:
+            with self._condition:
+                self._demand -= 1
+                self._schedule(session, provider, x, y, z, scale_factor, kwargs)
+                self._condition.notify_all()
+        return data
+
+    def forget(self, session) -> None:
+        """Drop the history and pending predictions of a finished session."""
+        with self._condition:
+            self._history.pop(session, None)
+            self._pending.pop(session, None)
+
+    def close(self) -> None:
+        """Stop the background threads."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _schedule(self, session, provider, x, y, z, scale_factor, kwargs):
+        previous = self._history.pop(session, None)
+        self._history[session] = (x, y, z)
+        while len(self._history) > self.max_sessions:
+            stale, _ = self._history.popitem(last=False)
+            self._pending.pop(stale, None)
+
+        if previous is not None and previous[2] == z:
+            dx = (x > previous[0]) - (x < previous[0])
+            dy = (y > previous[1]) - (y < previous[1])
+            if dx or dy:
+                predicted = [(x + dx, y + dy, z), (x + 2 * dx, y + 2 * dy, z)]
+            else:
+                predicted = [(x // 2, y // 2, z - 1)]
+        elif previous is not None and z > previous[2]:
+            predicted = [
+                (2 * x + i, 2 * y + j, z + 1) for j in range(2) for i in range(2)
+            ]
+        else:
+            predicted = [(x // 2, y // 2, z - 1)]
+
+        min_zoom = provider.get("min_zoom", 0)
+        max_zoom = provider.get("max_zoom", float("inf"))
+        queue = self._pending.get(session)
+        if queue is None:
+            queue = self._pending[session] = collections.deque(maxlen=self.budget)
+        for px, py, pz in predicted:
+            if min_zoom <= pz <= max_zoom and 0 <= px < 1 << pz and 0 <= py < 1 << pz:
+                # prefetched in the context (credentials) of the demand request
+                context = contextvars.copy_context()
+                queue.append((provider, px, py, pz, scale_factor, kwargs, context))
+        if not queue:
+            del self._pending[session]
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._closed and (self._demand or not self._pending):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # round-robin across sessions, newest prediction first
+                session, queue = next(iter(self._pending.items()))
+                provider, x, y, z, scale_factor, kwargs, context = queue.pop()
+                if queue:
+                    self._pending.move_to_end(session)
+                else:
+                    del self._pending[session]
+
+            key = context.run(_tile_key, provider, x, y, z, scale_factor, kwargs)
+            if key in self.fetcher.cache:
+                continue
+            try:
+                context.run(
+                    self.fetcher.fetch,
+                    provider,
+                    x,
+                    y,
+                    z,
+                    scale_factor=scale_factor,
+                    **kwargs,
+                )
+            except Exception:  # noqa: BLE001, S112 - prefetching is best effort
+                continue
+            with self._condition:
+                self.prefetched += 1
@@ -4,14 +4,81 @@ Utilities to support XYZservices
 
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import datetime
+import itertools
 import json
+import math
+import random
+import string
+import urllib.parse
 import urllib.request
 import uuid
-from typing import Callable
+from typing import IO, Callable, Iterable
 from urllib.parse import quote
 
 QUERY_NAME_TRANSLATION = str.maketrans({x: "" for x in "., -_/"})
 
+# accepted values of ``fill_subdomain`` in TileProvider.build_url
+SUBDOMAIN_STRATEGIES = (True, False, None, "first", "round_robin", "hash", "random")
+
+# URL placeholders filled per tile rather than from TileProvider attributes
+TILE_PLACEHOLDERS = ("x", "y", "z", "s", "q", "-y")
+
+_FORMATTER = string.Formatter()
+
+# hexadecimal digit of a Morton code mapped to the two quadkey digits it encodes
+_HEX_QUADS = {f"{i:x}": f"{i >> 2}{i & 3}" for i in range(16)}
+
+# latitude limit of the Web Mercator (EPSG:3857) tile grid
+MAX_LATITUDE = 85.0511287798066
+# tolerance (in tiles) for coordinates lying on tile edges
+_TILE_EPSILON = 1e-9
+# CRS and prefixes of the names of WMTS tile matrix sets of the Web Mercator grid
+_WEB_MERCATOR_CRS = ("EPSG:3857", "EPSG:900913")
+_WEB_MERCATOR_MATRIX_SETS = ("PM", "GoogleMapsCompatible", "WebMercatorQuad")
+
+# MIME types of vector tiles (Mapbox Vector Tiles encoded as protobuf)
+VECTOR_FORMATS = ("application/vnd.mapbox-vector-tile", "application/x-protobuf")
+
+# file extensions in tile URLs mapped to the MIME type of the tiles
+_EXTENSION_FORMATS = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+    ".pbf": "application/x-protobuf",
+    ".mvt": "application/vnd.mapbox-vector-tile",
+}
+
+# TileProvider attributes renamed when exported as Leaflet TileLayer options
+LEAFLET_OPTIONS = {"max_zoom": "maxZoom", "min_zoom": "minZoom"}
+LEAFLET_EXCLUDED_KEYS = {
+    "url",
+    "name",
+    "attribution",
+    "html_attribution",
+    "status",
+    "tile_matrices",
+}
+
+# Every in-place modification stamps the modified Bunch with the next value of this
+# counter. Cached lookup indexes store the value drawn when they were built and are
+# rebuilt once their Bunch, or any Bunch nested in it, carries a later stamp.
+_STAMPS = itertools.count(1)
+
+
+def _touch(bunch):
+    bunch.__dict__["_stamp"] = next(_STAMPS)
+
+
+# credentials of the current context (thread or asyncio task), see use_credentials()
+_CREDENTIALS = contextvars.ContextVar("xyzservices_credentials", default=None)
+
 
 class Bunch(dict):
     """A dict with attribute-access
@@ -49,6 +116,48 @@ class Bunch(dict):
     def __dir__(self):
         return self.keys()
 
+    def __getstate__(self):
+        # lookup caches (see _cached) and subdomain counters are valid only in the
+        # process that created them, so they are neither pickled nor copied
+        return {}
+
+    def __setstate__(self, state):
+        # the items have been restored through __setitem__, which is not a
+        # modification of the unpickled (or copied) Bunch
+        self.__dict__.pop("_stamp", None)
+
+    def __setitem__(self, key, value):
+        _touch(self)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        _touch(self)
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        _touch(self)
+        super().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        _touch(self)
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        _touch(self)
+        return super().pop(*args)
+
+    def popitem(self):
+        _touch(self)
+        return super().popitem()
+
+    def clear(self):
+        _touch(self)
+        super().clear()
+
+    def __ior__(self, other):
+        _touch(self)
+        return super().__ior__(other)
+
     def _repr_html_(self, inside=False):
         children = ""
         for key in self:
@@ -282,16 +391,162 @@ class Bunch(dict):
         >>> xyz.query_name("CartoDB.Positron")
 
         """
-        xyz_flat_lower = {
-            k.translate(QUERY_NAME_TRANSLATION).lower(): v
-            for k, v in self.flatten().items()
-        }
         name_clean = name.translate(QUERY_NAME_TRANSLATION).lower()
-        if name_clean in xyz_flat_lower:
-            return xyz_flat_lower[name_clean]
+        index = self._name_index()
+        if name_clean in index:
+            return index[name_clean]
 
         raise ValueError(f"No matching provider found for the query '{name}'.")
 
+    def to_leaflet_json(self) -> str:
+        """Return the providers as compact JSON of Leaflet ``TileLayer`` definitions
+
+        The :class:`Bunch` is flattened and each :class:`TileProvider` is converted
+        using :meth:`TileProvider.to_leaflet`. The resulting object maps provider names
+        to ``{"url": ..., "options": {...}}``, ready to be passed to
+        ``L.tileLayer(url, options)`` or an equivalent in libraries like folium or
+        ipyleaflet.
+
+        The JSON is generated once and cached until the :class:`Bunch` or any
+        :class:`TileProvider` within it is modified.
+
+        Returns
+        -------
+        str
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> layers = xyz.CartoDB.to_leaflet_json()
+
+        Filtered :class:`Bunch` can be exported as well:
+
+        >>> free_layers = xyz.filter(requires_token=False).to_leaflet_json()
+        """
+        return self._cached(
+            "_leaflet_json",
+            lambda: json.dumps(
+                {name: p.to_leaflet() for name, p in self.flatten().items()},
+                separators=(",", ":"),
+            ),
+        )
+
+    def to_json(self, f: IO[str] | None = None, indent: int | None = None):
+        """Serialise the :class:`Bunch` to JSON
+
+        The JSON has the same structure as the providers JSON shipped with
+        xyzservices and can be read back using :meth:`Bunch.from_json`. When a file
+        object is given, the JSON is written to it in chunks without building the
+        whole string in memory.
+
+        Parameters
+        ----------
+        f : file-like object (optional)
+            Text file object to write to. If None, the JSON is returned as a string.
+        indent : int (optional)
+            Indentation of the JSON. If None, the most compact representation is
+            used.
+
+        Returns
+        -------
+        str or None
+            JSON string if ``f`` is None
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> with open("providers.json", "w") as f:
+        ...     xyz.to_json(f)
+
+        >>> xyz.CartoDB.to_json()
+        """
+        separators = (",", ":") if indent is None else None
+        if f is None:
+            return json.dumps(self, indent=indent, separators=separators)
+        json.dump(self, f, indent=indent, separators=separators)
+        return None
+
+    @classmethod
+    def from_json(
+        cls, f: IO[str] | IO[bytes], names: Iterable[str] | None = None
+    ) -> Bunch:
+        """Load a :class:`Bunch` from JSON
+
+        Reads JSON of the structure of the providers JSON shipped with xyzservices
+        (e.g. written by :meth:`Bunch.to_json`) from a file object.
+
+        Parameters
+        ----------
+        f : file-like object
+            Text or binary file object to read from
+        names : list of str (optional)
+            Top-level names (providers or groups of providers) to load. Only these
+            are turned into :class:`TileProvider` objects, other entries are parsed
+            but then dropped. If None, everything is loaded.
+
+        Returns
+        -------
+        Bunch
+
+        Raises
+        ------
+        KeyError
+            If any of the ``names`` is not present in the JSON
+
+        Examples
+        --------
+        >>> from xyzservices import Bunch
+        >>> with open("providers.json") as f:
+        ...     providers = Bunch.from_json(f)
+
+        Load only selected providers:
+
+        >>> with open("providers.json") as f:
+        ...     providers = Bunch.from_json(f, names=["CartoDB", "OpenTopoMap"])
+        """
+        data = json.load(f)
+        if names is not None:
+            missing = [name for name in names if name not in data]
+            if missing:
+                raise KeyError(f"No providers named {', '.join(missing)} in the JSON.")
+            data = {name: data[name] for name in names}
+        return _from_dict(data)
+
+    def _name_index(self) -> dict:
+        """Return normalised provider names mapped to :class:`TileProvider` objects.
+
+        The index is built lazily on the first lookup and reused until this or any
+        nested :class:`Bunch` is modified, so repeated queries against a large (possibly
+        merged) catalog do not flatten it again.
+        """
+        return self._cached(
+            "_index",
+            lambda: {
+                k.translate(QUERY_NAME_TRANSLATION).lower(): v
+                for k, v in self.flatten().items()
+            },
+        )
+
+    def _cached(self, key: str, build: Callable):
+        """Return the value stored under ``key`` or ``build()`` it if outdated."""
+        cached = self.__dict__.get(key)
+        if cached is not None and cached[0] > self._latest_stamp():
+            return cached[1]
+
+        stamp = next(_STAMPS)
+        value = build()
+        self.__dict__[key] = (stamp, value)
+        return value
+
+    def _latest_stamp(self) -> int:
+        """Return the latest modification stamp of this or any nested Bunch."""
+        stamp = self.__dict__.get("_stamp", 0)
+        if not isinstance(self, TileProvider):
+            for value in self.values():
+                if isinstance(value, Bunch):
+                    stamp = max(stamp, value._latest_stamp())
+        return stamp
+
 
 class TileProvider(Bunch):
     """
@@ -371,8 +626,7 @@ class TileProvider(Bunch):
             raise AttributeError(msg)
 
     def __call__(self, **kwargs) -> TileProvider:
-        new = TileProvider(self)  # takes a copy preserving the class
-        new.update(kwargs)
+        new = TileProvider({**self, **kwargs})  # takes a copy preserving the class
         return new
 
     def copy(self) -> TileProvider:
@@ -385,7 +639,7 @@ class TileProvider(Bunch):
         y: int | str | None = None,
         z: int | str | None = None,
         scale_factor: str | None = None,
-        fill_subdomain: bool | None = True,
+        fill_subdomain: bool | str | None = True,
         **kwargs,
     ) -> str:
         """
@@ -393,6 +647,11 @@ class TileProvider(Bunch):
 
         Can return URL with placeholders or the final tile URL.
 
+        Apart from ``{x}``, ``{y}`` and ``{z}``, the URL can contain the ``{-y}``
+        placeholder for the row number counted from the bottom (TMS) and the ``{q}``
+        placeholder for the Bing Maps quadkey. If the :class:`TileProvider` has
+        a ``tms`` attribute set to True, ``{y}`` is inverted as well, following Leaflet.
+
         Parameters
         ----------
 
@@ -402,9 +661,18 @@ class TileProvider(Bunch):
             Scale factor (where supported). For example, you can get double resolution
             (512 x 512) instead of standard one (256 x 256) with ``"@2x"``. If you want
             to keep a placeholder, pass `"{r}"`.
-        fill_subdomain : bool (optional, default True)
-            Fill subdomain placeholder with the first available subdomain. If False, the
-            URL will contain ``{s}`` placeholder for subdomain.
+        fill_subdomain : bool | str (optional, default True)
+            Fill subdomain placeholder with one of the available subdomains. If False,
+            the URL will contain ``{s}`` placeholder for subdomain. If True, the first
+            subdomain is used. Alternatively, pass the name of the strategy spreading
+            the requests across subdomains:
+
+            - ``"first"`` - always the first subdomain (same as True)
+            - ``"round_robin"`` - cycle through subdomains on each call
+            - ``"hash"`` - subdomain derived from the tile number (``(x + y) %
+              len(subdomains)``, the same as Leaflet), so the same tile is always
+              fetched from the same host and HTTP caches stay warm
+            - ``"random"`` - random subdomain
 
         **kwargs
             Other potential attributes updating the :class:`TileProvider`.
@@ -428,12 +696,13 @@ class TileProvider(Bunch):
         >>> xyz.CartoDB.DarkMatter.build_url(x=9, y=11, z=5, scale_factor="@2x")
         'https://a.basemaps.cartocdn.com/dark_all/5/9/11@2x.png'
 
+        >>> xyz.CartoDB.DarkMatter.build_url(x=9, y=11, z=5, fill_subdomain="hash")
+        'https://a.basemaps.cartocdn.com/dark_all/5/9/11.png'
+
         >>> xyz.MapBox.build_url(accessToken="my_token")
         'https://api.mapbox.com/styles/v1/mapbox/streets-v11/tiles/{z}/{x}/{y}?access_token=my_token'
 
         """
-        provider = self.copy()
-
         if x is None:
             x = "{x}"
         if y is None:
@@ -441,30 +710,245 @@ class TileProvider(Bunch):
         if z is None:
             z = "{z}"
 
-        provider.update(kwargs)
+        url, values, subdomains = self._url_values(scale_factor, fill_subdomain, kwargs)
+        s = self._pick_subdomain(subdomains, fill_subdomain, x, y)
+        try:
+            x, y, z = int(x), int(y), int(z)
+        except ValueError:  # placeholders instead of tile numbers
+            tile = {"x": x, "y": y, "z": z, "q": "{q}", "-y": "{-y}"}
+        else:
+            tile = _tile_fields(x, y, z, values.get("tms"), "{q}" in url)
+        tile["s"] = s
+
+        return url.format_map(collections.ChainMap(tile, values))
+
+    def build_urls(
+        self,
+        tiles: Iterable[tuple[int, int, int]],
+        scale_factor: str | None = None,
+        fill_subdomain: bool | str | None = True,
+        clip: bool = False,
+        **kwargs,
+    ) -> list[str]:
+        """
+        Build the URLs of multiple tiles from the :class:`TileProvider` object
+
+        The URL template is resolved only once, making this considerably faster than
+        calling :meth:`build_url` for each tile.
+
+        Parameters
+        ----------
 
-        if provider.requires_token():
+        tiles : iterable of tuple
+            ``(x, y, z)`` tile numbers
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`build_url`.
+        fill_subdomain : bool | str (optional, default True)
+            Fill subdomain placeholder. See :meth:`build_url` for the available
+            strategies.
+        clip : bool (optional, default False)
+            Skip tiles the :class:`TileProvider` does not cover (see
+            :meth:`covers`).
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider`.
+
+        Returns
+        -------
+
+        urls : list of str
+            Formatted URLs in the order of ``tiles``
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+
+        >>> xyz.CartoDB.DarkMatter.build_urls(
+        ...     [(9, 11, 5), (10, 11, 5)], fill_subdomain="hash"
+        ... )
+        ['https://a.basemaps.cartocdn.com/dark_all/5/9/11.png', \
+'https://b.basemaps.cartocdn.com/dark_all/5/10/11.png']
+
+        """
+        url, values, subdomains = self._url_values(scale_factor, fill_subdomain, kwargs)
+        template = _compile_url(url, values)
+        fmt = template.format
+        pick = self._pick_subdomain
+        tms = values.get("tms")
+        quadkey = "{q}" in template
+        if clip:
+            tiles = self._clip(tiles)
+
+        if not tms and not quadkey and "{-y}" not in template:
+            return [
+                fmt(x=x, y=y, z=z, s=pick(subdomains, fill_subdomain, x, y))
+                for x, y, z in tiles
+            ]
+        return [
+            fmt(
+                s=pick(subdomains, fill_subdomain, x, y),
+                **_tile_fields(x, y, z, tms, quadkey),
+            )
+            for x, y, z in tiles
+        ]
+
+    def build_time_urls(
+        self,
+        tiles: Iterable[tuple[int, int, int]],
+        times: Iterable,
+        scale_factor: str | None = None,
+        fill_subdomain: bool | str | None = True,
+        **kwargs,
+    ) -> dict:
+        """
+        Build the URLs of multiple tiles at multiple times
+
+        For providers with the ``{time}`` placeholder in the URL (e.g. ``NASAGIBS``).
+        The URL template is resolved only once and the tile numbers are shared by
+        all the times.
+
+        Parameters
+        ----------
+
+        tiles : iterable of tuple
+            ``(x, y, z)`` tile numbers
+        times : iterable
+            Timestamps as strings (e.g. ``"2024-06-01"``), :class:`datetime.date` or
+            :class:`datetime.datetime` objects (formatted as ``"2024-06-01"`` and
+            ``"2024-06-01T12:00:00Z"`` in UTC respectively)
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`build_url`.
+        fill_subdomain : bool | str (optional, default True)
+            Fill subdomain placeholder. See :meth:`build_url` for the available
+            strategies.
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider`.
+
+        Returns
+        -------
+
+        urls : dict
+            Formatted URLs keyed by ``(time, z, x, y)``, where ``time`` is the
+            formatted timestamp, ordered by time and then in the order of ``tiles``
+
+        Raises
+        ------
+        ValueError
+            If the URL of the provider has no ``{time}`` placeholder
+
+        Examples
+        --------
+        >>> import datetime
+        >>> import xyzservices.providers as xyz
+
+        >>> days = [datetime.date(2024, 6, 1) + datetime.timedelta(d) for d in range(7)]
+        >>> urls = xyz.NASAGIBS.ModisTerraTrueColorCR.build_time_urls(
+        ...     [(16, 10, 5), (17, 10, 5)], days
+        ... )
+        >>> urls["2024-06-01", 5, 16, 10]
+        'https://map1.vis.earthdata.nasa.gov/wmts-webmerc/\
+MODIS_Terra_CorrectedReflectance_TrueColor/default/2024-06-01/\
+GoogleMapsCompatible_Level9/5/10/16.jpg'
+
+        """
+        url, values, subdomains = self._url_values(scale_factor, fill_subdomain, kwargs)
+        if "{time}" not in url:
+            raise ValueError(
+                f"The URL of '{self.name}' does not depend on time (no {{time}} "
+                "placeholder)."
+            )
+        template = _compile_url(url, values, keep=(*TILE_PLACEHOLDERS, "time"))
+        fmt = template.format
+        tms = values.get("tms")
+        quadkey = "{q}" in template
+
+        # placeholders of the tiles are resolved once for all the times
+        fields = [
+            (
+                (z, x, y),
+                {
+                    "s": self._pick_subdomain(subdomains, fill_subdomain, x, y),
+                    **_tile_fields(x, y, z, tms, quadkey),
+                },
+            )
+            for x, y, z in tiles
+        ]
+        urls = {}
+        for time in times:
+            time = _format_time(time)
+            for tile, placeholders in fields:
+                urls[(time, *tile)] = fmt(time=time, **placeholders)
+        return urls
+
+    def _clip(self, tiles):
+        """Return the tiles covered by the provider."""
+        ranges = {}
+        covered = []
+        for x, y, z in tiles:
+            if z not in ranges:
+                ranges[z] = self.tile_range(z)
+            tile_range = ranges[z]
+            if (
+                tile_range is not None
+                and tile_range[0] <= x <= tile_range[1]
+                and tile_range[2] <= y <= tile_range[3]
+            ):
+                covered.append((x, y, z))
+        return covered
+
+    def _url_values(self, scale_factor, fill_subdomain, kwargs):
+        """Resolve the URL template and the values of its placeholders.
+
+        Returns the URL, the values of all non-tile placeholders and the sequence
+        of subdomains to fill ``{s}`` from (None if ``fill_subdomain`` is False).
+        """
+        if fill_subdomain not in SUBDOMAIN_STRATEGIES:
+            raise ValueError(
+                f"Unknown subdomain strategy '{fill_subdomain}'. Use True, False or "
+                "one of 'first', 'round_robin', 'hash' and 'random'."
+            )
+
+        # layered lookup instead of a merged copy of the provider on every call
+        overrides = {}
+        values = collections.ChainMap(
+            overrides, kwargs, _context_credentials(self) or {}, self
+        )
+
+        if _requires_token(values):
             raise ValueError(
                 "Token is required for this provider, but not provided. "
                 "You can either update TileProvider or pass respective keywords "
                 "to build_url()."
             )
 
-        url = provider.pop("url")
-
         if scale_factor:
-            r = scale_factor
-            provider.pop("r", None)
-        else:
-            r = provider.pop("r", "")
-
-        if fill_subdomain:
-            subdomains = provider.pop("subdomains", "abc")
-            s = subdomains[0]
-        else:
-            s = "{s}"
-
-        return url.format(x=x, y=y, z=z, s=s, r=r, **provider)
+            overrides["r"] = scale_factor
+        elif "r" not in values:
+            overrides["r"] = ""
+
+        subdomains = values.get("subdomains", "abc") if fill_subdomain else None
+
+        return values["url"], values, subdomains
+
+    def _pick_subdomain(self, subdomains, strategy, x, y):
+        if subdomains is None:
+            return "{s}"
+        if strategy is True or strategy == "first":
+            return subdomains[0]
+        if strategy == "round_robin":
+            counter = self.__dict__.get("_subdomain_counter")
+            if counter is None:
+                counter = self.__dict__.setdefault(
+                    "_subdomain_counter", itertools.count()
+                )
+            return subdomains[next(counter) % len(subdomains)]
+        if strategy == "hash":
+            try:
+                return subdomains[abs(int(x) + int(y)) % len(subdomains)]
+            except (TypeError, ValueError):  # placeholders instead of tile numbers
+                return subdomains[0]
+        return random.choice(subdomains)
 
     def requires_token(self) -> bool:
         """
@@ -499,13 +983,263 @@ class TileProvider(Bunch):
 
         >>> xyz.OpenWeatherMap.Clouds(apiKey="my-private-api-key")
 
+        Or provide it only within a context, see :func:`use_credentials`:
+
+        >>> from xyzservices import use_credentials
+        >>> with use_credentials({"OpenWeatherMap": {"apiKey": "..."}}):
+        ...     xyz.OpenWeatherMap.Clouds.requires_token()
+        False
 
         """
-        # both attribute and placeholder in url are required to make it work
-        for key, val in self.items():
-            if isinstance(val, str) and "<insert your" in val and key in self.url:
-                return True
-        return False
+        return _requires_token(self, _context_credentials(self))
+
+    def tile_format(self) -> str | None:
+        """
+        Returns the MIME type of the tiles served by the TileProvider.
+
+        The type is taken from the ``format`` attribute (e.g. ``"image/png"`` or
+        ``"application/x-protobuf"`` for WMTS layers) or deduced from the file
+        extension in the URL. Vector tiles are reported as one of
+        ``xyzservices.lib.VECTOR_FORMATS``.
+
+        Returns
+        -------
+        str or None
+            MIME type or None if it cannot be determined
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> xyz.OpenStreetMap.Mapnik.tile_format()
+        'image/png'
+
+        >>> xyz.GeoportailFrance.plan.tile_format()
+        'image/png'
+        """
+        fmt = self.get("format")
+        if isinstance(fmt, str) and "/" in fmt:
+            return fmt.split(";")[0].strip()
+        path = urllib.parse.urlsplit(self.url).path
+        path = path.replace("{ext}", str(self.get("ext", "")))
+        suffix = path[path.rfind("}") + 1 :]
+        return _EXTENSION_FORMATS.get(suffix[suffix.rfind(".") :].lower())
+
+    def tile_range(self, z: int) -> tuple[int, int, int, int] | None:
+        """
+        Return the range of tiles available at a zoom level
+
+        The range is derived from the ``bounds`` of the :class:`TileProvider` (or the
+        whole world if it has none). Ranges of all zoom levels between ``min_zoom``
+        and ``max_zoom`` are computed once and reused until the provider is modified.
+
+        For providers not using the Web Mercator tile grid (see
+        :mod:`xyzservices.wmts`), the range is the whole tile matrix of the zoom
+        level given in ``tile_matrices``.
+
+        Parameters
+        ----------
+        z : int
+            Zoom level
+
+        Returns
+        -------
+        tuple or None
+            ``(x_min, x_max, y_min, y_max)`` of the tiles (inclusive), None if ``z``
+            is outside of ``min_zoom`` and ``max_zoom``
+
+        Raises
+        ------
+        ValueError
+            If the provider does not use the Web Mercator tile grid and its
+            ``tile_matrices`` are not known
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> xyz.NASAGIBS.ModisTerraTrueColorCR.tile_range(2)
+        (0, 3, 0, 3)
+        """
+        if z < self.get("min_zoom", 0) or z > self.get("max_zoom", float("inf")):
+            return None
+        if not _web_mercator(self):
+            return self._matrix_range(z)
+        return self._bounds_range(z)
+
+    def covers(self, x: int, y: int, z: int) -> bool:
+        """
+        Returns ``True`` if the tile is within the ``bounds`` and zoom range.
+
+        See :meth:`tile_range` for providers not using the Web Mercator tile grid.
+
+        Parameters
+        ----------
+        x, y, z : int
+            tile number
+
+        Returns
+        -------
+        bool
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> xyz.OpenStreetMap.CH.covers(x=133, y=90, z=8)
+        True
+        >>> xyz.OpenStreetMap.CH.covers(x=0, y=0, z=8)
+        False
+        """
+        tile_range = self.tile_range(z)
+        return (
+            tile_range is not None
+            and tile_range[0] <= x <= tile_range[1]
+            and tile_range[2] <= y <= tile_range[3]
+        )
+
+    def _matrix_range(self, z):
+        """Return the tile range of the matrix ``z`` of ``tile_matrices``."""
+        matrices = self.get("tile_matrices")
+        if matrices is None:
+            raise ValueError(
+                f"'{self.name}' does not use the Web Mercator tile grid and the "
+                "definition of its tile matrices (tile_matrices) is not available."
+            )
+        for identifier, _, _, _, width, height in matrices:
+            if identifier == z:
+                return 0, width - 1, 0, height - 1
+        return None
+
+    def _bounds_range(self, z):
+        """Return the tile range within ``bounds`` at zoom ``z`` from the table."""
+        table = self._cached("_range_table", self._tile_ranges)
+        tile_range = table.get(z)
+        if tile_range is None:  # outside of the precomputed zoom levels
+            tile_range = table[z] = _bounds_tile_range(self.get("bounds"), z)
+        return tile_range
+
+    def _tile_ranges(self):
+        bounds = self.get("bounds")
+        max_zoom = self.get("max_zoom")
+        if max_zoom is None:
+            return {}
+        return {
+            z: _bounds_tile_range(bounds, z)
+            for z in range(self.get("min_zoom", 0), max_zoom + 1)
+        }
+
+    def estimate_tiles(
+        self,
+        bbox: tuple[float, float, float, float],
+        zooms: int | Iterable[int],
+        average_tile_size: float | None = None,
+    ) -> dict:
+        """
+        Estimate the number of tiles (and bytes) covering the bounding box
+
+        The number of tiles is computed from the tile ranges at each zoom level
+        without enumerating the tiles, so even deep zoom pyramids over large areas are
+        estimated instantly. The bounding box is clipped to the ``bounds`` of the
+        :class:`TileProvider` and zoom levels outside of its ``min_zoom`` and
+        ``max_zoom`` are ignored.
+
+        Parameters
+        ----------
+        bbox : tuple
+            ``(west, south, east, north)`` in longitude and latitude (EPSG:4326).
+            If ``west`` is larger than ``east``, the box is assumed to cross
+            the antimeridian.
+        zooms : int | iterable of int
+            Zoom level or zoom levels (e.g. ``range(0, 20)``)
+        average_tile_size : float (optional)
+            Average size of a single tile in bytes (e.g. measured on a sample of
+            tiles) used to estimate the total size.
+
+        Returns
+        -------
+        dict
+            ``{"tiles": int, "bytes": float | None, "zooms": {zoom: int}}`` with
+            the total number of tiles, estimated total size (None if
+            ``average_tile_size`` is not given) and the number of tiles per zoom
+            level.
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> estimate = xyz.OpenStreetMap.Mapnik.estimate_tiles(
+        ...     (-10.7, 51.4, 1.9, 59.4), range(0, 20), average_tile_size=15_000
+        ... )
+        >>> estimate["zooms"][10]
+        1517
+        """
+        _check_web_mercator(self, "estimate_tiles()")
+        if isinstance(zooms, int):
+            zooms = [zooms]
+
+        west, south, east, north = bbox
+        if "bounds" in self:
+            (b_south, b_west), (b_north, b_east) = self["bounds"]
+            south = max(south, b_south)
+            north = min(north, b_north)
+            if west <= east:
+                boxes = [(max(west, b_west), min(east, b_east))]
+            else:  # crossing antimeridian
+                boxes = [(max(west, b_west), b_east), (b_west, min(east, b_east))]
+        elif west <= east:
+            boxes = [(west, east)]
+        else:
+            boxes = [(west, 180), (-180, east)]
+
+        min_zoom = self.get("min_zoom", 0)
+        max_zoom = self.get("max_zoom", float("inf"))
+
+        per_zoom = {}
+        for z in zooms:
+            if z < min_zoom or z > max_zoom or south >= north:
+                per_zoom[z] = 0
+                continue
+            y_min, y_max = _tile_range_y(south, north, z)
+            count = 0
+            for w, e in boxes:
+                if w < e:
+                    x_min, x_max = _tile_range_x(w, e, z)
+                    count += (x_max - x_min + 1) * (y_max - y_min + 1)
+            per_zoom[z] = count
+
+        total = sum(per_zoom.values())
+        return {
+            "tiles": total,
+            "bytes": total * average_tile_size if average_tile_size else None,
+            "zooms": per_zoom,
+        }
+
+    def to_leaflet(self) -> dict:
+        """
+        Return the :class:`TileProvider` as Leaflet ``TileLayer`` definition
+
+        The attributes are converted to Leaflet options (``max_zoom`` to ``maxZoom``,
+        ``min_zoom`` to ``minZoom``, ``html_attribution`` to ``attribution``). Other
+        attributes like ``subdomains``, ``bounds``, ``tileSize`` or ``variant`` are
+        passed through as Leaflet fills URL placeholders from options.
+
+        Returns
+        -------
+        dict
+            ``{"url": ..., "options": {...}}``
+
+        Examples
+        --------
+        >>> import xyzservices.providers as xyz
+        >>> layer = xyz.CartoDB.Positron.to_leaflet()
+        >>> layer["url"]
+        'https://{s}.basemaps.cartocdn.com/{variant}/{z}/{x}/{y}{r}.png'
+        >>> layer["options"]["maxZoom"]
+        20
+        """
+        options = {"attribution": self.html_attribution}
+        for key, value in self.items():
+            if key in LEAFLET_EXCLUDED_KEYS:
+                continue
+            options[LEAFLET_OPTIONS.get(key, key)] = value
+        return {"url": self["url"], "options": options}
 
     @property
     def html_attribution(self):
@@ -585,8 +1319,283 @@ class TileProvider(Bunch):
         )
 
 
+@contextlib.contextmanager
+def use_credentials(credentials: dict):
+    """
+    Provide credentials of providers within a context
+
+    The credentials are used by :meth:`TileProvider.build_url`,
+    :meth:`TileProvider.requires_token` and everything fetching tiles, without
+    modifying or copying the providers. They are stored in a
+    :class:`contextvars.ContextVar`, so they apply only to the current thread or
+    :mod:`asyncio` task (and the threads fetching tiles on its behalf). Different
+    requests of a multi-tenant service can use different credentials at the same
+    time. Tiles cached and shared by :mod:`xyzservices.cache` are kept apart per
+    credentials filling the URL.
+
+    Nested contexts add to the credentials of the outer ones. Keyword arguments of
+    :meth:`TileProvider.build_url` take precedence over the credentials.
+
+    Parameters
+    ----------
+    credentials : dict
+        Attributes of providers keyed by the provider name (e.g.
+        ``"OpenWeatherMap.Clouds"``), the name of a group of providers (e.g.
+        ``"OpenWeatherMap"``) or the host of the URL (e.g. ``"api.mapbox.com"``,
+        also matching its subdomains). Entries for a provider take precedence over
+        those for its group, which take precedence over those for a host.
+
+    Examples
+    --------
+    >>> import xyzservices
+    >>> import xyzservices.providers as xyz
+    >>> with xyzservices.use_credentials({"OpenWeatherMap": {"apiKey": "my-key"}}):
+    ...     xyz.OpenWeatherMap.Clouds.build_url(x=1, y=2, z=3)
+    'http://a.tile.openweathermap.org/map/clouds/3/1/2.png?appid=my-key'
+
+    In an :mod:`asyncio` web service, each request handler can use the credentials
+    of its tenant:
+
+    >>> async def handle(request):
+    ...     with xyzservices.use_credentials(tenant_tokens[request.tenant]):
+    ...         return await render_map(request)
+    """
+    outer = _CREDENTIALS.get() or {}
+    merged = dict(outer)
+    for key, values in credentials.items():
+        merged[key] = {**outer.get(key, {}), **values}
+    token = _CREDENTIALS.set(merged)
+    try:
+        yield
+    finally:
+        _CREDENTIALS.reset(token)
+
+
+def _tile_fields(x: int, y: int, z: int, tms: bool, quadkey: bool) -> dict:
+    """Return values of the tile placeholders of a URL."""
+    inverted = (1 << z) - 1 - y
+    return {
+        "x": x,
+        "y": inverted if tms else y,
+        "z": z,
+        "-y": inverted,
+        "q": _quadkey(x, y, z) if quadkey else "{q}",
+    }
+
+
+def _spread_bits(v: int) -> int:
+    """Insert a zero bit between each of the lower 32 bits of v."""
+    v &= 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+
+def _quadkey(x: int, y: int, z: int) -> str:
+    """Return the Bing Maps quadkey of a tile.
+
+    The bits of x and y are interleaved into a single integer (Morton code) in which
+    each pair of bits is one base-4 digit of the quadkey. The digits are then read two
+    at a time from its hexadecimal representation.
+    """
+    if z == 0:
+        return ""
+    if z > 32:
+        raise ValueError("Quadkeys are supported only up to zoom level 32.")
+    code = _spread_bits(x) | (_spread_bits(y) << 1)
+    digits = "".join(map(_HEX_QUADS.__getitem__, format(code, f"0{(z + 1) // 2}x")))
+    return digits[z & 1 :]
+
+
+def _web_mercator(provider: TileProvider) -> bool:
+    """Return True if the provider serves tiles of the Web Mercator (XYZ) grid."""
+    if "crs" in provider:
+        return provider["crs"] in _WEB_MERCATOR_CRS
+    matrix_set = provider.get("TileMatrixSet")
+    return matrix_set is None or str(matrix_set).startswith(_WEB_MERCATOR_MATRIX_SETS)
+
+
+def _check_web_mercator(provider: TileProvider, function: str) -> None:
+    """Raise ValueError if the provider does not use the Web Mercator grid."""
+    if not _web_mercator(provider):
+        grid = provider.get("crs", provider.get("TileMatrixSet"))
+        raise ValueError(
+            f"{function} supports only providers of the Web Mercator tile grid, "
+            f"'{provider.name}' uses '{grid}'. Use xyzservices.wmts to find its "
+            "tiles."
+        )
+
+
+def _lonlat_to_tile(lon: float, lat: float, z: int) -> tuple[int, int]:
+    """Return the column and row of the Web Mercator tile containing a point."""
+    n = 1 << z
+    x = math.floor((lon + 180.0) / 360.0 * n)
+    y = math.floor(_lat_to_tile_y(lat) * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _tile_range_x(west: float, east: float, z: int) -> tuple[int, int]:
+    """Return the first and the last tile column covering longitudes at zoom z."""
+    n = 1 << z
+    x_min = math.floor((west + 180.0) / 360.0 * n + _TILE_EPSILON)
+    x_max = math.ceil((east + 180.0) / 360.0 * n - _TILE_EPSILON) - 1
+    x_min = min(max(x_min, 0), n - 1)
+    return x_min, min(max(x_max, x_min), n - 1)
+
+
+def _tile_range_y(south: float, north: float, z: int) -> tuple[int, int]:
+    """Return the first and the last tile row covering latitudes at zoom z."""
+    n = 1 << z
+    y_min = math.floor(_lat_to_tile_y(north) * n + _TILE_EPSILON)
+    y_max = math.ceil(_lat_to_tile_y(south) * n - _TILE_EPSILON) - 1
+    y_min = min(max(y_min, 0), n - 1)
+    return y_min, min(max(y_max, y_min), n - 1)
+
+
+def _bounds_tile_range(bounds, z: int) -> tuple[int, int, int, int]:
+    """Return (x_min, x_max, y_min, y_max) of the tiles covering Leaflet bounds."""
+    if bounds is None:
+        n = (1 << z) - 1
+        return 0, n, 0, n
+    (south, west), (north, east) = bounds
+    return (*_tile_range_x(west, east, z), *_tile_range_y(south, north, z))
+
+
+def _lat_to_tile_y(lat: float) -> float:
+    """Return the Web Mercator tile row of a latitude as a fraction of the grid."""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    return (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+
+
+def _compile_url(url: str, values: dict, keep=TILE_PLACEHOLDERS) -> str:
+    """Substitute all placeholders of ``url`` except the tile-specific ones.
+
+    Returns a format string in which only ``{x}``, ``{y}``, ``{z}`` and ``{s}`` (and
+    other placeholders in ``keep``) remain and any braces coming from the substituted
+    values are escaped.
+    """
+    template = []
+    for literal, field, spec, conversion in _FORMATTER.parse(url):
+        template.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        if field in keep:
+            template.append("{" + field + (":" + spec if spec else "") + "}")
+            continue
+        value = _FORMATTER.convert_field(values[field], conversion)
+        value = format(value, spec)
+        template.append(value.replace("{", "{{").replace("}", "}}"))
+    return "".join(template)
+
+
+def _format_time(value) -> str:
+    """Format a timestamp as used in the ``{time}`` placeholder of URLs.
+
+    Dates are formatted as ``YYYY-MM-DD``, datetimes as ``YYYY-MM-DDThh:mm:ssZ`` in
+    UTC (including those at midnight, so all frames of a series are formatted
+    alike), other values are converted to strings.
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+def _requires_token(provider, credentials: dict | None = None) -> bool:
+    # both attribute and placeholder in url are required to make it work
+    url = provider["url"]
+    for key, val in provider.items():
+        if credentials and key in credentials:
+            val = credentials[key]
+        if isinstance(val, str) and "<insert your" in val and key in url:
+            return True
+    return False
+
+
+def _context_credentials(provider) -> dict | None:
+    """Return the credentials of the current context applying to the provider.
+
+    Entries for the host of the URL are applied first (parent domains before
+    subdomains), then those for the group of the provider and for the provider.
+    """
+    store = _CREDENTIALS.get()
+    if not store:
+        return None
+    credentials = {}
+    for key in provider._cached("_credential_keys", lambda: _credential_keys(provider)):
+        credentials.update(store.get(key, ()))
+    return credentials
+
+
+def _credential_keys(provider) -> list[str]:
+    """Return the keys of credentials applying to the provider, in order of precedence.
+
+    These are the host of the URL and its parent domains (parent domains first),
+    followed by the group of the provider and the full name of the provider.
+    """
+    labels = (urllib.parse.urlsplit(provider["url"]).hostname or "").split(".")
+    parts = provider.get("name", "").split(".")
+    return [".".join(labels[i:]) for i in range(len(labels) - 1, -1, -1)] + [
+        ".".join(parts[:i]) for i in range(1, len(parts) + 1)
+    ]
+
+
+def _submit(executor, fn, *args) -> concurrent.futures.Future:
+    """Submit ``fn(*args)`` to the executor within a copy of the current context.
+
+    Workers of thread pools do not inherit context variables, this makes them see
+    the credentials of the caller (see :func:`use_credentials`).
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _merge_providers(target: Bunch, source: Bunch) -> Bunch:
+    """Merge ``source`` catalog into ``target`` in place.
+
+    Providers and bunches not present in ``target`` are added. If both catalogs
+    contain a :class:`Bunch` of the same name, their providers are combined, with
+    those from ``source`` taking precedence. Any other clash is resolved in favour of
+    ``source``.
+    """
+    for key, value in source.items():
+        existing = target.get(key)
+        if (
+            isinstance(value, Bunch)
+            and not isinstance(value, TileProvider)
+            and isinstance(existing, Bunch)
+            and not isinstance(existing, TileProvider)
+        ):
+            existing.update(value)
+        else:
+            target[key] = value
+    return target
+
+
 def _load_json(f):
     data = json.loads(f)
+    return _from_dict(data)
+
+
+def _from_dict(data: dict, validate: bool = True) -> Bunch:
+    """Build a :class:`Bunch` of :class:`TileProvider` objects from plain dicts.
+
+    With ``validate=False`` the required attributes are not checked. That is meant
+    only for data that has been produced by :func:`_to_dict` from already validated
+    providers (e.g. a cached snapshot of the catalog).
+    """
+    if validate:
+        make_provider = TileProvider
+    else:
+
+        def make_provider(attrs):
+            provider = TileProvider.__new__(TileProvider)
+            dict.update(provider, attrs)
+            return provider
 
     providers = Bunch()
 
@@ -594,16 +1603,24 @@ def _load_json(f):
         provider = data[provider_name]
 
         if "url" in provider:
-            providers[provider_name] = TileProvider(provider)
+            providers[provider_name] = make_provider(provider)
 
         else:
             providers[provider_name] = Bunch(
-                {i: TileProvider(provider[i]) for i in provider}
+                {i: make_provider(provider[i]) for i in provider}
             )
 
     return providers
 
 
+def _to_dict(bunch: Bunch) -> dict:
+    """Convert a :class:`Bunch` back to plain nested dicts (inverse of _from_dict)."""
+    return {
+        key: dict(value) if isinstance(value, TileProvider) else _to_dict(value)
+        for key, value in bunch.items()
+    }
+
+
 CSS_STYLE = """
 /* CSS stylesheet for displaying xyzservices objects in Jupyter.*/
 .xyz-wrap {
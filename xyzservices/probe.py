@@ -0,0 +1,208 @@
+"""
+Concurrent health checks of TileProvider objects
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import socket
+import time
+import urllib.error
+import urllib.parse
+
+from .lib import Bunch, TileProvider, _lonlat_to_tile, _submit
+from .tiles import _get
+
+# results of a probe
+OK = "ok"
+TOKEN = "token"  # API key required (missing or rejected, HTTP 401 or 403)
+NOT_FOUND = "not_found"  # HTTP 404 or 410
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"  # HTTP 5xx
+RATE_LIMITED = "rate_limited"  # HTTP 429
+ERROR = "error"  # any other failure (connection refused, DNS, other status codes)
+
+# results marking the provider as broken in the providers JSON if they persist after
+# retries, transient failures (timeouts, rate limiting) never do
+BROKEN = (NOT_FOUND, SERVER_ERROR)
+
+
+def representative_tiles(provider: TileProvider) -> list[tuple[int, int, int]]:
+    """Return tiles most likely to exist for the :class:`TileProvider`
+
+    The first one is the tile at the centre of the ``bounds`` in the middle of the
+    zoom range of the provider, the second one the tile at the same place at
+    ``min_zoom``.
+
+    Parameters
+    ----------
+    provider : TileProvider
+
+    Returns
+    -------
+    list of tuple
+        ``(x, y, z)`` tile numbers
+    """
+    (south, west), (north, east) = provider.get("bounds", [[-90, -180], [90, 180]])
+    lat = (south + north) / 2
+    lon = (west + east) / 2
+    min_zoom = provider.get("min_zoom", 0)
+    tiles = []
+    for z in ((min_zoom + provider.get("max_zoom", 20)) // 2, min_zoom):
+        tile = (*_lonlat_to_tile(lon, lat, z), z)
+        if tile not in tiles:
+            tiles.append(tile)
+    return tiles
+
+
+def probe_provider(
+    provider: TileProvider,
+    timeout: float = 10,
+    headers: dict | None = None,
+) -> str:
+    """Check whether the :class:`TileProvider` serves tiles
+
+    :func:`representative_tiles` are requested one by one until one of them
+    does not return HTTP 404.
+
+    Parameters
+    ----------
+    provider : TileProvider
+    timeout : float (optional, default 10)
+        Timeout of a single request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+
+    Returns
+    -------
+    str
+        One of ``"ok"``, ``"token"`` (API key missing or rejected),
+        ``"not_found"``, ``"timeout"``, ``"server_error"``, ``"rate_limited"`` and
+        ``"error"``.
+    """
+    if provider.requires_token():
+        return TOKEN
+
+    result = ERROR
+    for x, y, z in representative_tiles(provider):
+        url = provider.build_url(x=x, y=y, z=z)
+        result = _probe_url(url, timeout, headers)
+        if result != NOT_FOUND:
+            break
+    return result
+
+
+def probe_providers(
+    providers: Bunch,
+    timeout: float = 10,
+    max_workers: int = 64,
+    per_host: int = 4,
+    headers: dict | None = None,
+    retries: int = 0,
+    retry_delay: float = 30,
+) -> dict[str, str]:
+    """Check all providers in the :class:`Bunch` concurrently
+
+    Providers are probed using :func:`probe_provider` in a thread pool with
+    at most ``per_host`` simultaneous requests to a single host. Providers
+    requiring an API token are reported as ``"token"`` without sending any request.
+
+    Providers not reported as ``"ok"`` or ``"token"`` are probed again up to
+    ``retries`` times, ``retry_delay`` seconds after the previous round and one at a
+    time per host, so that transient failures and rate limiting do not count. The
+    result of the last attempt is reported.
+
+    Parameters
+    ----------
+    providers : Bunch
+        Providers to check, e.g. ``xyzservices.providers``
+    timeout : float (optional, default 10)
+        Timeout of a single request in seconds
+    max_workers : int (optional, default 64)
+        Number of requests running at the same time
+    per_host : int (optional, default 4)
+        Maximum number of requests running at the same time against a single host
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+    retries : int (optional, default 0)
+        Number of times failing providers are probed again
+    retry_delay : float (optional, default 30)
+        Number of seconds to wait before probing failing providers again
+
+    Returns
+    -------
+    dict
+        Provider names mapped to the results of :func:`probe_provider`
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.probe import probe_providers
+    >>> results = probe_providers(xyz.CartoDB, retries=2)
+    """
+    flat = providers.flatten()
+    results = _probe_all(flat, timeout, max_workers, per_host, headers)
+    for _ in range(retries):
+        failing = {
+            name: flat[name]
+            for name, result in results.items()
+            if result not in (OK, TOKEN)
+        }
+        if not failing:
+            break
+        time.sleep(retry_delay)
+        results.update(_probe_all(failing, timeout, max_workers, 1, headers))
+
+    return {name: results[name] for name in flat}
+
+
+def _probe_all(flat, timeout, max_workers, per_host, headers):
+    # Providers are grouped by host and each host gets at most ``per_host`` lanes
+    # probing its providers one after another. That keeps the per-host limit without
+    # workers idling while waiting for a busy host.
+    hosts = {}
+    results = {}
+    for name, provider in flat.items():
+        if provider.requires_token():
+            results[name] = TOKEN
+            continue
+        x, y, z = representative_tiles(provider)[0]
+        host = urllib.parse.urlsplit(provider.build_url(x=x, y=y, z=z)).netloc
+        hosts.setdefault(host, []).append((name, provider))
+
+    def _lane(queue):
+        return [(name, probe_provider(p, timeout, headers)) for name, p in queue]
+
+    lanes = [queue[i::per_host] for queue in hosts.values() for i in range(per_host)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [_submit(executor, _lane, lane) for lane in lanes if lane]
+        for future in futures:
+            results.update(future.result())
+
+    return results
+
+
+def _probe_url(url: str, timeout: float, headers: dict | None) -> str:
+    try:
+        _get(url, timeout=timeout, headers=headers)
+    except urllib.error.HTTPError as err:
+        return _classify_status(err.code)
+    except urllib.error.URLError as err:
+        return TIMEOUT if isinstance(err.reason, socket.timeout) else ERROR
+    except socket.timeout:
+        return TIMEOUT
+    except (OSError, ValueError):
+        return ERROR
+    return OK
+
+
+def _classify_status(code: int) -> str:
+    if code in (401, 403):
+        return TOKEN
+    if code in (404, 410):
+        return NOT_FOUND
+    if code == 429:
+        return RATE_LIMITED
+    if 500 <= code < 600:
+        return SERVER_ERROR
+    return ERROR
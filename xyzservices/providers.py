@@ -1,15 +1,195 @@
+import contextlib
+import io
+import marshal
 import os
 import pkgutil
 import sys
+import tempfile
+import threading
+from importlib.metadata import PackageNotFoundError, version
 
-from .lib import _load_json
+from .lib import Bunch, _from_dict, _merge_providers, _to_dict
 
 data_path = os.path.join(sys.prefix, "share", "xyzservices", "providers.json")
+package_data_path = os.path.join(os.path.dirname(__file__), "data", "providers.json")
 
-if os.path.exists(data_path):
-    with open(data_path) as f:
-        json = f.read()
-else:
-    json = pkgutil.get_data("xyzservices", "data/providers.json")
+# additional user-supplied catalogs (e.g. internal tile servers) given as a list of
+# JSON files separated by os.pathsep
+extra_paths_env = "XYZSERVICES_PROVIDERS_PATH"
 
-providers = _load_json(json)
+# directory of the parsed catalog snapshot; set to an empty string to disable it
+cache_dir_env = "XYZSERVICES_CACHE_DIR"
+
+extra_paths = [p for p in os.environ.get(extra_paths_env, "").split(os.pathsep) if p]
+
+# catalogs merged by register_catalog(), merged again whenever the catalog is loaded
+registered_paths = []
+
+
+def _user_data_path():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(base, "xyzservices", "providers.json")
+
+
+# catalog downloaded by xyzservices.update.update_providers(), used instead of the
+# installed one unless that is newer (e.g. after upgrading the package)
+user_data_path = _user_data_path()
+
+
+def _cache_path():
+    if cache_dir_env in os.environ:
+        base = os.environ[cache_dir_env]
+        return os.path.join(base, "providers.marshal") if base else None
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "xyzservices", "providers.marshal")
+
+
+def _cache_key(paths):
+    try:
+        package_version = version("xyzservices")
+    except PackageNotFoundError:
+        package_version = None
+    key = [package_version, marshal.version]
+    for path in paths:
+        stat = os.stat(path)
+        key.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(key)
+
+
+def _read_cache(cache_path, key):
+    """Return the cached catalog as plain dicts or None if missing or stale."""
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if cached_key != key:
+        return None
+    return data
+
+
+def _write_cache(cache_path, key, data):
+    """Atomically store the catalog snapshot, silently giving up on failure."""
+    with contextlib.suppress(OSError, ValueError):
+        directory = os.path.dirname(cache_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(marshal.dumps((key, data)))
+            os.replace(tmp, cache_path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def _source_path():
+    if os.path.exists(data_path):
+        source = data_path
+    elif os.path.exists(package_data_path):
+        source = package_data_path
+    else:  # e.g. zipped package, no file to validate the snapshot against
+        source = None
+
+    with contextlib.suppress(OSError):
+        updated = os.path.getmtime(user_data_path)
+        if source is None or updated >= os.path.getmtime(source):
+            source = user_data_path
+    return source
+
+
+def _load_providers():
+    source = _source_path()
+    paths = [*extra_paths, *registered_paths]
+
+    cache_path = _cache_path() if source is not None else None
+    if cache_path is not None:
+        try:
+            key = _cache_key([source, *paths])
+        except OSError:
+            cache_path = None
+        else:
+            data = _read_cache(cache_path, key)
+            if data is not None:
+                return _from_dict(data, validate=False)
+
+    if source is not None:
+        with open(source) as f:
+            providers = Bunch.from_json(f)
+    else:
+        data = pkgutil.get_data("xyzservices", "data/providers.json")
+        providers = Bunch.from_json(io.BytesIO(data))
+
+    _merge_files(providers, paths)
+
+    if cache_path is not None:
+        _write_cache(cache_path, key, _to_dict(providers))
+
+    return providers
+
+
+def _merge_files(target, paths):
+    for path in paths:
+        with open(path) as f:
+            _merge_providers(target, Bunch.from_json(f))
+
+
+_load_lock = threading.Lock()
+
+
+def _catalog() -> Bunch:
+    """Return ``providers``, loading the catalog on first use."""
+    with _load_lock:
+        if "providers" not in globals():
+            globals()["providers"] = _load_providers()
+    return globals()["providers"]
+
+
+def __getattr__(name):
+    # the catalog is loaded only once used, so that processes not needing it (e.g.
+    # workers mapping a SharedCatalog) do not read and parse it on import
+    if name == "providers":
+        return _catalog()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def register_catalog(paths) -> Bunch:
+    """
+    Merge additional catalogs into ``xyzservices.providers``
+
+    Like those listed in the ``XYZSERVICES_PROVIDERS_PATH`` environment variable,
+    the JSON files are merged in order, providers from later files take precedence
+    and bunches of the same name are combined. The catalog is updated in place, so
+    name queries of all catalogs use a single index, rebuilt once on the next query.
+    The catalogs are merged again when the catalog is reloaded by
+    :func:`xyzservices.update.update_providers`.
+
+    Parameters
+    ----------
+    paths : str, os.PathLike or iterable of them
+        Paths to JSON files following the model of the providers JSON
+
+    Returns
+    -------
+    Bunch
+        ``xyzservices.providers`` including the merged catalogs
+
+    Examples
+    --------
+    >>> import xyzservices
+    >>> xyz = xyzservices.register_catalog(["internal.json", "partners.json"])
+    >>> xyz.query_name("internal streets")
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    providers = _catalog()
+    for path in paths:
+        _merge_files(providers, [path])
+        registered_paths.append(os.fspath(path))
+    return providers
@@ -0,0 +1,415 @@
+"""
+Local caching proxy serving tiles of all providers
+
+Run it using ``python -m xyzservices serve``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import http
+import http.client
+import re
+import socket
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from .cache import _MAX_ZOOM, NegativeCache, TileCache, _tile_key
+from .lib import Bunch, TileProvider, use_credentials
+from .tiles import USER_AGENT
+
+# /{provider}/{z}/{x}/{y} with an optional scale factor and file extension
+_TILE_PATH = re.compile(
+    r"/(?P<name>[^/]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)"
+    r"(?P<r>@\d+(?:\.\d+)?x)?(?:\.\w+)?"
+)
+_CHUNK_SIZE = 64 * 1024
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+]
+
+
+class TileProxy:
+    """
+    Caching HTTP proxy exposing providers under ``/{provider}/{z}/{x}/{y}``
+
+    Providers are resolved using :meth:`Bunch.query_name`, so any spelling of the
+    name works (e.g. ``/CartoDB.Positron/3/4/2.png`` or ``/cartodb-positron/3/4/2``).
+    The ``{y}`` part can be followed by a scale factor (e.g. ``2@2x.png``). Tiles
+    outside of the tile matrix of the zoom level are answered with
+    ``400 Bad Request``.
+
+    Tiles missing in the cache are streamed to the client as they arrive from the
+    upstream server and stored in the cache afterwards. If the upstream response
+    breaks off, the connection to the client is closed and nothing is cached.
+    Concurrent requests for a tile that is already being fetched wait for that
+    upstream request instead of sending their own. Cache hits are served directly
+    from memory or disk.
+
+    Parameters
+    ----------
+    providers : Bunch (optional)
+        Providers to serve. Defaults to ``xyzservices.providers``.
+    cache : TileCache (optional)
+        Cache of tiles. If None, a new in-memory :class:`~xyzservices.cache.TileCache`
+        is created.
+    tokens : dict (optional)
+        Attributes filled into providers on the server side, keyed by the provider
+        name, the name of a group of providers or a host, e.g.
+        ``{"Thunderforest": {"apikey": "..."}}``. Requests are served within
+        :func:`~xyzservices.use_credentials` of these, so providers are never
+        copied.
+    timeout : float (optional, default 30)
+        Timeout of a single upstream request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the upstream requests
+    max_workers : int (optional, default 64)
+        Number of upstream requests and disk reads running at the same time
+    negative : NegativeCache (optional)
+        Record of missing and empty tiles. Known missing tiles are answered with
+        ``404 Not Found`` and known empty tiles served without an upstream request.
+
+    Examples
+    --------
+    >>> import asyncio
+    >>> from xyzservices.cache import TileCache
+    >>> from xyzservices.server import TileProxy
+    >>> proxy = TileProxy(cache=TileCache("tile_cache"))
+    >>> server = await proxy.start("127.0.0.1", 8080)
+    """
+
+    def __init__(
+        self,
+        providers: Bunch | None = None,
+        cache: TileCache | None = None,
+        tokens: dict | None = None,
+        timeout: float = 30,
+        headers: dict | None = None,
+        max_workers: int = 64,
+        negative: NegativeCache | None = None,
+    ):
+        if providers is None:
+            from .providers import providers
+
+        self.providers = providers
+        self.cache = TileCache() if cache is None else cache
+        self.tokens = tokens or {}
+        self.timeout = timeout
+        self.headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        self.negative = negative
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._flights = {}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        """
+        Start serving on ``host`` and ``port``
+
+        Returns
+        -------
+        asyncio.Server
+        """
+        return await asyncio.start_server(self._handle, host, port)
+
+    def resolve(self, name: str) -> TileProvider:
+        """Return the :class:`TileProvider` matching ``name``."""
+        return self.providers.query_name(name)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, http.HTTPStatus.BAD_REQUEST)
+                    break
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                if method not in ("GET", "HEAD"):
+                    await self._respond(
+                        writer, http.HTTPStatus.METHOD_NOT_ALLOWED, keep_alive
+                    )
+                else:
+                    await self._serve_tile(writer, target, method == "HEAD", keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_tile(self, writer, target, head, keep_alive):
+        with use_credentials(self.tokens):
+            await self._serve_provider_tile(writer, target, head, keep_alive)
+
+    async def _serve_provider_tile(self, writer, target, head, keep_alive):
+        match = _TILE_PATH.fullmatch(
+            urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+        )
+        if match is None:
+            await self._respond(writer, http.HTTPStatus.NOT_FOUND, keep_alive)
+            return
+        try:
+            provider = self.resolve(match["name"])
+        except ValueError:
+            await self._respond(writer, http.HTTPStatus.NOT_FOUND, keep_alive)
+            return
+        if provider.requires_token():
+            await self._respond(writer, http.HTTPStatus.FORBIDDEN, keep_alive)
+            return
+
+        x, y, z = int(match["x"]), int(match["y"]), int(match["z"])
+        if not _valid_tile(provider, x, y, z):
+            await self._respond(writer, http.HTTPStatus.BAD_REQUEST, keep_alive)
+            return
+        key = _tile_key(provider, x, y, z, match["r"], {})
+
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self._executor, self.cache.get, key)
+        status = "HIT"
+        if data is None and self.negative is not None:
+            if self.negative.missing(key):
+                await self._respond(
+                    writer,
+                    http.HTTPStatus.NOT_FOUND,
+                    keep_alive,
+                    headers={"X-Cache": "NEGATIVE"},
+                )
+                return
+            data = self.negative.empty(key)
+            status = "NEGATIVE"
+        if data is not None:
+            await self._respond(
+                writer,
+                http.HTTPStatus.OK,
+                keep_alive,
+                data,
+                {"Content-Type": _content_type(data), "X-Cache": status},
+                head,
+            )
+            return
+
+        # concurrent misses of the same tile share a single upstream request
+        flight = self._flights.get(key)
+        if flight is not None:
+            outcome = await asyncio.shield(flight)
+            if outcome is None:
+                await self._respond(writer, http.HTTPStatus.BAD_GATEWAY, keep_alive)
+            elif outcome[0] != http.HTTPStatus.OK:
+                await self._respond(writer, outcome[0], keep_alive)
+            else:
+                headers = {"Content-Type": outcome[2], "X-Cache": "COALESCED"}
+                await self._respond(
+                    writer, http.HTTPStatus.OK, keep_alive, outcome[1], headers, head
+                )
+            return
+
+        flight = self._flights[key] = loop.create_future()
+        try:
+            await self._fetch_upstream(writer, provider, key, head, keep_alive, flight)
+        finally:
+            del self._flights[key]
+            if not flight.done():
+                flight.set_result(None)
+
+    async def _fetch_upstream(self, writer, provider, key, head, keep_alive, flight):
+        """Stream the tile from upstream to the client and the cache.
+
+        The outcome ``(status, data, content type)`` is set as the result of the
+        ``flight`` future shared with coalesced requests.
+        """
+        loop = asyncio.get_running_loop()
+        _, z, x, y, scale_factor = key
+        try:
+            url = provider.build_url(x=x, y=y, z=z, scale_factor=scale_factor)
+        except (KeyError, ValueError) as err:
+            # a placeholder without a value (e.g. {time}) cannot be filled from the
+            # request, other errors come from the definition of the provider
+            if isinstance(err, KeyError):
+                status = http.HTTPStatus.BAD_REQUEST
+            else:
+                status = http.HTTPStatus.BAD_GATEWAY
+            flight.set_result((status, b"", None))
+            await self._respond(writer, status, keep_alive)
+            return
+        try:
+            response = await loop.run_in_executor(self._executor, self._open, url)
+        except urllib.error.HTTPError as err:
+            err.close()
+            if self.negative is not None and err.code in (404, 410):
+                self.negative.add_missing(key)
+            flight.set_result((err.code, b"", None))
+            await self._respond(writer, err.code, keep_alive)
+            return
+        except (socket.timeout, TimeoutError):
+            flight.set_result((http.HTTPStatus.GATEWAY_TIMEOUT, b"", None))
+            await self._respond(writer, http.HTTPStatus.GATEWAY_TIMEOUT, keep_alive)
+            return
+        except (OSError, ValueError):
+            flight.set_result((http.HTTPStatus.BAD_GATEWAY, b"", None))
+            await self._respond(writer, http.HTTPStatus.BAD_GATEWAY, keep_alive)
+            return
+
+        with response:
+            length = response.headers.get("Content-Length")
+            content_type = response.headers.get("Content-Type")
+            headers = {"X-Cache": "MISS"}
+            if content_type:
+                headers["Content-Type"] = content_type
+            if length is not None:
+                headers["Content-Length"] = length
+            elif not head:
+                headers["Transfer-Encoding"] = "chunked"
+            client_error = None
+            try:
+                await self._write_head(writer, http.HTTPStatus.OK, keep_alive, headers)
+            except ConnectionError as err:
+                client_error = err
+
+            # keep reading even if the client went away to populate the cache
+            chunks = []
+            upstream_error = None
+            while True:
+                try:
+                    chunk = await loop.run_in_executor(
+                        self._executor, response.read, _CHUNK_SIZE
+                    )
+                except (http.client.HTTPException, OSError) as err:
+                    upstream_error = err
+                    break
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if head or client_error is not None:
+                    continue
+                if length is None:
+                    chunk = b"%x\r\n%s\r\n" % (len(chunk), chunk)
+                try:
+                    writer.write(chunk)
+                    await writer.drain()
+                except ConnectionError as err:
+                    client_error = err
+
+        data = b"".join(chunks)
+        complete = upstream_error is None and (
+            length is None or len(data) == int(length)
+        )
+        if complete:
+            flight.set_result(
+                (http.HTTPStatus.OK, data, content_type or _content_type(data))
+            )
+            if self.negative is None or not self.negative.add(key, data):
+                await loop.run_in_executor(self._executor, self.cache.put, key, data)
+        if client_error is not None:
+            raise client_error
+        if not complete:
+            # the status has been sent already, closing the connection is the only
+            # way to tell the client that the tile is incomplete
+            raise ConnectionAbortedError(
+                f"Incomplete response from {url}"
+            ) from upstream_error
+        if length is None and not head:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+    def _open(self, url):
+        request = urllib.request.Request(url, headers=self.headers)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    async def _respond(
+        self, writer, status, keep_alive=False, body=b"", headers=None, head=False
+    ):
+        headers = {**(headers or {}), "Content-Length": str(len(body))}
+        await self._write_head(writer, status, keep_alive, headers)
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _write_head(self, writer, status, keep_alive, headers):
+        try:
+            phrase = http.HTTPStatus(status).phrase
+        except ValueError:  # non-standard status code forwarded from upstream
+            phrase = ""
+        lines = [f"HTTP/1.1 {int(status)} {phrase}"]
+        lines.extend(f"{key}: {value}" for key, value in headers.items())
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    cache_dir: str | None = None,
+    max_items: int = 4096,
+    tokens: dict | None = None,
+    timeout: float = 30,
+) -> None:
+    """
+    Run the caching tile proxy until interrupted
+
+    Parameters
+    ----------
+    host : str (optional, default "127.0.0.1")
+        Address to listen on
+    port : int (optional, default 8080)
+        Port to listen on
+    cache_dir : str (optional)
+        Directory of the disk cache. If None, tiles are cached only in memory.
+    max_items : int (optional, default 4096)
+        Maximum number of tiles kept in memory
+    tokens : dict (optional)
+        Attributes filled into providers on the server side. See
+        :class:`TileProxy`.
+    timeout : float (optional, default 30)
+        Timeout of a single upstream request in seconds
+    """
+    proxy = TileProxy(
+        cache=TileCache(cache_dir, max_items=max_items),
+        tokens=tokens,
+        timeout=timeout,
+    )
+
+    async def _main():
+        server = await proxy.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(_main())
+
+
+def _valid_tile(provider, x, y, z):
+    """Return True if the tile exists in the tile matrix set of the provider."""
+    if z > _MAX_ZOOM:
+        return False
+    for identifier, _, _, _, width, height in provider.get("tile_matrices", ()):
+        if identifier == z:
+            return x < width and y < height
+    if "tile_matrices" in provider:
+        return False
+    return x < 1 << z and y < 1 << z
+
+
+def _content_type(data: bytes) -> str:
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
@@ -0,0 +1,217 @@
+"""
+Memory-mapped catalog shared by worker processes
+
+A catalog is built once into a file with :func:`build_catalog`. Every process then
+maps it with :class:`SharedCatalog` instead of parsing it, so the operating system
+keeps a single copy of the data in its page cache for all workers (e.g. of a
+pre-forking web server or a :mod:`multiprocessing` pool). Providers are decoded only
+when accessed.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterator
+
+from .lib import QUERY_NAME_TRANSLATION, Bunch, TileProvider
+
+_MAGIC = b"XYZCAT1\0"
+_HEADER = struct.Struct("<8sQQ")
+
+
+def build_catalog(path: str, providers: Bunch | None = None) -> None:
+    """
+    Write the providers into a file to be mapped by :class:`SharedCatalog`
+
+    The file is replaced atomically, so processes already mapping the previous
+    version keep working with it.
+
+    Parameters
+    ----------
+    path : str
+        Path of the catalog file, e.g. on a ``tmpfs`` such as ``/dev/shm``
+    providers : Bunch (optional)
+        Providers to write. Defaults to ``xyzservices.providers``.
+
+    Examples
+    --------
+    >>> from xyzservices.shared import build_catalog
+    >>> build_catalog("/dev/shm/xyzservices.catalog")
+    """
+    if providers is None:
+        from .providers import providers
+
+    blobs = []
+    offset = 0
+
+    def _add(provider):
+        nonlocal offset
+        blob = marshal.dumps(dict(provider))
+        blobs.append(blob)
+        entry = (offset, len(blob))
+        offset += len(blob)
+        return entry
+
+    # tree of offsets of the providers and normalised names mapped to their paths
+    tree = {}
+    names = {}
+    for key, value in providers.items():
+        if isinstance(value, TileProvider):
+            tree[key] = _add(value)
+            names[value.name.translate(QUERY_NAME_TRANSLATION).lower()] = (key,)
+        else:
+            tree[key] = {}
+            for name, provider in value.items():
+                tree[key][name] = _add(provider)
+                normalised = provider.name.translate(QUERY_NAME_TRANSLATION).lower()
+                names[normalised] = (key, name)
+    tree = marshal.dumps(tree)
+    names = marshal.dumps(names)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(tree), len(names)))
+            f.write(tree)
+            f.write(names)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+class SharedCatalog:
+    """
+    Read-only view of a catalog file written by :func:`build_catalog`
+
+    The file is memory-mapped and providers are decoded from it on access. Groups
+    of providers are returned as :class:`SharedCatalog` views and providers as new
+    :class:`TileProvider` objects, so modifying them never affects the file or other
+    processes. Use :meth:`to_bunch` to materialise the whole catalog.
+
+    Parameters
+    ----------
+    path : str
+        Path of the catalog file
+
+    Examples
+    --------
+    Build the catalog once, e.g. in the gunicorn master process:
+
+    >>> from xyzservices.shared import SharedCatalog, build_catalog
+    >>> build_catalog("/dev/shm/xyzservices.catalog")
+
+    and map it in every worker:
+
+    >>> providers = SharedCatalog("/dev/shm/xyzservices.catalog")
+    >>> providers.CartoDB.Positron.build_url()
+    >>> providers.query_name("cartodb positron")
+    """
+
+    def __init__(self, path: str, _parent=None, _group=None):
+        if _parent is not None:
+            self._root = _parent._root
+            self._map = _parent._map
+            self._tree = _parent._tree[_group]
+            self._group = _group
+            return
+
+        self._root = self
+        self._group = None
+        self._names = None
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, tree_length, names_length = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError(f"'{path}' is not an xyzservices catalog file.")
+        start = _HEADER.size
+        self._tree = marshal.loads(self._map[start : start + tree_length])
+        self._names_offset = start + tree_length
+        self._data_offset = self._names_offset + names_length
+
+    def __getitem__(self, key: str) -> SharedCatalog | TileProvider:
+        entry = self._tree[key]
+        if isinstance(entry, dict):
+            return SharedCatalog(None, _parent=self, _group=key)
+        return self._decode(entry)
+
+    def __getattr__(self, key):
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError as err:
+            raise AttributeError(key) from err
+
+    def __dir__(self):
+        return list(self._tree)
+
+    def __contains__(self, key) -> bool:
+        return key in self._tree
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._tree)
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def __repr__(self):
+        return f"<SharedCatalog with {len(self)} entries>"
+
+    def keys(self):
+        return self._tree.keys()
+
+    def items(self):
+        return ((key, self[key]) for key in self._tree)
+
+    def query_name(self, name: str) -> TileProvider:
+        """Return :class:`TileProvider` based on the name query
+
+        See :meth:`Bunch.query_name` for details.
+        """
+        root = self._root
+        if root._names is None:  # loaded on the first query only
+            root._names = marshal.loads(
+                self._map[root._names_offset : root._data_offset]
+            )
+        path = root._names.get(name.translate(QUERY_NAME_TRANSLATION).lower())
+        # providers outside of a group view do not match
+        if path is not None and self._group in (None, path[0]):
+            entry = root._tree
+            for key in path:
+                entry = entry[key]
+            return self._decode(entry)
+        raise ValueError(f"No matching provider found for the query '{name}'.")
+
+    def flatten(self) -> dict:
+        """Return a dictionary of all providers keyed by their names."""
+        return self.to_bunch().flatten()
+
+    def to_bunch(self) -> Bunch:
+        """Decode all providers into a regular :class:`Bunch`."""
+        bunch = Bunch()
+        for key, value in self.items():
+            bunch[key] = value.to_bunch() if isinstance(value, SharedCatalog) else value
+        return bunch
+
+    def close(self) -> None:
+        """Unmap the file. Views derived from this catalog become unusable."""
+        self._map.close()
+
+    def _decode(self, entry):
+        offset, length = entry
+        start = self._root._data_offset + offset
+        provider = TileProvider.__new__(TileProvider)
+        dict.update(provider, marshal.loads(self._map[start : start + length]))
+        return provider
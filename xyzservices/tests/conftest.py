@@ -0,0 +1,106 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+
+from xyzservices import TileProvider
+
+
+class StubTileServer(ThreadingHTTPServer):
+    """Local HTTP server standing in for a tile provider.
+
+    Every path returns its own bytes (e.g. ``b"/3/1/2.png"``) unless overridden in
+    ``tiles``. ``statuses`` maps paths to HTTP status codes and ``delay`` slows down
+    all responses. Paths in ``interrupted`` announce their full body but send only
+    half of it, after waiting the given number of seconds. Received requests are
+    recorded in ``requests``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.tiles = {}
+        self.statuses = {}
+        self.headers = {}
+        self.delay = 0
+        self.interrupted = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        pass  # e.g. client closed the connection after a timeout
+
+    def count(self, path):
+        with self.lock:
+            return sum(1 for p, _ in self.requests if p == path)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+        delay = server.delay(self.path) if callable(server.delay) else server.delay
+        if delay:
+            time.sleep(delay)
+        status = server.statuses.get(self.path, 200)
+        body = server.tiles.get(self.path, self.path.encode())
+        self.send_response(status)
+        for key, value in server.headers.get(self.path, {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.path in server.interrupted:
+            time.sleep(server.interrupted[self.path])
+            body = body[: len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    server = StubTileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_provider(tile_server):
+    return TileProvider(
+        url=tile_server.url + "/{z}/{x}/{y}.png",
+        attribution="(C) xyzservices",
+        name="stub",
+    )
+
+
+def _png(color, size=4, quadrants=None):
+    """PNG filled with ``color`` or with the four ``quadrants`` colours."""
+    from PIL import Image
+
+    image = Image.new("RGB", (size, size), color)
+    if quadrants is not None:
+        half = size // 2
+        for k, quadrant in enumerate(quadrants):
+            corner = (k % 2 * half, k // 2 * half)
+            image.paste(quadrant, (*corner, corner[0] + half, corner[1] + half))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def png():
+    """Factory of PNG tiles of solid colours (requires Pillow)."""
+    return _png
@@ -0,0 +1,333 @@
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+
+from xyzservices import TileProvider, use_credentials
+from xyzservices.cache import (
+    NegativeCache,
+    Prefetcher,
+    SingleFlight,
+    TileCache,
+    TileFetcher,
+    ZoomResolver,
+    _tile_key,
+)
+
+
+def test_tile_cache(tmp_path):
+    cache = TileCache(max_items=2)
+    cache.put(("a", 0, 0, 0, ""), b"0")
+    cache.put(("a", 1, 0, 0, ""), b"1")
+    assert cache.get(("a", 0, 0, 0, "")) == b"0"
+    cache.put(("a", 1, 1, 0, ""), b"2")
+    # least recently used is evicted
+    assert cache.get(("a", 1, 0, 0, "")) is None
+    assert ("a", 0, 0, 0, "") in cache
+
+    cache = TileCache(str(tmp_path), max_items=1)
+    cache.put(("Esri.WorldImagery", 3, 1, 2, "@2x"), b"tile")
+    cache.put(("Esri.WorldImagery", 3, 1, 3, ""), b"other")
+    assert (tmp_path / "Esri.WorldImagery" / "3" / "1" / "2@2x").read_bytes() == b"tile"
+    assert ("Esri.WorldImagery", 3, 1, 2, "@2x") in cache
+    assert (
+        TileCache(str(tmp_path)).get(("Esri.WorldImagery", 3, 1, 2, "@2x")) == b"tile"
+    )
+    assert cache.get(("Esri.WorldImagery", 3, 1, 4, "")) is None
+
+
+def test_tile_fetcher(tmp_path, tile_server, stub_provider):
+    fetcher = TileFetcher(TileCache(str(tmp_path)))
+    assert fetcher.fetch(stub_provider, 1, 2, 3) == b"/3/1/2.png"
+    assert fetcher.fetch(stub_provider, 1, 2, 3) == b"/3/1/2.png"
+    assert tile_server.count("/3/1/2.png") == 1
+
+    fetcher = TileFetcher(TileCache(str(tmp_path)))
+    assert fetcher.fetch(stub_provider, 1, 2, 3) == b"/3/1/2.png"
+    assert tile_server.count("/3/1/2.png") == 1
+
+
+def test_negative_cache(monkeypatch):
+    negative = NegativeCache(ttl=10, threshold=2)
+    for x in range(1000):
+        negative.add_missing(("a", 10, x, 5, ""))
+    negative.add_missing(("a", 10, 1023, 4, ""))
+    negative.add_missing(("a", 10, 1000, 5, ""))
+    assert negative.missing(("a", 10, 0, 5, ""))
+    assert negative.missing(("a", 10, 1023, 4, ""))
+    assert not negative.missing(("a", 10, 1001, 5, ""))
+    assert not negative.missing(("a", 10, 0, 5, "@2x"))
+    assert not negative.missing(("b", 10, 0, 5, ""))
+    # a single range across the end of row 4 and row 5
+    assert len(negative._zooms[("a", "", 10)][1][None]) == 1
+
+    # empty once identical content was seen for threshold tiles
+    assert not negative.add(("a", 10, 0, 0, ""), b"blank")
+    assert negative.empty(("a", 10, 0, 0, "")) is None
+    assert negative.add(("a", 10, 1, 0, ""), b"blank")
+    assert negative.add(("a", 11, 7, 0, ""), b"blank")
+    assert not negative.add(("a", 10, 2, 0, ""), b"x" * 4096)
+    assert negative.empty(("a", 11, 7, 0, "")) == b"blank"
+    assert ("a", 10, 1, 0, "") in negative
+    assert ("a", 10, 2, 0, "") not in negative
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert not negative.missing(("a", 10, 0, 5, ""))
+    assert negative.empty(("a", 11, 7, 0, "")) is None
+
+
+def test_negative_cache_invalid_tiles():
+    negative = NegativeCache(threshold=1)
+    # (2, 0) would share the row-major number of (0, 1) at zoom 1
+    negative.add_missing(("P", 1, 2, 0, ""))
+    assert not negative.missing(("P", 1, 0, 1, ""))
+    assert not negative.missing(("P", 1, 2, 0, ""))
+    assert not negative.add(("P", 1, 0, 2, ""), b"blank")
+    assert negative.empty(("P", 1, 0, 1, "")) is None
+
+    negative.add_missing(("P", 64, 1, 1, ""))
+    negative.add_missing(("P", 3, -1, 0, ""))
+    assert not negative.missing(("P", 64, 1, 1, ""))
+    assert negative._zooms == {}
+
+
+def test_tile_fetcher_negative(tile_server, stub_provider):
+    tile_server.statuses["/3/1/2.png"] = 404
+    for x in range(4):
+        tile_server.tiles[f"/3/{x}/0.png"] = b"blank"
+    cache = TileCache(max_items=1)
+    fetcher = TileFetcher(cache, negative=NegativeCache(threshold=2))
+
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError) as err:
+            fetcher.fetch(stub_provider, 1, 2, 3)
+        assert err.value.code == 404
+    assert tile_server.count("/3/1/2.png") == 1
+
+    for _ in range(2):
+        assert [fetcher.fetch(stub_provider, x, 0, 3) for x in range(4)] == [
+            b"blank"
+        ] * 4
+    assert all(tile_server.count(f"/3/{x}/0.png") == 1 for x in range(4))
+    # empty tiles do not take space in the cache
+    assert ("stub", 3, 3, 0, "") not in cache
+
+
+def test_tile_fetcher_credentials(tile_server):
+    provider = TileProvider(
+        url=tile_server.url + "/{z}/{x}/{y}.png?key={apikey}",
+        attribution="(C) xyzservices",
+        name="keyed",
+        apikey="<insert your api key here>",
+    )
+    tile_server.statuses["/3/1/2.png?key=b"] = 403
+    fetcher = TileFetcher(TileCache())
+    with use_credentials({"keyed": {"apikey": "a"}}):
+        assert fetcher.fetch(provider, 1, 2, 3) == b"/3/1/2.png?key=a"
+    # tiles and errors of other tenants are not shared
+    other_tenant = use_credentials({"keyed": {"apikey": "b"}})
+    with other_tenant, pytest.raises(urllib.error.HTTPError, match="403"):
+        fetcher.fetch(provider, 1, 2, 3)
+    with use_credentials({"keyed": {"apikey": "a"}, "other": {"apikey": "c"}}):
+        assert fetcher.fetch(provider, 1, 2, 3) == b"/3/1/2.png?key=a"
+    assert tile_server.count("/3/1/2.png?key=a") == 1
+    # credentials not filling the URL do not change the key
+    with use_credentials({"keyed": {"token": "x"}}):
+        assert _tile_key(provider, 1, 2, 3, None, {}) == ("keyed", 3, 1, 2, "")
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_prefetcher_pan(tile_server, stub_provider):
+    fetcher = TileFetcher()
+    with Prefetcher(fetcher) as prefetcher:
+        prefetcher.fetch("s", stub_provider, 4, 5, 4)
+        prefetcher.fetch("s", stub_provider, 5, 5, 4)
+        # panning east warms the tiles further east
+        _wait_for(lambda: ("stub", 4, 7, 5, "") in fetcher.cache)
+        assert ("stub", 4, 6, 5, "") in fetcher.cache
+        # first request has no history, its parent is warmed
+        _wait_for(lambda: ("stub", 3, 2, 2, "") in fetcher.cache)
+
+    assert prefetcher.fetch("s", stub_provider, 6, 5, 4) == b"/4/6/5.png"
+    assert tile_server.count("/4/6/5.png") == 1
+
+
+def test_prefetcher_zoom(stub_provider):
+    fetcher = TileFetcher()
+    with Prefetcher(fetcher) as prefetcher:
+        prefetcher.fetch("s", stub_provider, 1, 1, 2)
+        prefetcher.fetch("s", stub_provider, 2, 2, 3)
+        for x, y in [(4, 4), (5, 4), (4, 5), (5, 5)]:
+            _wait_for(lambda x=x, y=y: ("stub", 4, x, y, "") in fetcher.cache)
+
+
+def test_prefetcher_limits(tile_server, stub_provider):
+    # nothing outside of the zoom range or the world is requested
+    fetcher = TileFetcher()
+    with Prefetcher(fetcher) as prefetcher:
+        prefetcher.fetch("s", stub_provider(min_zoom=1), 0, 0, 1)
+        prefetcher.fetch("t", stub_provider(max_zoom=3), 3, 3, 2)
+        prefetcher.fetch("t", stub_provider(max_zoom=3), 3, 3, 3)
+        prefetcher.fetch("u", stub_provider, 3, 0, 2)
+        prefetcher.fetch("u", stub_provider, 3, 1, 2)
+        time.sleep(0.2)
+    paths = {path for path, _ in tile_server.requests}
+    assert not any(path.startswith(("/0/", "/4/")) for path in paths)
+    assert "/2/3/2.png" in paths
+    assert "/2/3/3.png" in paths
+
+
+def test_prefetcher_demand_first(tile_server, stub_provider):
+    released = threading.Event()
+    tile_server.delay = lambda _: released.wait(5) and 0
+
+    fetcher = TileFetcher()
+    with Prefetcher(fetcher, budget=2) as prefetcher:
+        blocked = threading.Thread(
+            target=prefetcher.fetch, args=("t", stub_provider, 0, 0, 0)
+        )
+        blocked.start()
+        _wait_for(lambda: tile_server.count("/0/0/0.png"))
+
+        tile_server.delay = 0
+        for x in range(4):
+            prefetcher.fetch("s", stub_provider, x, 5, 4)
+        time.sleep(0.2)
+        # no prefetching while a demand request is in progress
+        assert len(tile_server.requests) == 5
+
+        released.set()
+        blocked.join()
+        # only the newest predictions within the budget are fetched
+        _wait_for(lambda: prefetcher.prefetched == 2)
+        assert ("stub", 4, 5, 5, "") in fetcher.cache
+        assert ("stub", 4, 4, 5, "") in fetcher.cache
+
+    assert tile_server.count("/3/0/2.png") == 0
+
+
+def test_prefetcher_max_sessions(tile_server, stub_provider):
+    tile_server.delay = 0.05
+    with Prefetcher(TileFetcher(), max_workers=1, max_sessions=2) as prefetcher:
+        for session in range(5):
+            prefetcher.fetch(session, stub_provider, session, 5, 4)
+        prefetcher.fetch(3, stub_provider, 3, 6, 4)
+        with prefetcher._condition:
+            assert list(prefetcher._history) == [4, 3]
+            assert set(prefetcher._pending) <= {3, 4}
+        prefetcher.forget(3)
+        assert list(prefetcher._history) == [4]
+
+
+def test_prefetcher_credentials(tile_server):
+    provider = TileProvider(
+        url=tile_server.url + "/{z}/{x}/{y}.png?key={apikey}",
+        attribution="(C) xyzservices",
+        name="keyed",
+        apikey="<insert your api key here>",
+        min_zoom=1,
+    )
+    fetcher = TileFetcher()
+    with Prefetcher(fetcher) as prefetcher, use_credentials({"keyed": {"apikey": "a"}}):
+        prefetcher.fetch("t", provider, 0, 0, 1)
+        # the predicted parent is already cached under the key of the credentials
+        prefetcher.fetch("s", provider, 1, 1, 2)
+        time.sleep(0.2)
+    assert prefetcher.prefetched == 0
+    assert tile_server.count("/1/0/0.png?key=a") == 1
+
+
+def test_single_flight():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flights.do, "key", slow, 21)
+        started.wait(5)
+        followers = [executor.submit(flights.do, "key", slow, 0) for _ in range(3)]
+        _wait_for(lambda: flights.shared == 3)
+        release.set()
+        assert leader.result() == 42
+        assert [f.result() for f in followers] == [42, 42, 42]
+    assert calls == [21]
+
+    # the finished flight is forgotten, errors are shared too
+    with pytest.raises(ZeroDivisionError):
+        flights.do("key", lambda: 1 / 0)
+    assert flights.do("key", slow, 1) == 2
+
+
+def test_tile_fetcher_coalescing(tile_server, stub_provider):
+    tile_server.delay = 0.2
+    fetcher = TileFetcher()
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            executor.map(lambda _: fetcher.fetch(stub_provider, 1, 2, 3), range(8))
+        )
+    assert results == [b"/3/1/2.png"] * 8
+    assert tile_server.count("/3/1/2.png") == 1
+
+
+def _pixels(data):
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        return image.size, image.convert("RGB").getpixel((1, 1))
+
+
+def test_zoom_resolver_overzoom(tile_server, stub_provider, png):
+    pytest.importorskip("PIL")
+    quadrants = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+    tile_server.tiles["/2/1/1.png"] = png(quadrants[0], size=8, quadrants=quadrants)
+    resolver = ZoomResolver()
+    provider = stub_provider(max_zoom=2)
+
+    for k, color in enumerate(quadrants):
+        data = resolver.fetch(provider, 2 + k % 2, 2 + k // 2, 3)
+        assert _pixels(data) == ((8, 8), color)
+    # two levels deeper, top left quarter of the top left quadrant
+    assert _pixels(resolver.fetch(provider, 4, 4, 4)) == ((8, 8), quadrants[0])
+    assert tile_server.count("/2/1/1.png") == 1
+    assert ("stub", 3, 2, 2, "") in resolver.fetcher.cache
+
+    # within the zoom range tiles are passed through
+    assert resolver.fetch(provider, 1, 1, 2) == tile_server.tiles["/2/1/1.png"]
+
+
+def test_zoom_resolver_min_zoom(tile_server, stub_provider, png):
+    image_module = pytest.importorskip("PIL.Image")
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+    for k, color in enumerate(colors):
+        tile_server.tiles[f"/3/{2 + k % 2}/{2 + k // 2}.png"] = png(color, size=8)
+    resolver = ZoomResolver(max_levels=1)
+    provider = stub_provider(min_zoom=3)
+
+    data = resolver.fetch(provider, 1, 1, 2)
+    with image_module.open(BytesIO(data)) as image:
+        assert image.size == (8, 8)
+        assert image.getpixel((0, 0))[:3] == colors[0]
+        assert image.getpixel((7, 7))[:3] == colors[3]
+
+    with pytest.raises(ValueError, match="at most 1"):
+        resolver.fetch(provider, 0, 0, 1)
+    with pytest.raises(ValueError, match="Vector tiles"):
+        resolver.fetch(provider(format="application/x-protobuf"), 0, 0, 2)
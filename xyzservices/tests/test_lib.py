@@ -1,9 +1,24 @@
+import datetime
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import threading
 from urllib.error import URLError
 
 import pytest
 
 import xyzservices.providers as xyz
-from xyzservices import Bunch, TileProvider
+from xyzservices import Bunch, TileProvider, use_credentials
+from xyzservices.lib import (
+    VECTOR_FORMATS,
+    _from_dict,
+    _load_json,
+    _merge_providers,
+    _to_dict,
+)
 
 
 @pytest.fixture
@@ -267,3 +282,522 @@ def test_query_name():
     queried = xyz.query_name(option_with_underscore)
     assert isinstance(queried, TileProvider)
     assert queried.name == option_with_underscore
+
+
+def test_query_name_index_invalidation(test_bunch, basic_provider):
+    assert test_bunch.query_name("my public provider") is basic_provider
+
+    renamed = basic_provider(name="renamed_provider")
+    test_bunch["bunched"]["renamed"] = renamed
+    assert test_bunch.query_name("renamed provider") is renamed
+
+    del test_bunch["bunched"]["renamed"]
+    with pytest.raises(ValueError, match="No matching provider found"):
+        test_bunch.query_name("renamed provider")
+
+
+def test_caches_are_local(test_bunch, basic_provider):
+    exported = test_bunch.to_leaflet_json()
+    index = test_bunch._name_index()
+
+    # building or modifying unrelated Bunches keeps the caches
+    test_bunch.filter(name="retina")["extra"] = basic_provider
+    Bunch.from_json(io.StringIO(test_bunch.to_json()))
+    Bunch(other=Bunch())["other"]["new"] = basic_provider
+    assert test_bunch.to_leaflet_json() is exported
+    assert test_bunch._name_index() is index
+
+    # modifying a provider in place rebuilds the caches of the Bunches containing it
+    test_bunch["bunched"]["subdomain_provider"]["max_zoom"] = 3
+    assert test_bunch.to_leaflet_json() is not exported
+    assert test_bunch._name_index() is not index
+
+
+def test_pickle_drops_caches(test_bunch):
+    size = len(pickle.dumps(test_bunch))
+    test_bunch.query_name("my public provider")
+    provider = test_bunch.bunched.subdomain_provider
+    provider.build_url(1, 2, 3, fill_subdomain="round_robin")
+    assert len(pickle.dumps(test_bunch)) == size
+
+    restored = pickle.loads(pickle.dumps(test_bunch))
+    assert restored == test_bunch
+    assert restored.__dict__ == {}
+    assert isinstance(restored.bunched.subdomain_provider, TileProvider)
+    assert restored.bunched.subdomain_provider.__dict__ == {}
+    assert restored.query_name("my public provider") == test_bunch.basic_provider
+
+
+def test_merge_providers(test_bunch, basic_provider):
+    extra = _load_json(
+        """{
+        "internal": {
+            "url": "https://internal.com/{z}/{x}/{y}.png",
+            "attribution": "(C) internal",
+            "name": "internal"
+        },
+        "bunched": {
+            "subdomain_provider": {
+                "url": "https://{s}.internal.com/{z}/{x}/{y}.png",
+                "attribution": "(C) internal",
+                "name": "bunched.subdomain_provider"
+            },
+            "other": {
+                "url": "https://other.internal.com/{z}/{x}/{y}.png",
+                "attribution": "(C) internal",
+                "name": "bunched.other"
+            }
+        }
+    }"""
+    )
+    merged = _merge_providers(test_bunch, extra)
+    assert merged is test_bunch
+    assert set(merged.bunched) == {"html_attr_provider", "subdomain_provider", "other"}
+    assert merged.bunched.subdomain_provider.attribution == "(C) internal"
+    assert merged.basic_provider is basic_provider
+    assert merged.query_name("internal").url == "https://internal.com/{z}/{x}/{y}.png"
+    assert merged.query_name("bunched other").name == "bunched.other"
+
+
+def test_extra_catalogs_env(tmp_path):
+    catalog = tmp_path / "internal.json"
+    catalog.write_text(
+        '{"Internal": {"url": "https://internal.com/{z}/{x}/{y}.png", '
+        '"attribution": "(C) internal", "name": "Internal"}}'
+    )
+    env = dict(os.environ, XYZSERVICES_PROVIDERS_PATH=str(catalog))
+    code = (
+        "import xyzservices.providers as xyz;"
+        "print(xyz.query_name('internal').url, 'CartoDB' in xyz)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert out.stdout.strip() == "https://internal.com/{z}/{x}/{y}.png True"
+
+
+def test_register_catalog(tmp_path):
+    first = tmp_path / "internal.json"
+    first.write_text(
+        '{"Internal": {"Streets": {"url": "https://internal.com/{z}/{x}/{y}.png", '
+        '"attribution": "(C) internal", "name": "Internal.Streets"}}}'
+    )
+    second = tmp_path / "partners.json"
+    second.write_text(
+        '{"Internal": {"Aerial": {"url": "https://aerial.com/{z}/{x}/{y}.png", '
+        '"attribution": "(C) partner", "name": "Internal.Aerial"}}}'
+    )
+    # a new process, not to modify the catalog of the test session
+    code = (
+        "import xyzservices;"
+        "import xyzservices.providers as xyz;"
+        "xyz.query_name('CartoDB Positron');"
+        f"merged = xyzservices.register_catalog({str(first)!r});"
+        f"xyzservices.register_catalog([{str(second)!r}]);"
+        "print(merged is xyz, '+'.join(sorted(xyz.Internal)),"
+        " xyz.query_name('internal aerial').url)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        env=dict(os.environ, XYZSERVICES_CACHE_DIR=""),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    assert out == "True Aerial+Streets https://aerial.com/{z}/{x}/{y}.png"
+
+
+def _import_providers(env, code="print(len(xyz.flatten()))"):
+    return subprocess.run(
+        [sys.executable, "-c", "import xyzservices.providers as xyz;" + code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def test_catalog_snapshot_cache(tmp_path):
+    env = dict(os.environ, XYZSERVICES_CACHE_DIR=str(tmp_path))
+    cold = _import_providers(env)
+    snapshot = tmp_path / "providers.marshal"
+    assert snapshot.exists()
+    mtime = snapshot.stat().st_mtime_ns
+
+    warm = _import_providers(env)
+    assert warm == cold == str(len(xyz.flatten()))
+    assert snapshot.stat().st_mtime_ns == mtime  # served from the snapshot
+
+    warm = _import_providers(
+        env, "print(type(xyz.CartoDB.Positron).__name__, xyz.CartoDB.Positron.name)"
+    )
+    assert warm == "TileProvider CartoDB.Positron"
+
+
+def test_catalog_snapshot_cache_fallback(tmp_path):
+    # stale snapshot is ignored
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "providers.marshal").write_bytes(b"not a marshal snapshot")
+    env = dict(os.environ, XYZSERVICES_CACHE_DIR=str(cache_dir))
+    assert _import_providers(env) == str(len(xyz.flatten()))
+
+    # unwritable location
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    env = dict(os.environ, XYZSERVICES_CACHE_DIR=str(blocker / "cache"))
+    assert _import_providers(env) == str(len(xyz.flatten()))
+
+    # disabled
+    env = dict(os.environ, XYZSERVICES_CACHE_DIR="")
+    assert _import_providers(env) == str(len(xyz.flatten()))
+
+
+def test_from_dict_roundtrip(test_bunch):
+    data = _to_dict(test_bunch)
+    assert type(data) is dict
+    assert type(data["bunched"]["subdomain_provider"]) is dict
+
+    restored = _from_dict(data, validate=False)
+    assert restored == test_bunch
+    assert isinstance(restored.basic_provider, TileProvider)
+    assert isinstance(restored.bunched, Bunch)
+    assert restored.query_name("my_subdomain_provider").subdomains == "abcd"
+
+
+def test_json_roundtrip(tmp_path, test_bunch):
+    path = tmp_path / "providers.json"
+    with open(path, "w") as f:
+        assert test_bunch.to_json(f) is None
+    with open(path) as f:
+        restored = Bunch.from_json(f)
+    assert restored == test_bunch
+    assert isinstance(restored.bunched.subdomain_provider, TileProvider)
+    assert isinstance(restored.bunched, Bunch)
+
+    assert json.loads(test_bunch.to_json()) == test_bunch
+    assert "\n    " in test_bunch.to_json(indent=4)
+    assert ", " not in test_bunch.basic_provider.to_json()
+
+    with open(path, "rb") as f:
+        partial = Bunch.from_json(f, names=["bunched", "basic_provider"])
+    assert list(partial) == ["bunched", "basic_provider"]
+    assert partial.bunched == test_bunch.bunched
+
+    with open(path) as f, pytest.raises(KeyError, match="missing"):
+        Bunch.from_json(f, names=["basic_provider", "missing"])
+
+
+def test_build_url_subdomain_strategies(subdomain_provider):
+    expected = "https://a.myserver.com/tiles/3/1/2.png"
+    assert subdomain_provider.build_url(1, 2, 3, fill_subdomain="first") == expected
+
+    expected = "https://d.myserver.com/tiles/3/1/2.png"
+    assert subdomain_provider.build_url(1, 2, 3, fill_subdomain="hash") == expected
+    # subdomain is stable across zoom levels for the same x + y
+    assert subdomain_provider.build_url(1, 2, 4, fill_subdomain="hash")[8] == "d"
+    expected = "https://a.myserver.com/tiles/{z}/{x}/{y}.png"
+    assert subdomain_provider.build_url(fill_subdomain="hash") == expected
+
+    hosts = [
+        subdomain_provider.build_url(1, 2, 3, fill_subdomain="round_robin")[8]
+        for _ in range(8)
+    ]
+    assert "".join(hosts) == "abcdabcd"
+
+    for _ in range(10):
+        url = subdomain_provider.build_url(1, 2, 3, fill_subdomain="random")
+        assert url[8] in "abcd"
+
+    with pytest.raises(ValueError, match="Unknown subdomain strategy 'nearest'"):
+        subdomain_provider.build_url(1, 2, 3, fill_subdomain="nearest")
+
+
+def test_build_urls(
+    basic_provider, retina_provider, private_provider, subdomain_provider
+):
+    tiles = [(1, 2, 3), (2, 2, 3), (3, 2, 3)]
+    assert basic_provider.build_urls(tiles) == [
+        basic_provider.build_url(*tile) for tile in tiles
+    ]
+    assert retina_provider.build_urls(tiles, scale_factor="@3x") == [
+        retina_provider.build_url(*tile, scale_factor="@3x") for tile in tiles
+    ]
+    assert private_provider.build_urls(tiles[:1], accessToken="my{token}") == [
+        "https://myserver.com/tiles/3/1/2?access_token=my{token}"
+    ]
+    assert subdomain_provider.build_urls(tiles, fill_subdomain="hash") == [
+        "https://d.myserver.com/tiles/3/1/2.png",
+        "https://a.myserver.com/tiles/3/2/2.png",
+        "https://b.myserver.com/tiles/3/3/2.png",
+    ]
+    assert subdomain_provider.build_urls(tiles[:1], fill_subdomain=False) == [
+        "https://{s}.myserver.com/tiles/3/1/2.png"
+    ]
+
+    with pytest.raises(ValueError, match="Token is required for this provider"):
+        private_provider.build_urls(tiles)
+
+
+def test_build_time_urls(basic_provider, subdomain_provider):
+    provider = subdomain_provider(
+        url="https://{s}.myserver.com/{time}/{z}/{x}/{y}.png", time=""
+    )
+    times = [
+        "2024-06-01",
+        datetime.date(2024, 6, 2),
+        datetime.datetime(2024, 6, 3),
+        datetime.datetime(2024, 6, 3, 14, tzinfo=datetime.timezone.utc),
+    ]
+    urls = provider.build_time_urls(
+        [(1, 2, 3), (2, 2, 3)], times, fill_subdomain="hash"
+    )
+    assert list(urls)[:3] == [
+        ("2024-06-01", 3, 1, 2),
+        ("2024-06-01", 3, 2, 2),
+        ("2024-06-02", 3, 1, 2),
+    ]
+    assert len(urls) == 8
+    assert urls["2024-06-03T00:00:00Z", 3, 2, 2] == (
+        "https://a.myserver.com/2024-06-03T00:00:00Z/3/2/2.png"
+    )
+    assert urls["2024-06-03T14:00:00Z", 3, 1, 2] == (
+        "https://d.myserver.com/2024-06-03T14:00:00Z/3/1/2.png"
+    )
+
+    with pytest.raises(ValueError, match="does not depend on time"):
+        basic_provider.build_time_urls([(1, 2, 3)], ["2024-06-01"])
+
+    # an hourly series is formatted alike, including midnight
+    hours = [datetime.datetime(2024, 6, 1, h) for h in range(2)]
+    assert [t for t, _, _, _ in provider.build_time_urls([(1, 2, 3)], hours)] == [
+        "2024-06-01T00:00:00Z",
+        "2024-06-01T01:00:00Z",
+    ]
+
+
+def test_use_credentials(private_provider):
+    grouped = private_provider(name="Group.Private")
+    assert private_provider.requires_token()
+
+    with use_credentials({"myserver.com": {"accessToken": "host"}}):
+        assert not private_provider.requires_token()
+        assert private_provider.build_url(1, 2, 3).endswith("access_token=host")
+        with use_credentials({"Group": {"accessToken": "group"}}):
+            assert grouped.build_url(1, 2, 3).endswith("access_token=group")
+            assert private_provider.build_url(1, 2, 3).endswith("access_token=host")
+            with use_credentials({"Group.Private": {"accessToken": "provider"}}):
+                assert grouped.build_url(1, 2, 3).endswith("access_token=provider")
+                assert grouped.build_url(1, 2, 3, accessToken="kw").endswith("=kw")
+        assert grouped.build_url(1, 2, 3).endswith("access_token=host")
+
+    with use_credentials({"other.com": {"accessToken": "other"}}):
+        assert private_provider.requires_token()
+    # the provider itself is never modified
+    assert private_provider.requires_token()
+    assert private_provider["accessToken"] == "<insert your access token here>"
+
+    # separate per thread
+    urls = {}
+    barrier = threading.Barrier(2)
+
+    def _build(tenant):
+        with use_credentials({"my_private_provider": {"accessToken": tenant}}):
+            barrier.wait()
+            urls[tenant] = private_provider.build_url(1, 2, 3)
+
+    threads = [threading.Thread(target=_build, args=(t,)) for t in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert urls["a"].endswith("access_token=a")
+    assert urls["b"].endswith("access_token=b")
+
+
+def test_use_credentials_after_modification(private_provider):
+    provider = private_provider(name="Group.Private")
+    with use_credentials(
+        {"myserver.com": {"accessToken": "host"}, "other.com": {"accessToken": "new"}}
+    ):
+        assert provider.build_url(1, 2, 3).endswith("access_token=host")
+        # the host and name prefixes are looked up again once the provider changes
+        provider["url"] = provider["url"].replace("myserver.com", "other.com")
+        assert provider.build_url(1, 2, 3).endswith("access_token=new")
+        assert provider.build_url(1, 2, 3, scale_factor="@2x").endswith("=new")
+
+
+def test_to_leaflet(html_attr_provider, subdomain_provider):
+    provider = subdomain_provider(
+        max_zoom=18, min_zoom=2, tileSize=512, bounds=[[0, 0], [1, 1]], status="ok"
+    )
+    assert provider.to_leaflet() == {
+        "url": "https://{s}.myserver.com/tiles/{z}/{x}/{y}.png",
+        "options": {
+            "attribution": "(C) xyzservices",
+            "subdomains": "abcd",
+            "maxZoom": 18,
+            "minZoom": 2,
+            "tileSize": 512,
+            "bounds": [[0, 0], [1, 1]],
+        },
+    }
+    assert html_attr_provider.to_leaflet()["options"]["attribution"] == (
+        '&copy; <a href="https://xyzservices.readthedocs.io">xyzservices</a>'
+    )
+
+
+def test_to_leaflet_json(test_bunch, basic_provider):
+    exported = test_bunch.to_leaflet_json()
+    assert '", "' not in exported and '": ' not in exported  # compact separators
+    layers = json.loads(exported)
+    assert set(layers) == set(test_bunch.flatten())
+    assert layers["my_public_provider"] == basic_provider.to_leaflet()
+
+    assert test_bunch.to_leaflet_json() is exported  # cached
+
+    test_bunch["bunched"]["new"] = basic_provider(name="new_provider")
+    updated = json.loads(test_bunch.to_leaflet_json())
+    assert "new_provider" in updated
+
+    filtered = json.loads(test_bunch.filter(name="retina").to_leaflet_json())
+    assert list(filtered) == ["my_public_retina_provider3"]
+
+
+def test_estimate_tiles(basic_provider):
+    world = (-180, -90, 180, 90)
+    estimate = basic_provider.estimate_tiles(world, range(0, 5))
+    assert estimate == {
+        "tiles": 341,
+        "bytes": None,
+        "zooms": {0: 1, 1: 4, 2: 16, 3: 64, 4: 256},
+    }
+    assert basic_provider.estimate_tiles(world, 19)["tiles"] == 4**19
+
+    # tile aligned box covers exactly one tile
+    assert basic_provider.estimate_tiles((0, 0, 90, 66.51326044311186), 2)["tiles"] == 1
+    # antimeridian
+    assert basic_provider.estimate_tiles((170, -10, -170, 10), 2)["tiles"] == 4
+
+    estimate = basic_provider.estimate_tiles(world, 1, average_tile_size=1000)
+    assert estimate["bytes"] == 4000
+
+
+def test_estimate_tiles_clip(basic_provider):
+    provider = basic_provider(min_zoom=2, max_zoom=3, bounds=[[0, 0], [85, 180]])
+    estimate = provider.estimate_tiles((-180, -90, 180, 90), range(0, 5))
+    assert estimate["zooms"] == {0: 0, 1: 0, 2: 4, 3: 16, 4: 0}
+    assert estimate["tiles"] == 20
+
+    # outside of bounds
+    assert provider.estimate_tiles((-20, -20, -10, -10), 3)["tiles"] == 0
+
+
+def test_tile_range(basic_provider):
+    assert basic_provider.tile_range(3) == (0, 7, 0, 7)
+    assert basic_provider.covers(7, 7, 3)
+    assert not basic_provider.covers(8, 0, 3)
+
+    provider = basic_provider(min_zoom=2, max_zoom=3, bounds=[[0, 0], [85, 180]])
+    assert provider.tile_range(1) is None
+    assert provider.tile_range(3) == (4, 7, 0, 3)
+    assert provider.covers(4, 3, 3)
+    assert not provider.covers(3, 3, 3)
+    assert not provider.covers(0, 0, 4)
+
+    # recomputed once the provider changes
+    provider["bounds"] = [[-85, -180], [0, 0]]
+    assert provider.tile_range(3) == (0, 3, 4, 7)
+
+    tiles = [(3, 4, 3), (4, 4, 3), (1, 5, 3), (4, 0, 1)]
+    assert provider.build_urls(tiles, clip=True) == [
+        "https://myserver.com/tiles/3/3/4.png",
+        "https://myserver.com/tiles/3/1/5.png",
+    ]
+
+
+def test_tile_range_tile_matrices(basic_provider):
+    provider = basic_provider(
+        crs="EPSG:2154",
+        bounds=[[41, -6], [52, 10]],
+        max_zoom=7,
+        tile_matrices=[[6, 1400.0, 0.0, 12000000.0, 4, 5]],
+    )
+    # the whole matrix, bounds in degrees do not apply to the Lambert-93 grid
+    assert provider.tile_range(6) == (0, 3, 0, 4)
+    assert provider.tile_range(7) is None
+    assert provider.covers(3, 4, 6)
+    assert not provider.covers(4, 0, 6)
+    assert provider.build_urls([(3, 4, 6), (4, 0, 6), (0, 0, 7)], clip=True) == [
+        "https://myserver.com/tiles/6/3/4.png"
+    ]
+
+    for grid in [{"crs": "EPSG:2154"}, {"TileMatrixSet": "2154_10cm_6_20"}]:
+        with pytest.raises(ValueError, match="tile_matrices"):
+            basic_provider(**grid).covers(0, 0, 6)
+    with pytest.raises(ValueError, match="Web Mercator tile grid"):
+        basic_provider(crs="EPSG:2154").estimate_tiles((0, 45, 1, 46), 6)
+    assert basic_provider(TileMatrixSet="PM_0_19").tile_range(1) == (0, 1, 0, 1)
+
+
+@pytest.fixture
+def quadkey_provider():
+    return TileProvider(
+        url="https://ecn.t{s}.tiles.virtualearth.net/tiles/a{q}.jpeg?g=1",
+        attribution="(C) xyzservices",
+        subdomains="0123",
+        name="my_quadkey_provider",
+    )
+
+
+def test_build_url_quadkey(quadkey_provider):
+    expected = "https://ecn.t0.tiles.virtualearth.net/tiles/a213.jpeg?g=1"
+    assert quadkey_provider.build_url(3, 5, 3) == expected
+    expected = "https://ecn.t0.tiles.virtualearth.net/tiles/a1202102332221212.jpeg?g=1"
+    assert quadkey_provider.build_url(35210, 21493, 16) == expected
+    expected = "https://ecn.t0.tiles.virtualearth.net/tiles/a.jpeg?g=1"
+    assert quadkey_provider.build_url(0, 0, 0) == expected
+    expected = "https://ecn.t{s}.tiles.virtualearth.net/tiles/a{q}.jpeg?g=1"
+    assert quadkey_provider.build_url(fill_subdomain=False) == expected
+
+    assert quadkey_provider.build_urls([(3, 5, 3), (0, 1, 1)]) == [
+        "https://ecn.t0.tiles.virtualearth.net/tiles/a213.jpeg?g=1",
+        "https://ecn.t0.tiles.virtualearth.net/tiles/a2.jpeg?g=1",
+    ]
+
+
+def test_build_url_tms(basic_provider):
+    provider = basic_provider(url="https://myserver.com/tms/{z}/{x}/{-y}.png")
+    assert provider.build_url(1, 2, 3) == "https://myserver.com/tms/3/1/5.png"
+    assert provider.build_url() == "https://myserver.com/tms/{z}/{x}/{-y}.png"
+    assert provider.build_urls([(1, 2, 3), (0, 0, 1)]) == [
+        "https://myserver.com/tms/3/1/5.png",
+        "https://myserver.com/tms/1/0/1.png",
+    ]
+
+    # leaflet's tms option inverts {y}
+    provider = basic_provider(tms=True)
+    assert provider.build_url(1, 2, 3) == "https://myserver.com/tiles/3/1/5.png"
+    assert provider.build_urls([(1, 2, 3)]) == ["https://myserver.com/tiles/3/1/5.png"]
+
+
+def test_tile_format(basic_provider, retina_provider):
+    assert basic_provider.tile_format() == "image/png"
+    assert retina_provider.tile_format() == "image/png"
+    assert basic_provider(
+        url="https://a.b/{z}/{x}/{y}.{ext}", ext="jpg"
+    ).tile_format() == ("image/jpeg")
+    assert basic_provider(url="https://a.b/{z}/{x}/{y}.pbf?key=1").tile_format() == (
+        "application/x-protobuf"
+    )
+    assert basic_provider(url="https://a.b/{z}/{x}/{y}").tile_format() is None
+
+    wmts = basic_provider(
+        url="https://a.b/wmts?FORMAT={format}&TILEMATRIX={z}&TILEROW={y}&TILECOL={x}",
+        format="application/x-protobuf",
+    )
+    assert wmts.tile_format() in VECTOR_FORMATS
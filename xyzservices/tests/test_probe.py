@@ -0,0 +1,136 @@
+import threading
+import time
+
+from xyzservices import Bunch, TileProvider
+from xyzservices.probe import (
+    BROKEN,
+    probe_provider,
+    probe_providers,
+    representative_tiles,
+)
+
+
+def _provider(url, name, **kwargs):
+    return TileProvider(url=url, attribution="(C) xyzservices", name=name, **kwargs)
+
+
+def test_representative_tiles():
+    provider = _provider("https://myserver.com/{z}/{x}/{y}.png", "p")
+    assert representative_tiles(provider) == [(512, 512, 10), (0, 0, 0)]
+
+    provider = _provider(
+        "https://myserver.com/{z}/{x}/{y}.png",
+        "p",
+        min_zoom=4,
+        max_zoom=8,
+        bounds=[[40, 10], [50, 20]],
+    )
+    assert representative_tiles(provider) == [(34, 23, 6), (8, 5, 4)]
+
+
+def test_probe_provider(tile_server):
+    provider = _provider(tile_server.url + "/{z}/{x}/{y}.png", "p")
+    assert probe_provider(provider) == "ok"
+
+    tile_server.statuses["/10/512/512.png"] = 403
+    assert probe_provider(provider) == "token"
+
+    # falls back to the tile at min_zoom
+    tile_server.statuses["/10/512/512.png"] = 404
+    assert probe_provider(provider) == "ok"
+    tile_server.statuses["/0/0/0.png"] = 404
+    assert probe_provider(provider) == "not_found"
+
+    tile_server.statuses["/10/512/512.png"] = 503
+    assert probe_provider(provider) == "server_error"
+    tile_server.statuses["/10/512/512.png"] = 429
+    assert probe_provider(provider) == "rate_limited"
+
+    tile_server.statuses["/10/512/512.png"] = 200
+    tile_server.delay = 0.5
+    assert probe_provider(provider, timeout=0.1) == "timeout"
+
+    provider = _provider("http://127.0.0.1:1/{z}/{x}/{y}.png", "p")
+    assert probe_provider(provider) == "error"
+
+    provider = _provider(
+        tile_server.url + "/{z}/{x}/{y}.png?key={key}",
+        "p",
+        key="<insert your key here>",
+    )
+    assert probe_provider(provider) == "token"
+    assert len(tile_server.requests) == 9
+
+
+def test_probe_providers_concurrency(tile_server):
+    active = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def delay(path):
+        with lock:
+            active.append(path)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(path)
+        return 0
+
+    tile_server.delay = delay
+    tile_server.statuses["/5/16/16.png?v=0"] = 404
+    tile_server.statuses["/0/0/0.png?v=0"] = 404
+
+    bunch = Bunch(
+        {
+            f"p{i}": _provider(
+                tile_server.url + f"/{{z}}/{{x}}/{{y}}.png?v={i}",
+                f"p{i}",
+                max_zoom=10 if i == 0 else 10 + i % 3,
+            )
+            for i in range(12)
+        }
+    )
+    bunch["b"] = Bunch(
+        token=_provider(
+            tile_server.url + "/{z}/{x}/{y}.png?k={k}", "b.token", k="<insert your k>"
+        )
+    )
+
+    start = time.perf_counter()
+    results = probe_providers(bunch, per_host=3)
+    elapsed = time.perf_counter() - start
+
+    assert list(results) == list(bunch.flatten())
+    assert results["p0"] == "not_found"
+    assert results["b.token"] == "token"
+    assert set(results.values()) == {"ok", "not_found", "token"}
+    assert peak[0] <= 3
+    assert elapsed < 12 * 0.05 * 2  # not sequential
+
+
+def test_probe_providers_retries(tile_server):
+    bunch = Bunch(
+        flaky=_provider(tile_server.url + "/flaky/{z}/{x}/{y}.png", "flaky"),
+        gone=_provider(tile_server.url + "/gone/{z}/{x}/{y}.png", "gone"),
+        fine=_provider(tile_server.url + "/fine/{z}/{x}/{y}.png", "fine"),
+    )
+    for path in ["/flaky/10/512/512.png", "/gone/10/512/512.png"]:
+        tile_server.statuses[path] = 429 if "flaky" in path else 410
+    tile_server.statuses["/gone/0/0/0.png"] = 404
+
+    flaky = []
+
+    def recover(path):
+        # rate limited only the first time
+        if path.startswith("/flaky/"):
+            flaky.append(path)
+            if len(flaky) > 1:
+                tile_server.statuses.pop(path, None)
+        return 0
+
+    tile_server.delay = recover
+    results = probe_providers(bunch, retries=2, retry_delay=0)
+    assert results == {"flaky": "ok", "gone": "not_found", "fine": "ok"}
+    assert tile_server.count("/fine/10/512/512.png") == 1
+    assert tile_server.count("/gone/10/512/512.png") == 3
+    assert BROKEN == ("not_found", "server_error")
@@ -0,0 +1,138 @@
+import datetime
+import importlib.util
+import pathlib
+
+import pytest
+
+SCRIPT = (
+    pathlib.Path(__file__).parents[2]
+    / "provider_sources"
+    / "_parse_leaflet_providers.py"
+)
+
+if not SCRIPT.exists():  # e.g. installed from a wheel
+    pytest.skip("provider_sources are not available", allow_module_level=True)
+
+_spec = importlib.util.spec_from_file_location("_parse_leaflet_providers", SCRIPT)
+parser = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(parser)
+
+# excerpt of leaflet-providers.js in the format used upstream
+LEAFLET_PROVIDERS = r"""
+(function (root, factory) {
+	if (typeof define === 'function' && define.amd) {
+		define(['leaflet'], factory);
+	} else {
+		factory(window.L);
+	}
+}(this, function (L) {
+	'use strict';
+
+	L.TileLayer.Provider = L.TileLayer.extend({});
+
+	/* multi-line comment: {not: 'parsed'} */
+	L.TileLayer.Provider.providers = {
+		OpenStreetMap: {
+			url: 'https://tile.openstreetmap.org/{z}/{x}/{y}.png',
+			options: {
+				maxZoom: 19,
+				attribution:
+					'&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+			},
+			variants: {
+				Mapnik: {},
+				DE: {
+					url: 'https://tile.openstreetmap.de/{z}/{x}/{y}.png',
+					options: {
+						maxZoom: 18
+					}
+				},
+				France: {
+					url: 'https://{s}.tile.openstreetmap.fr/osmfr/{z}/{x}/{y}.png',
+					options: {
+						maxZoom: 20,
+						attribution: '&copy; OpenStreetMap France | {attribution.OpenStreetMap}'
+					}
+				}
+			}
+		},
+		HEREv3: {
+			url:
+				'https://{s}.{base}.maps.ls.hereapi.com/maptile/2.1/' +
+				'{type}/{mapID}/{variant}/{z}/{x}/{y}/{size}/{format}?' +
+				'apiKey={apiKey}&lg={language}',
+			options: {
+				attribution:
+					'Map &copy; 1987-' + new Date().getFullYear() + ' <a href="http://developer.here.com">HERE</a>',
+				subdomains: '1234',
+				apiKey: '<insert your apiKey here>',
+				bounds: [[-85.0, -180], [85.0, 180.0]],
+				detectRetina: undefined, // dropped, as by JSON.stringify
+				"quoted": "it\'s é"
+			},
+			variants: {
+				normalDay: 'normal.day',
+				normalDayCustom: 'normal.day.custom'
+			}
+		},
+		Esri: {
+			url: 'https://server.arcgisonline.com/ArcGIS/rest/services/{variant}/MapServer/tile/{z}/{y}/{x}',
+			options: {
+				variant: 'World_Street_Map',
+				attribution: 'Tiles &copy; Esri'
+			}
+		}
+	};
+
+	L.tileLayer.provider = function (provider, options) {
+		return new L.TileLayer.Provider(provider, options);
+	};
+}));
+"""  # noqa: E501
+
+
+def test_parse_providers():
+    data = parser.parse_providers(LEAFLET_PROVIDERS)
+    assert list(data) == ["OpenStreetMap", "HEREv3", "Esri"]
+    assert data["OpenStreetMap"]["variants"]["DE"] == {
+        "url": "https://tile.openstreetmap.de/{z}/{x}/{y}.png",
+        "options": {"maxZoom": 18},
+    }
+    here = data["HEREv3"]
+    year = datetime.date.today().year
+    assert here["url"] == (
+        "https://{s}.{base}.maps.ls.hereapi.com/maptile/2.1/"
+        "{type}/{mapID}/{variant}/{z}/{x}/{y}/{size}/{format}?"
+        "apiKey={apiKey}&lg={language}"
+    )
+    assert here["options"]["attribution"].startswith(f"Map &copy; 1987-{year} <a")
+    assert here["options"]["bounds"] == [[-85.0, -180], [85.0, 180.0]]
+    assert "detectRetina" not in here["options"]
+    assert here["options"]["quoted"] == "it's é"
+    assert here["variants"]["normalDay"] == "normal.day"
+
+
+def test_parse_providers_errors():
+    with pytest.raises(ValueError, match="not found"):
+        parser.parse_providers("var providers = {};")
+    with pytest.raises(ValueError, match="Unsupported expression 'foo'"):
+        parser.parse_providers("L.TileLayer.Provider.providers = {a: foo()};")
+    with pytest.raises(ValueError, match="Unexpected end"):
+        parser.parse_providers("L.TileLayer.Provider.providers = {a: 1")
+
+
+def test_process_data():
+    pytest.importorskip("html2text")
+    result = parser.process_data(parser.parse_providers(LEAFLET_PROVIDERS))
+    france = result["OpenStreetMap"]["France"]
+    assert france["name"] == "OpenStreetMap.France"
+    assert france["max_zoom"] == 20
+    assert france["html_attribution"] == (
+        '&copy; OpenStreetMap France | &copy; <a href="https://www.openstreetmap.org'
+        '/copyright">OpenStreetMap</a> contributors'
+    )
+    assert france["attribution"] == (
+        "(C) OpenStreetMap France | (C) OpenStreetMap contributors"
+    )
+    assert result["HEREv3"]["normalDay"]["variant"] == "normal.day"
+    assert result["Esri"]["name"] == "Esri"
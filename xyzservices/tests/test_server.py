@@ -0,0 +1,227 @@
+import asyncio
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from xyzservices import Bunch, TileProvider
+from xyzservices.__main__ import _parse_tokens
+from xyzservices.cache import NegativeCache, TileCache
+from xyzservices.server import TileProxy, _content_type
+
+
+@pytest.fixture
+def proxy(tmp_path, tile_server):
+    providers = Bunch(
+        Stub=Bunch(
+            Tiles=TileProvider(
+                url=tile_server.url + "/{z}/{x}/{y}{r}.png",
+                attribution="(C) xyzservices",
+                name="Stub.Tiles",
+            ),
+            Keyed=TileProvider(
+                url=tile_server.url + "/{z}/{x}/{y}.png?key={apikey}",
+                attribution="(C) xyzservices",
+                name="Stub.Keyed",
+                apikey="<insert your api key here>",
+            ),
+        ),
+        Other=TileProvider(
+            url=tile_server.url + "/other/{z}/{x}/{y}.png?key={apikey}",
+            attribution="(C) xyzservices",
+            name="Other",
+            apikey="<insert your api key here>",
+        ),
+    )
+    proxy = TileProxy(
+        providers,
+        TileCache(str(tmp_path)),
+        tokens={"Stub": {"apikey": "group"}, "Stub.Keyed": {"apikey": "secret"}},
+    )
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = asyncio.run_coroutine_threadsafe(
+        proxy.start("127.0.0.1", 0), loop
+    ).result()
+    proxy.port = server.sockets[0].getsockname()[1]
+    yield proxy
+
+    async def _shutdown():
+        server.close()
+        await server.wait_closed()
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(_shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def _get(proxy, *paths, method="GET"):
+    connection = http.client.HTTPConnection("127.0.0.1", proxy.port, timeout=5)
+    responses = []
+    for path in paths:
+        connection.request(method, path)
+        response = connection.getresponse()
+        responses.append((response.status, dict(response.headers), response.read()))
+    connection.close()
+    return responses
+
+
+def test_proxy_cache(tmp_path, tile_server, proxy):
+    # two requests over a single keep-alive connection
+    (status, headers, body), (_, cached_headers, cached) = _get(
+        proxy, "/Stub.Tiles/3/1/2.png", "/stub-tiles/3/1/2"
+    )
+    assert status == 200
+    assert body == cached == b"/3/1/2.png"
+    assert headers["X-Cache"] == "MISS"
+    assert cached_headers["X-Cache"] == "HIT"
+    assert tile_server.count("/3/1/2.png") == 1
+    assert (tmp_path / "Stub.Tiles" / "3" / "1" / "2").read_bytes() == body
+
+    [(status, _, body)] = _get(proxy, "/Stub.Tiles/3/1/2@2x.png")
+    assert body == b"/3/1/2@2x.png"
+
+    [(status, headers, body)] = _get(proxy, "/Stub.Tiles/3/1/2.png", method="HEAD")
+    assert status == 200
+    assert headers["Content-Length"] == "10"
+    assert body == b""
+
+
+def test_proxy_coalescing(tile_server, proxy):
+    tile_server.delay = 0.3
+    with ThreadPoolExecutor(6) as executor:
+        responses = list(
+            executor.map(lambda _: _get(proxy, "/Stub.Tiles/2/1/1.png")[0], range(6))
+        )
+    assert tile_server.count("/2/1/1.png") == 1
+    assert [body for _, _, body in responses] == [b"/2/1/1.png"] * 6
+    assert sorted(headers["X-Cache"] for _, headers, _ in responses) == [
+        "COALESCED"
+    ] * 5 + ["MISS"]
+
+    tile_server.statuses["/2/1/2.png"] = 404
+    with ThreadPoolExecutor(3) as executor:
+        responses = list(
+            executor.map(lambda _: _get(proxy, "/Stub.Tiles/2/1/2.png")[0], range(3))
+        )
+    assert [status for status, _, _ in responses] == [404] * 3
+    assert tile_server.count("/2/1/2.png") == 1
+
+
+def test_proxy_tokens(tile_server, proxy):
+    [(status, _, body)] = _get(proxy, "/Stub.Keyed/1/0/0.png")
+    assert status == 200
+    assert body == b"/1/0/0.png?key=secret"
+
+    # no token configured
+    [(status, _, _)] = _get(proxy, "/Other/1/0/0.png")
+    assert status == 403
+    assert not any(path.startswith("/other") for path, _ in tile_server.requests)
+
+    # providers are not copied, the tokens apply to the requests
+    assert proxy.resolve("Stub.Keyed") is proxy.providers.Stub.Keyed
+    assert proxy.providers.Stub.Keyed.requires_token()
+    deadline = time.monotonic() + 5
+    while not proxy.cache._memory and time.monotonic() < deadline:
+        time.sleep(0.01)  # the tile is cached after the response
+    [name] = {key[0] for key in proxy.cache._memory}
+    assert name.startswith("Stub.Keyed#")
+
+
+def test_proxy_errors(tile_server, proxy):
+    tile_server.statuses["/3/1/2.png"] = 404
+    tile_server.statuses["/3/1/3.png"] = 503
+    responses = _get(
+        proxy,
+        "/Stub.Tiles/3/1/2.png",
+        "/Stub.Tiles/3/1/3.png",
+        "/Unknown/3/1/2.png",
+        "/Stub.Tiles/3/1",
+    )
+    assert [status for status, _, _ in responses] == [404, 503, 404, 404]
+
+    # errors are not cached
+    tile_server.statuses.clear()
+    [(status, _, body)] = _get(proxy, "/Stub.Tiles/3/1/2.png")
+    assert status == 200
+
+
+def test_proxy_url_errors(proxy):
+    proxy.providers["Timed"] = TileProvider(
+        url="https://myserver.com/{time}/{z}/{x}/{y}.png",
+        attribution="(C) xyzservices",
+        name="Timed",
+    )
+    proxy.providers["Broken"] = TileProvider(
+        url="https://myserver.com/{z}/{x}/{y}.png?v={variant:d}",
+        attribution="(C) xyzservices",
+        name="Broken",
+        variant="abc",
+    )
+    responses = _get(proxy, "/Timed/3/1/2.png", "/Broken/3/1/2.png", "/Timed/3/1/2")
+    assert [status for status, _, _ in responses] == [400, 502, 400]
+
+
+@pytest.mark.parametrize("stall", [0, 1], ids=["incomplete", "timeout"])
+def test_proxy_interrupted_upstream(tile_server, proxy, stall):
+    proxy.timeout = 0.2
+    tile_server.interrupted["/3/1/2.png"] = stall
+    connection = http.client.HTTPConnection("127.0.0.1", proxy.port, timeout=5)
+    connection.request("GET", "/Stub.Tiles/3/1/2.png")
+    response = connection.getresponse()
+    assert response.status == 200
+    with pytest.raises(http.client.IncompleteRead):
+        response.read()
+    connection.close()
+
+    # the incomplete tile is not cached
+    tile_server.interrupted.clear()
+    [(status, headers, body)] = _get(proxy, "/Stub.Tiles/3/1/2.png")
+    assert status == 200
+    assert body == b"/3/1/2.png"
+    assert headers["X-Cache"] == "MISS"
+
+
+def test_proxy_negative(tile_server, proxy):
+    proxy.negative = NegativeCache()
+    tile_server.statuses["/3/1/2.png"] = 404
+    responses = _get(proxy, "/Stub.Tiles/3/1/2.png", "/Stub.Tiles/3/1/2.png")
+    assert [status for status, _, _ in responses] == [404, 404]
+    assert responses[1][1]["X-Cache"] == "NEGATIVE"
+    assert tile_server.count("/3/1/2.png") == 1
+
+
+def test_proxy_invalid_tile(tile_server, proxy):
+    proxy.negative = NegativeCache()
+    tile_server.statuses["/1/2/0.png"] = 404
+    responses = _get(
+        proxy, "/Stub.Tiles/1/2/0.png", "/Stub.Tiles/1/0/1.png", "/Stub.Tiles/64/1/1"
+    )
+    assert [status for status, _, _ in responses] == [400, 200, 400]
+    assert tile_server.count("/1/2/0.png") == 0
+
+
+def test_content_type():
+    assert _content_type(b"\x89PNG\r\n\x1a\n...") == "image/png"
+    assert _content_type(b"\xff\xd8\xff\xe0") == "image/jpeg"
+    assert _content_type(b"RIFF\x00\x00\x00\x00WEBPVP8") == "image/webp"
+    assert _content_type(b"\x1a\x03") == "application/octet-stream"
+
+
+def test_parse_tokens():
+    assert _parse_tokens(
+        ["Thunderforest:apikey=abc", "Jawg.Streets:accessToken=x"]
+    ) == {
+        "Thunderforest": {"apikey": "abc"},
+        "Jawg.Streets": {"accessToken": "x"},
+    }
+    with pytest.raises(ValueError, match="NAME:KEY=VALUE"):
+        _parse_tokens(["Thunderforest=abc"])
@@ -0,0 +1,102 @@
+import multiprocessing
+import subprocess
+import sys
+
+import pytest
+
+import xyzservices.providers as xyz
+from xyzservices import Bunch, TileProvider
+from xyzservices.shared import SharedCatalog, build_catalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = str(tmp_path / "xyzservices.catalog")
+    build_catalog(path)
+    catalog = SharedCatalog(path)
+    yield catalog
+    catalog.close()
+
+
+def test_shared_catalog(catalog):
+    assert list(catalog) == list(xyz)
+    assert "CartoDB" in catalog
+    assert len(catalog.CartoDB) == len(xyz.CartoDB)
+
+    positron = catalog.CartoDB.Positron
+    assert isinstance(positron, TileProvider)
+    assert positron == xyz.CartoDB.Positron
+    assert catalog["OpenTopoMap"] == xyz.OpenTopoMap
+    assert positron.build_url(1, 2, 3) == xyz.CartoDB.Positron.build_url(1, 2, 3)
+
+    # providers are independent copies
+    positron["max_zoom"] = 1
+    assert catalog.CartoDB.Positron.max_zoom == xyz.CartoDB.Positron.max_zoom
+
+    assert not hasattr(catalog, "Unknown")
+    with pytest.raises(KeyError):
+        catalog["Unknown"]
+
+
+def test_shared_catalog_to_bunch(catalog):
+    bunch = catalog.to_bunch()
+    assert isinstance(bunch, Bunch)
+    assert isinstance(bunch.CartoDB, Bunch)
+    assert bunch == xyz
+    assert catalog.flatten() == xyz.flatten()
+
+
+def test_shared_catalog_query_name(catalog):
+    assert catalog.query_name("cartodb positron") == xyz.CartoDB.Positron
+    assert catalog.query_name("OpenTopoMap") == xyz.OpenTopoMap
+    assert catalog.CartoDB.query_name("CartoDB.Positron") == xyz.CartoDB.Positron
+    with pytest.raises(ValueError, match="No matching provider"):
+        catalog.CartoDB.query_name("OpenTopoMap")
+    with pytest.raises(ValueError, match="No matching provider"):
+        catalog.query_name("unknown")
+
+
+def test_shared_catalog_rebuild(tmp_path):
+    path = str(tmp_path / "xyzservices.catalog")
+    build_catalog(path, Bunch(Stub=xyz.OpenTopoMap))
+    old = SharedCatalog(path)
+    build_catalog(path)
+    # mapped catalogs keep the version they were opened with
+    assert list(old) == ["Stub"]
+    assert old.Stub == xyz.OpenTopoMap
+    assert len(SharedCatalog(path)) == len(xyz)
+
+    invalid = tmp_path / "invalid"
+    invalid.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError, match="not an xyzservices catalog"):
+        SharedCatalog(str(invalid))
+
+
+def _worker_url(path):
+    return SharedCatalog(path).query_name("CartoDB Positron").build_url(1, 2, 3)
+
+
+def test_shared_catalog_workers(tmp_path):
+    path = str(tmp_path / "xyzservices.catalog")
+    build_catalog(path)
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        urls = pool.map(_worker_url, [path] * 2)
+    assert urls == [xyz.CartoDB.Positron.build_url(1, 2, 3)] * 2
+
+
+def test_shared_catalog_does_not_load_providers(tmp_path):
+    path = str(tmp_path / "xyzservices.catalog")
+    build_catalog(path)
+    # a new process, the catalog of the test session is loaded already
+    code = (
+        "import sys;"
+        "import xyzservices;"
+        "from xyzservices.shared import SharedCatalog;"
+        f"url = SharedCatalog({path!r}).query_name('CartoDB Positron').url;"
+        "module = sys.modules['xyzservices.providers'];"
+        "print(url, 'providers' in vars(module), 'providers' in vars(xyzservices))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert out == f"{xyz.CartoDB.Positron.url} False False"
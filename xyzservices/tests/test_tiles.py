@@ -0,0 +1,359 @@
+import gzip
+import time
+from urllib.error import HTTPError
+
+import pytest
+
+from xyzservices import TileProvider, use_credentials
+from xyzservices.cache import TileFetcher
+from xyzservices.lib import _tile_range_x, _tile_range_y
+from xyzservices.tiles import (
+    USER_AGENT,
+    WEB_MERCATOR_HALF_WORLD,
+    CircuitBreaker,
+    FailoverChain,
+    HedgedFetcher,
+    fetch_tile,
+    fetch_time_series,
+    mosaic,
+    plan_tiles,
+)
+
+
+def test_fetch_tile(tile_server, stub_provider):
+    assert fetch_tile(stub_provider, 1, 2, 3) == b"/3/1/2.png"
+    path, headers = tile_server.requests[0]
+    assert headers["User-Agent"] == USER_AGENT
+
+    fetch_tile(stub_provider, 1, 2, 3, headers={"Referer": "https://xyz.test"})
+    assert tile_server.requests[1][1]["Referer"] == "https://xyz.test"
+
+    tile_server.statuses["/3/1/2.png"] = 404
+    with pytest.raises(HTTPError, match="404"):
+        fetch_tile(stub_provider, 1, 2, 3)
+
+
+def test_fetch_tile_compressed(tile_server, stub_provider):
+    tile = b"\x1a\x05\x0a\x03poi"
+    tile_server.tiles["/1/0/0.png"] = gzip.compress(tile)
+    tile_server.headers["/1/0/0.png"] = {"Content-Encoding": "gzip"}
+    # gzipped vector tile served without Content-Encoding
+    tile_server.tiles["/1/0/1.png"] = gzip.compress(tile)
+    # gzipped twice
+    tile_server.tiles["/1/1/0.png"] = gzip.compress(gzip.compress(tile))
+    tile_server.headers["/1/1/0.png"] = {"Content-Encoding": "gzip"}
+
+    assert fetch_tile(stub_provider, 0, 0, 1) == tile
+    assert fetch_tile(stub_provider, 0, 1, 1) == tile
+    assert fetch_tile(stub_provider, 1, 0, 1) == tile
+    assert "gzip" in tile_server.requests[0][1]["Accept-Encoding"]
+
+    brotli = pytest.importorskip("brotli")
+    tile_server.tiles["/1/1/1.png"] = brotli.compress(tile)
+    tile_server.headers["/1/1/1.png"] = {"Content-Encoding": "br"}
+    assert fetch_tile(stub_provider, 1, 1, 1) == tile
+
+
+def test_mosaic_vector(stub_provider):
+    with pytest.raises(ValueError, match="Vector tiles"):
+        mosaic(stub_provider(format="application/x-protobuf"), (0, 0, 1, 1), 2)
+
+
+def test_mosaic(tile_server, stub_provider, png):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("PIL")
+
+    bbox = (-100, -10, 100, 60)
+    zoom = 2
+    x_min, x_max = _tile_range_x(bbox[0], bbox[2], zoom)
+    y_min, y_max = _tile_range_y(bbox[1], bbox[3], zoom)
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            tile_server.tiles[f"/{zoom}/{x}/{y}.png"] = png((x, y, 7))
+
+    image, extent = mosaic(stub_provider, bbox, zoom, max_workers=2)
+    assert image.shape == (4 * (y_max - y_min + 1), 4 * (x_max - x_min + 1), 4)
+    assert image.dtype == np.uint8
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            block = image[(y - y_min) * 4 : (y - y_min + 1) * 4, (x - x_min) * 4 :][:4]
+            assert (block[:, :4] == [x, y, 7, 255]).all()
+
+    half = WEB_MERCATOR_HALF_WORLD
+    assert (y_min, y_max) == (1, 2)
+    assert extent == pytest.approx((-half, -half / 2, half, half / 2))
+
+
+def test_mosaic_out(tmp_path, tile_server, stub_provider, png):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("PIL")
+
+    for x in range(2):
+        for y in range(2):
+            tile_server.tiles[f"/1/{x}/{y}.png"] = png((x, y, 1), size=8)
+
+    out = np.memmap(
+        tmp_path / "mosaic.raw", dtype=np.uint8, mode="w+", shape=(16, 16, 4)
+    )
+    image, _ = mosaic(stub_provider, (-180, -85, 180, 85), 1, out=out)
+    assert image is out
+    assert (out[8:, 8:] == [1, 1, 1, 255]).all()
+
+    with pytest.raises(ValueError, match="must be of shape"):
+        mosaic(stub_provider, (-180, -85, 180, 85), 1, out=np.empty((8, 8, 4)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        failure_rate=0.5, window=4, min_requests=4, cooldown=10, clock=clock
+    )
+    for success in [True, False, True]:
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # only a single trial request
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_circuit_breaker_slow_calls():
+    breaker = CircuitBreaker(min_requests=2, slow_call=1, clock=FakeClock())
+    breaker.record(True, 0.5)
+    breaker.record(True, 2)
+    assert breaker.state == "open"
+
+
+def test_failover_chain(tile_server):
+    primary = TileProvider(
+        url=tile_server.url + "/primary/{z}/{x}/{y}.png",
+        attribution="(C) xyzservices",
+        name="primary",
+    )
+    backup = primary(url=tile_server.url + "/backup/{z}/{x}/{y}.png", name="backup")
+    chain = FailoverChain([primary, backup], min_requests=3, cooldown=60)
+
+    assert chain.fetch(1, 2, 3) == b"/primary/3/1/2.png"
+
+    tile_server.statuses["/primary/3/1/2.png"] = 503
+    assert chain.fetch(1, 2, 3) == b"/backup/3/1/2.png"
+    assert chain.breakers[0].state == "closed"
+    assert chain.fetch(1, 2, 3) == b"/backup/3/1/2.png"
+    assert chain.breakers[0].state == "open"
+
+    # primary is not contacted while its breaker is open
+    requests = tile_server.count("/primary/3/1/2.png")
+    assert chain.fetch(1, 2, 3) == b"/backup/3/1/2.png"
+    assert tile_server.count("/primary/3/1/2.png") == requests
+
+    # 404 does not trip the breaker but falls back
+    tile_server.statuses["/backup/4/1/2.png"] = 404
+    with pytest.raises(HTTPError, match="404"):
+        chain.fetch(1, 2, 4)
+    assert chain.breakers[1].state == "closed"
+
+    tile_server.statuses["/backup/3/1/2.png"] = 500
+    while chain.breakers[1].state == "closed":
+        with pytest.raises(HTTPError, match="500"):
+            chain.fetch(1, 2, 3)
+    with pytest.raises(ConnectionError, match="temporarily disabled"):
+        chain.fetch(1, 2, 3)
+
+
+def test_failover_chain_exceptions(monkeypatch):
+    import http.client
+
+    import xyzservices.tiles
+
+    primary = TileProvider(
+        url="https://primary/{z}/{x}/{y}.png", attribution="", name="primary"
+    )
+    backup = primary(url="https://backup/{z}/{x}/{y}.png", name="backup")
+    errors = {}
+
+    def fake_fetch(provider, *args, **kwargs):  # noqa: ARG001
+        error = errors.get(provider.url)
+        if error is not None:
+            raise error
+        return provider.url.encode()
+
+    monkeypatch.setattr(xyzservices.tiles, "fetch_tile", fake_fetch)
+    clock = FakeClock()
+    chain = FailoverChain([primary, backup], min_requests=1, cooldown=10, clock=clock)
+
+    # broken responses fail over
+    errors[primary.url] = http.client.IncompleteRead(b"")
+    assert chain.fetch(0, 0, 0) == backup.url.encode()
+    assert chain.breakers[0].state == "open"
+
+    # unexpected errors are raised but conclude the trial request
+    clock.now = 10
+    errors[primary.url] = RuntimeError("bug")
+    with pytest.raises(RuntimeError, match="bug"):
+        chain.fetch(0, 0, 0)
+    assert chain.breakers[0].state == "open"
+    clock.now = 20
+    del errors[primary.url]
+    assert chain.breakers[0].allow()
+    chain.breakers[0].record(True)
+    assert chain.fetch(0, 0, 0) == primary.url.encode()
+    assert chain.breakers[0].state == "closed"
+
+
+def test_hedged_fetcher(tile_server):
+    provider = TileProvider(
+        url=tile_server.url + "/{s}/{z}/{x}/{y}.png",
+        attribution="(C) xyzservices",
+        subdomains="ab",
+        name="hedged",
+    )
+    tile_server.delay = lambda path: 1 if path.startswith("/a/") else 0
+
+    with HedgedFetcher(provider, delay=0.05, budget=0.5) as fetcher:
+        # (0 + 0) % 2 -> "a" is slow, "b" wins
+        start = time.perf_counter()
+        assert fetcher.fetch(0, 0, 1) == b"/b/1/0/0.png"
+        assert time.perf_counter() - start < 0.9
+        assert fetcher.hedged == 1
+
+        # primary "b" is fast, no hedge
+        assert fetcher.fetch(1, 0, 1) == b"/b/1/1/0.png"
+        assert fetcher.hedged == 1
+
+        # budget of 0.5: 1 hedged < 0.5 * 3 requests, 2 hedged = 0.5 * 4 requests
+        assert fetcher.fetch(0, 0, 2) == b"/b/2/0/0.png"
+        assert fetcher.hedged == 2
+        assert fetcher.fetch(0, 0, 3) == b"/a/3/0/0.png"
+        assert fetcher.hedged == 2
+
+    # hedge failing falls back to the primary response
+    tile_server.statuses["/b/4/0/0.png"] = 500
+    with HedgedFetcher(provider, delay=0.05, budget=1) as fetcher:
+        assert fetcher.fetch(0, 0, 4) == b"/a/4/0/0.png"
+
+
+def test_hedged_fetcher_delay(tile_server):
+    provider = TileProvider(
+        url=tile_server.url + "/{z}/{x}/{y}.png",
+        attribution="(C) xyzservices",
+        name="single",
+    )
+    with HedgedFetcher(provider, initial_delay=0.3) as fetcher:
+        assert fetcher.hedge_delay() == 0.3
+        for i in range(20):
+            assert fetcher.fetch(i, 0, 5) == f"/5/{i}/0.png".encode()
+        assert fetcher.hedge_delay() < 0.3
+        assert fetcher.hedged == 0
+
+
+def test_fetch_time_series(tile_server, stub_provider):
+    provider = stub_provider(url=tile_server.url + "/{time}/{z}/{x}/{y}.png", time="")
+    times = ["2024-06-01", "2024-06-02"]
+    frames = fetch_time_series(provider, [(1, 2, 3), (2, 2, 3)], times, max_workers=4)
+    assert frames == {
+        (t, 3, x, 2): f"/{t}/3/{x}/2.png".encode() for t in times for x in (1, 2)
+    }
+
+    # cached separately per time
+    fetcher = TileFetcher()
+    for _ in range(2):
+        frames = fetch_time_series(provider, [(1, 2, 3)], times, fetcher=fetcher)
+        assert frames["2024-06-02", 3, 1, 2] == b"/2024-06-02/3/1/2.png"
+    assert tile_server.count("/2024-06-02/3/1/2.png") == 2
+    assert ("stub@2024-06-01", 3, 1, 2, "") in fetcher.cache
+
+    with pytest.raises(ValueError, match="does not depend on time"):
+        fetch_time_series(stub_provider, [(1, 2, 3)], times)
+
+    # credentials of the caller are used by the fetching threads
+    private = provider(url=provider.url + "?key={key}", key="<insert your key here>")
+    with use_credentials({"stub": {"key": "secret"}}):
+        frames = fetch_time_series(private, [(1, 2, 3)], times, fetcher=TileFetcher())
+    assert frames["2024-06-01", 3, 1, 2] == b"/2024-06-01/3/1/2.png?key=secret"
+
+
+def test_plan_tiles():
+    bbox = (-0.2, 51.4, 0.1, 51.6)
+    provider = TileProvider(
+        url="https://myserver.com/{z}/{x}/{y}.png",
+        attribution="(C) xyzservices",
+        name="p",
+    )
+    plan = plan_tiles(provider, bbox, width=1024)
+    assert (plan["zoom"], plan["tile_size"], plan["scale_factor"]) == (13, 256, None)
+    assert plan["shape"][1] >= 1024
+    assert len(plan["tiles"]) == len(plan["offsets"]) == 64
+    assert plan["offsets"][:2] == [(0, 0), (256, 0)]
+    assert plan["tiles"][1][0] == plan["tiles"][0][0] + 1
+
+    retina = provider(url="https://myserver.com/{z}/{x}/{y}{r}.png")
+    plan = plan_tiles(retina, bbox, width=1024)
+    assert (plan["zoom"], plan["tile_size"], plan["scale_factor"]) == (12, 512, "@2x")
+    assert len(plan["tiles"]) == 20
+    assert plan["offsets"][1] == (512, 0)
+
+    large = retina(tileSize=512, zoomOffset=-1, max_zoom=20)
+    plan = plan_tiles(large, bbox, width=1024)
+    assert (plan["zoom"], plan["tile_size"], plan["scale_factor"]) == (11, 1024, "@2x")
+    assert len(plan["tiles"]) == 6
+    assert plan["shape"] == (2048, 3072)
+
+    # height drives the resolution
+    assert plan_tiles(provider, bbox, width=10, height=1024)["zoom"] == 13
+
+    # limited by max_zoom
+    plan = plan_tiles(provider(max_zoom=10), bbox, width=1024)
+    assert plan["zoom"] == 10
+    plan = plan_tiles(large(max_zoom=10), bbox, width=1024)
+    assert plan["zoom"] == 9
+    # limited by min_zoom
+    assert plan_tiles(provider(min_zoom=3), bbox, width=1)["zoom"] == 3
+
+    # tiles west of the bounds are left out
+    plan = plan_tiles(provider(bounds=[[51, 0], [52, 1]]), bbox, width=1024)
+    assert len(plan["tiles"]) == 24
+    assert plan["shape"][1] >= 1024
+    assert min(left for left, _ in plan["offsets"]) > 0
+
+
+def test_tiles_web_mercator_only():
+    provider = TileProvider(
+        url="https://s/{z}/{x}/{y}.png",
+        attribution="",
+        name="l93",
+        crs="EPSG:2154",
+        tile_matrices=[[6, 1400.0, 0.0, 12000000.0, 4, 5]],
+    )
+    with pytest.raises(ValueError, match=r"plan_tiles\(\) supports only"):
+        plan_tiles(provider, (2, 48, 3, 49), 256)
+    with pytest.raises(ValueError, match=r"mosaic\(\) supports only"):
+        mosaic(provider, (2, 48, 3, 49), 6)
+
+
+def test_plan_tiles_extent():
+    provider = TileProvider(url="https://s/{z}/{x}/{y}.png", attribution="", name="p")
+    plan = plan_tiles(provider, (-180, -85.06, 180, 85.06), width=512)
+    half = WEB_MERCATOR_HALF_WORLD
+    assert plan["zoom"] == 1
+    assert plan["extent"] == pytest.approx((-half, -half, half, half))
@@ -0,0 +1,108 @@
+import importlib
+import json
+import os
+
+import pytest
+
+from xyzservices import Bunch
+from xyzservices.update import update_providers
+
+providers_module = importlib.import_module("xyzservices.providers")
+
+CATALOG = {
+    "Stub": {
+        "url": "https://stub.test/{z}/{x}/{y}.png",
+        "attribution": "(C) xyzservices",
+        "name": "Stub",
+    }
+}
+
+
+@pytest.fixture
+def user_data(tmp_path, monkeypatch):
+    path = tmp_path / "data" / "providers.json"
+    monkeypatch.setattr(providers_module, "user_data_path", str(path))
+    monkeypatch.setenv("XYZSERVICES_CACHE_DIR", "")
+    return path
+
+
+def test_update_providers(tile_server, user_data):
+    url = tile_server.url + "/providers.json"
+    tile_server.tiles["/providers.json"] = json.dumps(CATALOG).encode()
+    tile_server.headers["/providers.json"] = {
+        "ETag": '"v1"',
+        "Last-Modified": "Mon, 19 Oct 2026 10:00:00 GMT",
+    }
+
+    assert update_providers(url, reload=False)
+    assert json.loads(user_data.read_text()) == CATALOG
+    assert "If-None-Match" not in tile_server.requests[0][1]
+
+    # unchanged catalog is not downloaded again
+    tile_server.statuses["/providers.json"] = 304
+    assert not update_providers(url, reload=False)
+    headers = tile_server.requests[1][1]
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["If-Modified-Since"] == "Mon, 19 Oct 2026 10:00:00 GMT"
+
+    # a different URL is always downloaded
+    tile_server.tiles["/other.json"] = json.dumps(CATALOG).encode()
+    assert update_providers(tile_server.url + "/other.json", reload=False)
+    assert "If-None-Match" not in tile_server.requests[2][1]
+
+
+def test_update_providers_invalid(tile_server, user_data):
+    user_data.parent.mkdir()
+    user_data.write_text(json.dumps(CATALOG))
+    for body in [b"not json", b"{}", b'{"Stub": {"url": "https://stub.test"}}']:
+        tile_server.tiles["/providers.json"] = body
+        with pytest.raises(ValueError):
+            update_providers(tile_server.url + "/providers.json", reload=False)
+    # the previous catalog is kept
+    assert json.loads(user_data.read_text()) == CATALOG
+    assert not [p for p in os.listdir(user_data.parent) if p.endswith(".tmp")]
+
+
+@pytest.mark.usefixtures("user_data")
+def test_update_providers_reload(tile_server, monkeypatch):
+    providers = Bunch(providers_module.providers)
+    monkeypatch.setattr(providers_module, "providers", providers)
+    group = providers.CartoDB
+    tile_server.tiles["/providers.json"] = json.dumps(CATALOG).encode()
+
+    assert update_providers(tile_server.url + "/providers.json")
+    assert list(providers) == ["Stub"]
+    assert providers.query_name("stub").url == CATALOG["Stub"]["url"]
+    assert "CartoDB" not in providers
+    assert group.Positron.name == "CartoDB.Positron"
+
+    # new imports use the downloaded catalog
+    assert list(providers_module._load_providers()) == ["Stub"]
+
+
+@pytest.mark.usefixtures("user_data")
+def test_update_providers_reload_registered(tile_server, tmp_path, monkeypatch):
+    providers = Bunch(providers_module.providers)
+    monkeypatch.setattr(providers_module, "providers", providers)
+    monkeypatch.setattr(providers_module, "registered_paths", [])
+    internal = {
+        "url": "https://internal.test/{z}/{x}/{y}.png",
+        "attribution": "(C) internal",
+    }
+    catalog = tmp_path / "internal.json"
+    catalog.write_text(
+        json.dumps(
+            {
+                "Group": {"Internal": {**internal, "name": "Group.Internal"}},
+                "Internal": {**internal, "name": "Internal"},
+            }
+        )
+    )
+    providers_module.register_catalog(catalog)
+    downloaded = {"Group": {"Stub": {**CATALOG["Stub"], "name": "Group.Stub"}}}
+    tile_server.tiles["/providers.json"] = json.dumps(downloaded).encode()
+
+    assert update_providers(tile_server.url + "/providers.json")
+    assert sorted(providers) == ["Group", "Internal"]
+    assert sorted(providers.Group) == ["Internal", "Stub"]
+    assert providers.query_name("group internal").url == internal["url"]
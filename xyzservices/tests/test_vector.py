@@ -0,0 +1,140 @@
+import struct
+
+import pytest
+
+from xyzservices.vector import iter_features, iter_layers
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, value):
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _packed(number, values):
+    return _field(number, b"".join(_varint(v) for v in values))
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _command(command, count):
+    return command | count << 3
+
+
+def _layer(name, features, keys, values, extent=4096):
+    # features are encoded before keys and values, as most encoders do
+    data = _field(15, 2) + _field(1, name.encode())
+    for feature in features:
+        data += _field(2, feature)
+    for key in keys:
+        data += _field(3, key.encode())
+    for value in values:
+        data += _field(4, value)
+    return data + _field(5, extent)
+
+
+def _tile():
+    road = (
+        _field(1, 7)
+        + _packed(2, [0, 0, 1, 1])
+        + _field(3, 2)
+        + _packed(
+            4,
+            [
+                _command(1, 1),
+                _zigzag(10),
+                _zigzag(20),
+                _command(2, 2),
+                _zigzag(5),
+                _zigzag(0),
+                _zigzag(-5),
+                _zigzag(10),
+            ],
+        )
+    )
+    building = (
+        _packed(2, [0, 2])
+        + _field(3, 3)
+        + _packed(
+            4,
+            [
+                _command(1, 1),
+                _zigzag(0),
+                _zigzag(0),
+                _command(2, 2),
+                _zigzag(8),
+                _zigzag(0),
+                _zigzag(0),
+                _zigzag(8),
+                _command(7, 1),
+            ],
+        )
+    )
+    pois = (
+        _packed(2, [0, 3])
+        + _field(3, 1)
+        + _packed(4, [_command(1, 2), _zigzag(1), _zigzag(2), _zigzag(3), _zigzag(-1)])
+    )
+    values = [
+        _field(1, b"primary"),
+        _field(6, _zigzag(-3)),
+        _varint(3 << 3 | 1) + struct.pack("<d", 12.5),
+        _field(7, 1),
+    ]
+    layers = [
+        _layer("transportation", [road], ["class", "lanes"], values[:2]),
+        _layer("building", [building], ["height"], values, extent=512),
+        _layer("poi", [pois], ["open"], values),
+    ]
+    return b"".join(_field(3, layer) for layer in layers)
+
+
+def test_iter_layers():
+    layers = list(iter_layers(_tile()))
+    assert [layer.name for layer in layers] == ["transportation", "building", "poi"]
+    assert [len(layer) for layer in layers] == [1, 1, 1]
+    assert layers[1].extent == 512
+    assert layers[0].version == 2
+
+    assert [layer.name for layer in iter_layers(_tile(), ["poi"])] == ["poi"]
+    assert list(iter_layers(_tile(), ["missing"])) == []
+
+
+def test_iter_features():
+    features = list(iter_features(_tile()))
+    assert features[0] == {
+        "id": 7,
+        "type": "LineString",
+        "properties": {"class": "primary", "lanes": -3},
+        "geometry": [[(10, 20), (15, 20), (10, 30)]],
+        "layer": "transportation",
+    }
+    assert features[1]["type"] == "Polygon"
+    assert features[1]["properties"] == {"height": 12.5}
+    assert features[1]["geometry"] == [[(0, 0), (8, 0), (8, 8), (0, 0)]]
+    assert features[2]["properties"] == {"open": True}
+    assert features[2]["geometry"] == [[(1, 2)], [(4, 1)]]
+
+    [poi] = iter_features(_tile(), layers=["poi"])
+    assert poi["layer"] == "poi"
+
+
+def test_iter_features_truncated():
+    with pytest.raises(ValueError, match="Truncated"):
+        list(iter_features(_tile()[:-3]))
+    with pytest.raises(ValueError, match="Truncated"):
+        list(iter_layers(b"\x1a\x85"))
@@ -0,0 +1,81 @@
+import pytest
+
+from xyzservices import TileProvider
+from xyzservices.lib import _lonlat_to_tile
+from xyzservices.wmts import lonlat_to_tile, project, tile_matrix, xy_to_tile
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def l93_provider():
+    return TileProvider(
+        url="https://myserver.com/wmts?TILEMATRIX={z}&TILEROW={y}&TILECOL={x}",
+        attribution="(C) xyzservices",
+        name="l93",
+        crs="EPSG:2154",
+        tile_matrices=[
+            [6, 1400.0, 0.0, 12000000.0, 4, 5],
+            [7, 700.0, 0.0, 12000000.0, 8, 10],
+        ],
+    )
+
+
+def test_project():
+    # Paris
+    x, y = project("EPSG:2154", [2.3522], [48.8566])
+    assert (x[0], y[0]) == pytest.approx((652469.02, 6862035.26), abs=0.01)
+    x, y = project("EPSG:2154", 3, 46.5)
+    assert (x, y) == pytest.approx((700000, 6600000))
+
+    x, y = project("EPSG:3857", [180, 0], [0, 90])
+    assert x[0] == pytest.approx(20037508.342789244)
+    assert y[1] == pytest.approx(20037508.342789244)
+
+    with pytest.raises(ValueError, match="Unsupported CRS 'EPSG:27700'"):
+        project("EPSG:27700", 0, 0)
+
+
+def test_xy_to_tile(l93_provider):
+    assert tile_matrix(l93_provider, 7) == {
+        "crs": "EPSG:2154",
+        "resolution": 700.0,
+        "origin": (0.0, 12000000.0),
+        "tile_size": 256,
+        "matrix_size": (8, 10),
+    }
+    cols, rows = xy_to_tile(l93_provider, [0, 179199, 179200], [12e6, 12e6, 6e6], 7)
+    assert cols.tolist() == [0, 0, 1]
+    assert rows.tolist() == [0, 0, 33]
+
+    cols, rows = lonlat_to_tile(l93_provider, [2.3522], [48.8566], 6)
+    assert (cols[0], rows[0]) == (1, 14)
+
+    with pytest.raises(ValueError, match="has no matrix 8"):
+        tile_matrix(l93_provider, 8)
+
+
+def test_tile_matrix_unknown(l93_provider):
+    provider = l93_provider.copy()
+    del provider["tile_matrices"]
+    with pytest.raises(ValueError, match="'EPSG:2154' of 'l93' does not use"):
+        tile_matrix(provider, 7)
+    provider = TileProvider(
+        url="https://s/{z}/{x}/{y}.png",
+        attribution="",
+        name="p",
+        TileMatrixSet="2154_10cm_6_20",
+    )
+    with pytest.raises(ValueError, match="'2154_10cm_6_20'"):
+        lonlat_to_tile(provider, 2.35, 48.86, 7)
+    provider["TileMatrixSet"] = "PM_0_19"
+    assert tile_matrix(provider, 1)["matrix_size"] == (2, 2)
+
+
+def test_lonlat_to_tile_web_mercator():
+    provider = TileProvider(url="https://s/{z}/{x}/{y}.png", attribution="", name="p")
+    lon = np.array([-179.9, -0.1, 2.3522, 151.2])
+    lat = np.array([85, 51.5, 48.8566, -33.9])
+    cols, rows = lonlat_to_tile(provider, lon, lat, 12)
+    expected = [_lonlat_to_tile(x, y, 12) for x, y in zip(lon, lat)]
+    assert list(zip(cols.tolist(), rows.tolist())) == expected
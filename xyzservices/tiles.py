@@ -0,0 +1,880 @@
+"""
+Fetching and assembling tiles of a TileProvider
+"""
+
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import http.client
+import importlib.util
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+from importlib.metadata import PackageNotFoundError, version
+from io import BytesIO
+from typing import Iterable
+
+from .lib import (
+    VECTOR_FORMATS,
+    TileProvider,
+    _check_web_mercator,
+    _format_time,
+    _lat_to_tile_y,
+    _submit,
+    _tile_range_x,
+    _tile_range_y,
+)
+
+# half of the circumference of the Earth in Web Mercator (EPSG:3857) meters
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+
+_version = "unknown"
+with contextlib.suppress(PackageNotFoundError):
+    _version = version("xyzservices")
+
+USER_AGENT = f"xyzservices/{_version}"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# brotli is decoded only if the optional ``brotli`` package is installed
+_ACCEPT_ENCODING = "gzip, br" if importlib.util.find_spec("brotli") else "gzip"
+
+
+def fetch_tile(
+    provider: TileProvider,
+    x: int,
+    y: int,
+    z: int,
+    scale_factor: str | None = None,
+    timeout: float = 30,
+    headers: dict | None = None,
+    **kwargs,
+) -> bytes:
+    """
+    Fetch a single tile from the :class:`TileProvider`
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    x, y, z : int
+        tile number
+    scale_factor : str (optional)
+        Scale factor (where supported). See :meth:`TileProvider.build_url`.
+    timeout : float (optional, default 30)
+        Timeout of the request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the request
+
+    **kwargs
+        Other potential attributes updating the :class:`TileProvider`.
+
+    Returns
+    -------
+    bytes
+        Content of the tile as returned by the server
+
+    Raises
+    ------
+    urllib.error.HTTPError
+        If the server responds with an error status code
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.tiles import fetch_tile
+    >>> png = fetch_tile(xyz.OpenStreetMap.Mapnik, x=0, y=0, z=0)
+    """
+    url = provider.build_url(x=x, y=y, z=z, scale_factor=scale_factor, **kwargs)
+    return _get(url, timeout=timeout, headers=headers)
+
+
+def fetch_time_series(
+    provider: TileProvider,
+    tiles: Iterable[tuple[int, int, int]],
+    times: Iterable,
+    scale_factor: str | None = None,
+    max_workers: int = 8,
+    timeout: float = 30,
+    headers: dict | None = None,
+    fetcher=None,
+    **kwargs,
+) -> dict:
+    """
+    Fetch the same tiles at multiple times, e.g. frames of an animation
+
+    For providers with the ``{time}`` placeholder in the URL (e.g. ``NASAGIBS``). The
+    URLs are built at once by :meth:`TileProvider.build_time_urls` and all the tiles
+    are fetched concurrently.
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    tiles : iterable of tuple
+        ``(x, y, z)`` tile numbers
+    times : iterable
+        Timestamps as strings, :class:`datetime.date` or :class:`datetime.datetime`
+        objects. See :meth:`TileProvider.build_time_urls`.
+    scale_factor : str (optional)
+        Scale factor (where supported). See :meth:`TileProvider.build_url`.
+    max_workers : int (optional, default 8)
+        Number of threads fetching the tiles
+    timeout : float (optional, default 30)
+        Timeout of a single request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+    fetcher : TileFetcher (optional)
+        Fetch the tiles through a :class:`~xyzservices.cache.TileFetcher` and its
+        cache instead of directly. Tiles of different times are cached separately.
+        ``timeout`` and ``headers`` of the fetcher are used.
+
+    **kwargs
+        Other potential attributes updating the :class:`TileProvider`.
+
+    Returns
+    -------
+    dict
+        Contents of the tiles keyed by ``(time, z, x, y)``, where ``time`` is the
+        formatted timestamp
+
+    Raises
+    ------
+    ValueError
+        If the URL of the provider has no ``{time}`` placeholder
+    urllib.error.HTTPError
+        If the server responds with an error status code to any of the requests
+
+    Examples
+    --------
+    >>> import datetime
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.tiles import fetch_time_series
+    >>> days = [datetime.date(2024, 6, d) for d in range(1, 31)]
+    >>> frames = fetch_time_series(
+    ...     xyz.NASAGIBS.ModisTerraTrueColorCR, [(16, 10, 5), (17, 10, 5)], days
+    ... )
+    >>> jpg = frames["2024-06-01", 5, 16, 10]
+    """
+    tiles = list(tiles)
+    times = [_format_time(timestamp) for timestamp in times]
+    urls = provider.build_time_urls(tiles, times, scale_factor=scale_factor, **kwargs)
+
+    def _fetch(key, url):
+        if fetcher is None:
+            return _get(url, timeout=timeout, headers=headers)
+        timestamp, z, x, y = key
+        return fetcher.fetch(
+            provider,
+            x,
+            y,
+            z,
+            scale_factor=scale_factor,
+            **{**kwargs, "time": timestamp},
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            key: _submit(executor, _fetch, key, url) for key, url in urls.items()
+        }
+        try:
+            return {key: future.result() for key, future in futures.items()}
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+
+def mosaic(
+    provider: TileProvider,
+    bbox: tuple[float, float, float, float],
+    zoom: int,
+    out=None,
+    scale_factor: str | None = None,
+    max_workers: int = 8,
+    executor: concurrent.futures.Executor | None = None,
+    timeout: float = 30,
+    headers: dict | None = None,
+    **kwargs,
+):
+    """
+    Assemble tiles covering the bounding box into a single RGBA image
+
+    Tiles are fetched and decoded in parallel and each of them is copied directly into
+    its place in the output array, which is allocated only once. Any
+    :class:`concurrent.futures.Executor` can be used, including
+    :class:`~concurrent.futures.ProcessPoolExecutor` as the workers return only raw
+    decoded bytes.
+
+    Only providers of the Web Mercator tile grid are supported (see
+    :mod:`xyzservices.wmts` for the others).
+
+    Requires ``numpy`` and ``Pillow``.
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    bbox : tuple
+        ``(west, south, east, north)`` in longitude and latitude (EPSG:4326)
+    zoom : int
+        Zoom level of the tiles
+    out : numpy.ndarray (optional)
+        Preallocated ``uint8`` array of shape ``(height, width, 4)`` to write the
+        image into, e.g. a :class:`numpy.memmap` for images not fitting into memory.
+        Height and width must match the tile rows and columns covering the ``bbox``
+        multiplied by the tile size. If None, a new array is allocated.
+    scale_factor : str (optional)
+        Scale factor (where supported). See :meth:`TileProvider.build_url`.
+    max_workers : int (optional, default 8)
+        Number of threads used to fetch and decode tiles if ``executor`` is not given
+    executor : concurrent.futures.Executor (optional)
+        Executor used to fetch and decode tiles
+    timeout : float (optional, default 30)
+        Timeout of a single request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+
+    **kwargs
+        Other potential attributes updating the :class:`TileProvider`.
+
+    Returns
+    -------
+    image : numpy.ndarray
+        RGBA image of shape ``(height, width, 4)``
+    extent : tuple
+        ``(west, south, east, north)`` of the image in Web Mercator (EPSG:3857)
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.tiles import mosaic
+    >>> image, extent = mosaic(xyz.OpenStreetMap.Mapnik, (-0.2, 51.4, 0.1, 51.6), 12)
+    """
+    _check_web_mercator(provider, "mosaic()")
+    if provider.tile_format() in VECTOR_FORMATS:
+        raise ValueError(
+            "Vector tiles cannot be assembled into an image. Use "
+            "xyzservices.vector to read them."
+        )
+    try:
+        import numpy as np
+    except ImportError as err:
+        raise ImportError("mosaic() requires numpy and Pillow.") from err
+
+    west, south, east, north = bbox
+    if west > east:
+        raise ValueError("Bounding boxes crossing the antimeridian are not supported.")
+
+    x_min, x_max = _tile_range_x(west, east, zoom)
+    y_min, y_max = _tile_range_y(south, north, zoom)
+    tiles = [
+        (x, y, zoom) for y in range(y_min, y_max + 1) for x in range(x_min, x_max + 1)
+    ]
+    urls = provider.build_urls(tiles, scale_factor=scale_factor, **kwargs)
+
+    # the first tile determines the tile size in pixels
+    data, (width, height) = _fetch_decode(urls[0], timeout, headers)
+    shape = ((y_max - y_min + 1) * height, (x_max - x_min + 1) * width, 4)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    elif out.shape != shape or out.dtype != np.uint8:
+        raise ValueError(
+            f"The output array must be of shape {shape} and dtype uint8, "
+            f"got {out.shape} and {out.dtype}."
+        )
+
+    def _write(tile, data, size):
+        if size != (width, height):
+            raise ValueError(
+                f"Tile {tile} is of size {size}, expected {(width, height)}."
+            )
+        row = (tile[1] - y_min) * height
+        col = (tile[0] - x_min) * width
+        out[row : row + height, col : col + width] = np.frombuffer(
+            data, dtype=np.uint8
+        ).reshape(height, width, 4)
+
+    _write(tiles[0], data, (width, height))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    futures = {}
+    try:
+        for tile, url in zip(tiles[1:], urls[1:]):
+            futures[executor.submit(_fetch_decode, url, timeout, headers)] = tile
+        for future in concurrent.futures.as_completed(futures):
+            _write(futures[future], *future.result())
+    finally:
+        for future in futures:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+
+    return out, _tile_extent(x_min, x_max, y_min, y_max, zoom)
+
+
+def plan_tiles(
+    provider: TileProvider,
+    bbox: tuple[float, float, float, float],
+    width: int,
+    height: int | None = None,
+) -> dict:
+    """
+    Plan the fewest tile requests covering the bounding box at the given resolution
+
+    Besides the standard 256 px tiles, the planner considers larger tiles the
+    :class:`TileProvider` may offer - tiles of ``tileSize`` (e.g. 512 px tiles of
+    MapBox or MapTiler, used with ``zoomOffset``) and double resolution tiles if the
+    URL contains the ``{r}`` placeholder. A 512 px tile covers the same area as four
+    256 px tiles one zoom level deeper, so the same image can be assembled from
+    a quarter of the requests. The option needing the fewest tiles is chosen.
+
+    The zoom level is limited by ``min_zoom`` and ``max_zoom`` of the provider. If the
+    requested resolution is not available, the deepest zoom level is used. Tiles
+    outside of the ``bounds`` of the provider are not requested, leaving their part
+    of the image empty.
+
+    The ``"zoom"`` and ``"scale_factor"`` of the plan can be passed directly to
+    :func:`mosaic`. Like :func:`mosaic`, only providers of the Web Mercator tile grid
+    are supported.
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    bbox : tuple
+        ``(west, south, east, north)`` in longitude and latitude (EPSG:4326)
+    width : int
+        Minimal width of the resulting image in pixels
+    height : int (optional)
+        Minimal height of the resulting image in pixels
+
+    Returns
+    -------
+    dict
+        - ``"zoom"`` - zoom level in the tile URLs
+        - ``"scale_factor"`` - ``"@2x"`` or None, to be passed to
+          :meth:`TileProvider.build_urls`
+        - ``"tile_size"`` - size of a tile in pixels
+        - ``"tiles"`` - list of ``(x, y, z)`` tile numbers within the ``bounds`` of
+          the provider
+        - ``"offsets"`` - list of ``(left, top)`` pixel offsets of the tiles in the
+          assembled image
+        - ``"shape"`` - ``(height, width)`` of the assembled image in pixels
+        - ``"extent"`` - ``(west, south, east, north)`` of the assembled image in
+          Web Mercator (EPSG:3857)
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.tiles import plan_tiles
+    >>> plan = plan_tiles(xyz.MapTiler.Streets, (-0.2, 51.4, 0.1, 51.6), width=1024)
+    >>> plan["tile_size"], plan["scale_factor"], len(plan["tiles"])
+    (1024, '@2x', 6)
+    """
+    _check_web_mercator(provider, "plan_tiles()")
+    west, south, east, north = bbox
+    if west > east:
+        raise ValueError("Bounding boxes crossing the antimeridian are not supported.")
+
+    # pixels per the whole world width needed to reach the requested resolution
+    span_x = (east - west) / 360.0
+    span_y = _lat_to_tile_y(south) - _lat_to_tile_y(north)
+    needed = width / span_x if span_x > 0 else 0
+    if height is not None and span_y > 0:
+        needed = max(needed, height / span_y)
+
+    base = provider.get("tileSize", 256)
+    options = [(base, None)]
+    if "{r}" in provider["url"]:
+        options.append((2 * base, "@2x"))
+
+    offset = provider.get("zoomOffset", 0)
+    lowest = max(provider.get("min_zoom", 0) + offset, 0)
+    deepest = provider.get("max_zoom", 22) + offset
+
+    best = None
+    for tile_size, scale_factor in options:
+        zoom = max(math.ceil(math.log2(max(needed, 1) / tile_size) - 1e-9), 0)
+        zoom = min(max(zoom, lowest), max(deepest, lowest))
+        x_min, x_max = _tile_range_x(west, east, zoom)
+        y_min, y_max = _tile_range_y(south, north, zoom)
+        count = (x_max - x_min + 1) * (y_max - y_min + 1)
+        # prefer fewer requests, then higher resolution
+        key = (count, -tile_size * (1 << zoom))
+        if best is None or key < best[0]:
+            best = (key, tile_size, scale_factor, zoom, x_min, x_max, y_min, y_max)
+
+    _, tile_size, scale_factor, zoom, x_min, x_max, y_min, y_max = best
+    # tiles outside of the bounds of the provider are left out of the plan
+    x_low, x_high, y_low, y_high = provider._bounds_range(zoom)
+    tiles = []
+    offsets = []
+    for y in range(max(y_min, y_low), min(y_max, y_high) + 1):
+        for x in range(max(x_min, x_low), min(x_max, x_high) + 1):
+            tiles.append((x, y, zoom))
+            offsets.append(((x - x_min) * tile_size, (y - y_min) * tile_size))
+
+    return {
+        "zoom": zoom,
+        "scale_factor": scale_factor,
+        "tile_size": tile_size,
+        "tiles": tiles,
+        "offsets": offsets,
+        "shape": ((y_max - y_min + 1) * tile_size, (x_max - x_min + 1) * tile_size),
+        "extent": _tile_extent(x_min, x_max, y_min, y_max, zoom),
+    }
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker tracking the health of a single tile provider
+
+    The breaker is *closed* (requests pass) until the share of failed requests among
+    the last ``window`` requests reaches ``failure_rate``. Then it *opens* and requests
+    are rejected right away for ``cooldown`` seconds. After that, it is *half-open* and
+    lets a single trial request through. Its success closes the breaker again, its
+    failure opens it for another ``cooldown``.
+
+    Requests slower than ``slow_call`` seconds count as failures, so the breaker also
+    trips on a provider that still responds but too slowly.
+
+    Parameters
+    ----------
+    failure_rate : float (optional, default 0.5)
+        Share of failed requests opening the breaker
+    window : int (optional, default 20)
+        Number of the most recent requests considered
+    min_requests : int (optional, default 5)
+        Minimal number of recorded requests before the breaker can open
+    slow_call : float (optional)
+        Duration of a request in seconds above which it counts as failed
+    cooldown : float (optional, default 30)
+        Number of seconds the breaker stays open
+    clock : callable (optional)
+        Function returning the current time in seconds. Defaults to
+        :func:`time.monotonic`.
+
+    Examples
+    --------
+    >>> breaker = CircuitBreaker(failure_rate=0.5, cooldown=10)
+    >>> if breaker.allow():
+    ...     start = time.monotonic()
+    ...     ok = send_request()
+    ...     breaker.record(ok, time.monotonic() - start)
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_requests: int = 5,
+        slow_call: float | None = None,
+        cooldown: float = 30,
+        clock=time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.clock = clock
+        self._outcomes = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """``"closed"``, ``"open"`` or ``"half_open"``"""
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self.clock() - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Return True if a request may be sent now."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, success: bool, duration: float = 0) -> None:
+        """Record the outcome of a request.
+
+        Parameters
+        ----------
+        success : bool
+            Whether the request succeeded
+        duration : float (optional)
+            Duration of the request in seconds
+        """
+        if self.slow_call is not None and duration > self.slow_call:
+            success = False
+        with self._lock:
+            if self._opened_at is not None:
+                if self._trial:  # outcome of the trial request
+                    self._trial = False
+                    if success:
+                        self._opened_at = None
+                        self._outcomes.clear()
+                    else:
+                        self._opened_at = self.clock()
+                return  # late outcomes of requests sent before opening are ignored
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (
+                len(self._outcomes) >= self.min_requests
+                and failures / len(self._outcomes) >= self.failure_rate
+            ):
+                self._opened_at = self.clock()
+
+
+class FailoverChain:
+    """
+    Ordered chain of providers falling back to the next one when a provider fails
+
+    Each :class:`TileProvider` has its own :class:`CircuitBreaker`. A tile is fetched
+    from the first provider whose breaker allows the request. If the request fails
+    (connection error, timeout, invalid response or HTTP 5xx or 429), the next
+    provider is tried. Other exceptions are recorded as a failure and raised without
+    trying other providers.
+    Providers with an open breaker are skipped without waiting, so a failing upstream
+    does not slow down every request by the full timeout. HTTP 404 is not considered
+    a failure of the provider, but the next provider is still tried as it may have
+    the tile.
+
+    Parameters
+    ----------
+    providers : list of TileProvider
+        Providers in the order of preference. They should serve the same tile grid.
+    timeout : float (optional, default 30)
+        Timeout of a single request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+    **breaker_kwargs
+        Arguments of :class:`CircuitBreaker` created for each provider
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.tiles import FailoverChain
+    >>> chain = FailoverChain(
+    ...     [xyz.OpenStreetMap.Mapnik, xyz.OpenStreetMap.DE],
+    ...     timeout=5,
+    ...     slow_call=2,
+    ... )
+    >>> png = chain.fetch(x=0, y=0, z=0)
+    """
+
+    def __init__(
+        self,
+        providers: list[TileProvider],
+        timeout: float = 30,
+        headers: dict | None = None,
+        **breaker_kwargs,
+    ):
+        self.providers = list(providers)
+        self.breakers = [CircuitBreaker(**breaker_kwargs) for _ in self.providers]
+        self.timeout = timeout
+        self.headers = headers
+
+    def fetch(
+        self, x: int, y: int, z: int, scale_factor: str | None = None, **kwargs
+    ) -> bytes:
+        """
+        Fetch a tile from the first available provider
+
+        Parameters
+        ----------
+        x, y, z : int
+            tile number
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`TileProvider.build_url`.
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider` objects.
+
+        Returns
+        -------
+        bytes
+            Content of the tile
+
+        Raises
+        ------
+        ConnectionError
+            If all breakers are open
+        urllib.error.URLError or http.client.HTTPException
+            The last error if all available providers failed
+        """
+        error = None
+        for provider, breaker in zip(self.providers, self.breakers):
+            if not breaker.allow():
+                continue
+            start = time.monotonic()
+            data = None
+            success = False
+            try:
+                data = fetch_tile(
+                    provider,
+                    x,
+                    y,
+                    z,
+                    scale_factor=scale_factor,
+                    timeout=self.timeout,
+                    headers=self.headers,
+                    **kwargs,
+                )
+                success = True
+            except urllib.error.HTTPError as err:
+                error = err
+                success = not _is_upstream_failure(err)
+            except (OSError, http.client.HTTPException) as err:
+                # URLError, timeouts, connection errors, truncated or invalid responses
+                error = err
+            finally:
+                # other exceptions are raised as they are, but also count as a failure
+                # so that the trial request of a half-open breaker is always concluded
+                breaker.record(success, time.monotonic() - start)
+            if data is not None:
+                return data
+
+        if error is None:
+            raise ConnectionError(
+                "All providers of the FailoverChain are temporarily disabled by their "
+                "circuit breakers."
+            )
+        raise error
+
+
+class HedgedFetcher:
+    """
+    Fetch tiles hedging slow requests with a request to another subdomain
+
+    Many providers serve identical tiles from several subdomains. If a tile has not
+    arrived within ``delay``, the same tile is requested from another subdomain and
+    the first successful response wins. By default, the delay is the 95th percentile
+    of the observed request durations, so only the slowest 5 % of requests are
+    hedged. The share of hedged requests is capped by ``budget`` to keep the extra
+    load on the provider bounded.
+
+    The primary subdomain is derived from the tile number (the ``"hash"`` strategy of
+    :meth:`TileProvider.build_url`), so HTTP caches stay warm. Providers with a single
+    or no subdomain are fetched without hedging.
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    delay : float (optional)
+        Fixed delay in seconds before a request is hedged. If None, the 95th percentile
+        of the last 100 request durations is used.
+    initial_delay : float (optional, default 0.5)
+        Delay used until 20 request durations are observed
+    budget : float (optional, default 0.05)
+        Maximum share of requests that can be hedged
+    timeout : float (optional, default 30)
+        Timeout of a single request in seconds
+    headers : dict (optional)
+        Additional HTTP headers of the requests
+    max_workers : int (optional, default 16)
+        Number of threads sending requests
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.tiles import HedgedFetcher
+    >>> fetcher = HedgedFetcher(xyz.CartoDB.Positron, budget=0.1)
+    >>> png = fetcher.fetch(x=0, y=0, z=0)
+    """
+
+    def __init__(
+        self,
+        provider: TileProvider,
+        delay: float | None = None,
+        initial_delay: float = 0.5,
+        budget: float = 0.05,
+        timeout: float = 30,
+        headers: dict | None = None,
+        max_workers: int = 16,
+    ):
+        self.provider = provider
+        self.delay = delay
+        self.initial_delay = initial_delay
+        self.budget = budget
+        self.timeout = timeout
+        self.headers = headers
+        self.requests = 0
+        self.hedged = 0
+        self._durations = collections.deque(maxlen=100)
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self) -> None:
+        """Shut down the worker threads."""
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def hedge_delay(self) -> float:
+        """Return the current delay in seconds before a request is hedged."""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            if len(self._durations) < 20:
+                return self.initial_delay
+            durations = sorted(self._durations)
+        return durations[int(0.95 * (len(durations) - 1))]
+
+    def fetch(
+        self, x: int, y: int, z: int, scale_factor: str | None = None, **kwargs
+    ) -> bytes:
+        """
+        Fetch a tile, hedging the request if it is slow
+
+        Parameters
+        ----------
+        x, y, z : int
+            tile number
+        scale_factor : str (optional)
+            Scale factor (where supported). See :meth:`TileProvider.build_url`.
+
+        **kwargs
+            Other potential attributes updating the :class:`TileProvider`.
+
+        Returns
+        -------
+        bytes
+            Content of the tile
+        """
+        provider = {**self.provider, **kwargs}
+        subdomains = provider.get("subdomains", "abc")
+        if "{s}" not in provider["url"] or len(subdomains) < 2:
+            subdomains = subdomains[:1]
+        first = abs(x + y) % len(subdomains)
+
+        def _request(index):
+            url = self.provider.build_url(
+                x=x,
+                y=y,
+                z=z,
+                scale_factor=scale_factor,
+                **{**kwargs, "subdomains": [subdomains[index]]},
+            )
+            start = time.monotonic()
+            data = _get(url, timeout=self.timeout, headers=self.headers)
+            with self._lock:
+                self._durations.append(time.monotonic() - start)
+            return data
+
+        with self._lock:
+            self.requests += 1
+
+        primary = _submit(self._executor, _request, first)
+        if len(subdomains) < 2:
+            return primary.result()
+        try:
+            return primary.result(timeout=self.hedge_delay())
+        except concurrent.futures.TimeoutError:
+            pass
+
+        with self._lock:
+            allowed = self.hedged < self.budget * self.requests
+            if allowed:
+                self.hedged += 1
+        if not allowed:
+            return primary.result()
+
+        hedge = _submit(self._executor, _request, (first + 1) % len(subdomains))
+        pending = {primary, hedge}
+        while True:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:  # both failed
+                return primary.result()
+
+
+def _is_upstream_failure(err: urllib.error.HTTPError) -> bool:
+    return err.code == 429 or err.code >= 500
+
+
+def _tile_extent(x_min, x_max, y_min, y_max, zoom):
+    """Return (west, south, east, north) of a range of tiles in Web Mercator."""
+    tile_size = 2 * WEB_MERCATOR_HALF_WORLD / (1 << zoom)
+    return (
+        -WEB_MERCATOR_HALF_WORLD + x_min * tile_size,
+        WEB_MERCATOR_HALF_WORLD - (y_max + 1) * tile_size,
+        -WEB_MERCATOR_HALF_WORLD + (x_max + 1) * tile_size,
+        WEB_MERCATOR_HALF_WORLD - y_min * tile_size,
+    )
+
+
+def _get(url: str, timeout: float = 30, headers: dict | None = None) -> bytes:
+    request = urllib.request.Request(
+        url,
+        headers={
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": _ACCEPT_ENCODING,
+            **(headers or {}),
+        },
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return _decode_content(
+            response.read(), response.headers.get("Content-Encoding", "")
+        )
+
+
+def _decode_content(data: bytes, encoding: str) -> bytes:
+    """Undo the Content-Encoding of a response.
+
+    Vector tiles are often stored gzipped and served without the header, so the
+    gzip signature (never the start of an image or a protobuf message) is
+    decompressed as well.
+    """
+    for coding in reversed([c.strip().lower() for c in encoding.split(",")]):
+        if coding in ("gzip", "x-gzip"):
+            data = gzip.decompress(data)
+        elif coding == "br":
+            import brotli
+
+            data = brotli.decompress(data)
+    if data[:2] == _GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return data
+
+
+def _fetch_decode(url, timeout, headers):
+    """Fetch and decode a tile into raw RGBA bytes and its (width, height).
+
+    Defined at the module level to be usable by process pools.
+    """
+    try:
+        from PIL import Image
+    except ImportError as err:
+        raise ImportError("mosaic() requires numpy and Pillow.") from err
+
+    with Image.open(BytesIO(_get(url, timeout=timeout, headers=headers))) as image:
+        image = image.convert("RGBA")
+        return image.tobytes(), image.size
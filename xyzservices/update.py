@@ -0,0 +1,140 @@
+"""
+Refreshing the catalog from a remote providers JSON without reinstalling
+"""
+
+from __future__ import annotations
+
+import contextlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import urllib.error
+import urllib.request
+
+from .lib import Bunch
+from .tiles import USER_AGENT, _decode_content
+
+DEFAULT_URL = (
+    "https://raw.githubusercontent.com/geopandas/xyzservices/main/"
+    "xyzservices/data/providers.json"
+)
+
+# overrides the default URL of update_providers()
+url_env = "XYZSERVICES_PROVIDERS_URL"
+
+
+def update_providers(
+    url: str | None = None,
+    timeout: float = 30,
+    reload: bool = True,
+) -> bool:
+    """
+    Download a newer providers JSON and reload ``xyzservices.providers``
+
+    The request is conditional (using ``ETag`` and ``Last-Modified`` of the previous
+    download), so nothing is transferred if the remote catalog has not changed. A
+    downloaded catalog is validated and atomically moved to the user data directory
+    (``$XDG_DATA_HOME/xyzservices`` or ``~/.local/share/xyzservices``,
+    ``%LOCALAPPDATA%\\xyzservices`` on Windows), where all subsequent imports of
+    xyzservices pick it up until a newer version of the package is installed.
+
+    Long-running services can call it periodically, e.g. once a day, to pick up
+    fixed providers without a redeploy.
+
+    Parameters
+    ----------
+    url : str (optional)
+        URL of the providers JSON. Defaults to the value of the
+        ``XYZSERVICES_PROVIDERS_URL`` environment variable or the catalog on the
+        main branch of xyzservices.
+    timeout : float (optional, default 30)
+        Timeout of the request in seconds
+    reload : bool (optional, default True)
+        Update the ``xyzservices.providers`` :class:`Bunch` in place after a
+        download, so existing references to it see the new catalog.
+
+    Returns
+    -------
+    bool
+        True if a new catalog was downloaded, False if it has not changed
+
+    Raises
+    ------
+    ValueError
+        If the downloaded JSON is not a valid catalog. The current catalog is kept.
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.update import update_providers
+    >>> update_providers()
+    True
+    """
+    providers_module = importlib.import_module(".providers", __package__)
+    path = providers_module.user_data_path
+    meta_path = path + ".meta"
+    if url is None:
+        url = os.environ.get(url_env, DEFAULT_URL)
+
+    headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"}
+    meta = {}
+    with contextlib.suppress(OSError, ValueError), open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("url") == url and os.path.exists(path):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = _decode_content(
+                response.read(), response.headers.get("Content-Encoding", "")
+            )
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return False
+        raise
+
+    _validate(data)
+    _write_atomic(path, data)
+    meta = {"url": url, "etag": etag, "last_modified": last_modified}
+    with contextlib.suppress(OSError):
+        _write_atomic(meta_path, json.dumps(meta).encode())
+
+    # a catalog not loaded yet is read from the new file once used
+    if reload and "providers" in vars(providers_module):
+        providers = providers_module.providers
+        fresh = providers_module._load_providers()
+        providers.update(fresh)
+        for key in set(providers) - set(fresh):
+            del providers[key]
+    return True
+
+
+def _validate(data: bytes) -> None:
+    try:
+        providers = Bunch.from_json(io.BytesIO(data))
+    except (ValueError, AttributeError, TypeError) as err:
+        raise ValueError(f"The downloaded catalog is not valid: {err}") from err
+    if not providers:
+        raise ValueError("The downloaded catalog is empty.")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
@@ -0,0 +1,274 @@
+"""
+Streaming reader of Mapbox Vector Tiles (MVT)
+
+A minimal pure Python decoder of the `Mapbox Vector Tile specification
+<https://github.com/mapbox/vector-tile-spec/tree/master/2.1>`__. Layers are located
+without decoding their features and features are decoded one by one, so reading a
+single layer of a tile does not pay for the others.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import Iterable, Iterator
+
+GEOMETRY_TYPES = {0: "Unknown", 1: "Point", 2: "LineString", 3: "Polygon"}
+
+# protobuf wire types
+_VARINT = 0
+_FIXED64 = 1
+_BYTES = 2
+_FIXED32 = 5
+
+# geometry commands
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+class Layer:
+    """
+    Layer of a vector tile
+
+    Features are decoded lazily while iterating over the layer.
+
+    Attributes
+    ----------
+    name : str
+        Name of the layer
+    extent : int
+        Size of the tile in the coordinates of the features (usually 4096)
+    version : int
+        Version of the vector tile specification
+
+    Examples
+    --------
+    >>> from xyzservices.vector import iter_layers
+    >>> for layer in iter_layers(data):
+    ...     print(layer.name, sum(1 for _ in layer))
+    """
+
+    def __init__(self, data: memoryview):
+        self.name = ""
+        self.extent = 4096
+        self.version = 1
+        self._keys = []
+        self._values = []
+        self._features = []
+        for field, wire, value in _fields(data):
+            if field == 1:
+                self.name = str(value, "utf-8")
+            elif field == 2:
+                self._features.append(value)
+            elif field == 3:
+                self._keys.append(str(value, "utf-8"))
+            elif field == 4:
+                self._values.append(value)
+            elif field == 5 and wire == _VARINT:
+                self.extent = value
+            elif field == 15 and wire == _VARINT:
+                self.version = value
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def __iter__(self) -> Iterator[dict]:
+        # values are decoded once per layer and only if a feature uses them
+        values = {}
+        for feature in self._features:
+            yield self._decode_feature(feature, values)
+
+    def __repr__(self):
+        return f"<Layer {self.name!r} with {len(self)} features>"
+
+    def _decode_feature(self, data, values):
+        feature = {"id": None, "type": "Unknown", "properties": {}, "geometry": []}
+        tags = geometry = ()
+        for field, wire, value in _fields(data):
+            if field == 1 and wire == _VARINT:
+                feature["id"] = value
+            elif field == 2:
+                tags = _packed(value)
+            elif field == 3 and wire == _VARINT:
+                feature["type"] = GEOMETRY_TYPES.get(value, "Unknown")
+            elif field == 4:
+                geometry = _packed(value)
+
+        properties = feature["properties"]
+        for i in range(0, len(tags) - 1, 2):
+            index = tags[i + 1]
+            if index not in values:
+                values[index] = _decode_value(self._values[index])
+            properties[self._keys[tags[i]]] = values[index]
+
+        feature["geometry"] = _decode_geometry(geometry)
+        return feature
+
+
+def iter_layers(data: bytes, layers: Iterable[str] | None = None) -> Iterator[Layer]:
+    """
+    Iterate over the layers of a vector tile
+
+    Parameters
+    ----------
+    data : bytes
+        Content of the tile (decompressed, as returned by
+        :func:`~xyzservices.tiles.fetch_tile`)
+    layers : list of str (optional)
+        Names of the layers to return. Other layers are skipped without being
+        parsed. If None, all layers are returned.
+
+    Returns
+    -------
+    Iterator of Layer
+    """
+    wanted = None if layers is None else set(layers)
+    for field, wire, value in _fields(memoryview(data)):
+        if field != 3 or wire != _BYTES:
+            continue
+        if wanted is not None and _layer_name(value) not in wanted:
+            continue
+        yield Layer(value)
+
+
+def iter_features(data: bytes, layers: Iterable[str] | None = None) -> Iterator[dict]:
+    """
+    Iterate over the features of a vector tile
+
+    Each feature is a dictionary with the ``"layer"`` name, ``"id"``, geometry
+    ``"type"`` (``"Point"``, ``"LineString"``, ``"Polygon"`` or ``"Unknown"``),
+    ``"properties"`` and ``"geometry"``. The geometry is a list of parts (points,
+    lines or polygon rings), each a list of ``(x, y)`` tile coordinates ranging from
+    0 to the ``extent`` of the layer with ``y`` pointing down.
+
+    Parameters
+    ----------
+    data : bytes
+        Content of the tile (decompressed, as returned by
+        :func:`~xyzservices.tiles.fetch_tile`)
+    layers : list of str (optional)
+        Names of the layers to read. Other layers are skipped without being
+        parsed. If None, all layers are read.
+
+    Returns
+    -------
+    Iterator of dict
+
+    Examples
+    --------
+    >>> from xyzservices.tiles import fetch_tile
+    >>> from xyzservices.vector import iter_features
+    >>> data = fetch_tile(provider, x=8, y=5, z=4)
+    >>> roads = list(iter_features(data, layers=["transportation"]))
+    """
+    for layer in iter_layers(data, layers):
+        for feature in layer:
+            feature["layer"] = layer.name
+            yield feature
+
+
+def _layer_name(data):
+    for field, wire, value in _fields(data):
+        if field == 1 and wire == _BYTES:
+            return str(value, "utf-8")
+    return ""
+
+
+def _varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data):
+    """Yield ``(field number, wire type, value)`` of a protobuf message.
+
+    Length-delimited values are returned as memoryview slices without copying.
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        try:
+            key, pos = _varint(data, pos)
+            field, wire = key >> 3, key & 7
+            if wire == _VARINT:
+                value, pos = _varint(data, pos)
+            elif wire == _BYTES:
+                length, pos = _varint(data, pos)
+                value = data[pos : pos + length]
+                pos += length
+            elif wire == _FIXED32:
+                value = data[pos : pos + 4]
+                pos += 4
+            elif wire == _FIXED64:
+                value = data[pos : pos + 8]
+                pos += 8
+            else:
+                raise ValueError(f"Unsupported protobuf wire type {wire}.")
+        except IndexError:
+            pos = end + 1
+        if pos > end:
+            raise ValueError("Truncated vector tile.")
+        yield field, wire, value
+
+
+def _packed(data):
+    values = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        value, pos = _varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _decode_value(data):
+    for field, wire, value in _fields(data):
+        if field == 1:
+            return str(value, "utf-8")
+        if field == 2 and wire == _FIXED32:
+            return struct.unpack("<f", value)[0]
+        if field == 3 and wire == _FIXED64:
+            return struct.unpack("<d", value)[0]
+        if field == 4:
+            return value - (1 << 64) if value >= 1 << 63 else value
+        if field == 5:
+            return value
+        if field == 6:
+            return _zigzag(value)
+        if field == 7:
+            return bool(value)
+    return None
+
+
+def _decode_geometry(commands):
+    parts = []
+    part = None
+    x = y = 0
+    i = 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == _CLOSE_PATH:
+            if part:
+                part.append(part[0])
+            continue
+        for _ in range(count):
+            x += _zigzag(commands[i])
+            y += _zigzag(commands[i + 1])
+            i += 2
+            if command == _MOVE_TO:
+                part = [(x, y)]
+                parts.append(part)
+            else:
+                part.append((x, y))
+    return parts
@@ -0,0 +1,225 @@
+"""
+Tile grids of WMTS providers, including those not using Web Mercator
+
+Providers with a ``crs`` other than Web Mercator (e.g. the Lambert-93 layers of
+GeoportailFrance) carry the definition of their tile matrix set in the
+``tile_matrices`` attribute, captured from the WMTS capabilities when the catalog is
+built. Each tile matrix is a list of ``[identifier, resolution, origin x, origin y,
+matrix width, matrix height]``, where the identifier is the ``{z}`` of the URL, the
+resolution is in CRS units per pixel and the origin is the top left corner in the
+``(x, y)`` (easting, northing or longitude, latitude) order. Functions of this
+module raise ValueError for providers of other grids lacking ``tile_matrices``
+(e.g. in a catalog built before they were captured).
+
+Points are converted to tiles with NumPy in bulk. The projections of the supported
+CRS are implemented here, so no GIS library is needed.
+
+Requires ``numpy``.
+"""
+
+from __future__ import annotations
+
+import math
+
+from .lib import MAX_LATITUDE, TileProvider, _web_mercator
+from .tiles import WEB_MERCATOR_HALF_WORLD
+
+# CRS of providers without the ``crs`` attribute
+DEFAULT_CRS = "EPSG:3857"
+
+_EARTH_RADIUS = 6378137.0
+
+# Lambert-93 (EPSG:2154): Lambert conformal conic with two standard parallels
+# (EPSG method 9802) on the GRS80 ellipsoid
+_GRS80_E = math.sqrt(2 / 298.257222101 - (1 / 298.257222101) ** 2)
+_L93_LON0 = math.radians(3)
+_L93_FALSE_EASTING = 700000.0
+_L93_FALSE_NORTHING = 6600000.0
+
+
+def _lcc_t(phi, sin=math.sin, tan=math.tan):
+    e_sin = _GRS80_E * sin(phi)
+    return tan(math.pi / 4 - phi / 2) / ((1 - e_sin) / (1 + e_sin)) ** (_GRS80_E / 2)
+
+
+def _lcc_m(phi):
+    return math.cos(phi) / math.sqrt(1 - (_GRS80_E * math.sin(phi)) ** 2)
+
+
+_L93_N = (math.log(_lcc_m(math.radians(49))) - math.log(_lcc_m(math.radians(44)))) / (
+    math.log(_lcc_t(math.radians(49))) - math.log(_lcc_t(math.radians(44)))
+)
+_L93_AF = (
+    _EARTH_RADIUS
+    * _lcc_m(math.radians(49))
+    / (_L93_N * _lcc_t(math.radians(49)) ** _L93_N)
+)
+_L93_R0 = _L93_AF * _lcc_t(math.radians(46.5)) ** _L93_N
+
+
+def tile_matrix(provider: TileProvider, z: int) -> dict:
+    """
+    Return the definition of the tile matrix of a provider at a zoom level
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    z : int
+        Zoom level (identifier of the tile matrix)
+
+    Returns
+    -------
+    dict
+        - ``"crs"`` - CRS of the tile matrix set, e.g. ``"EPSG:2154"``
+        - ``"resolution"`` - size of a pixel in the units of the CRS
+        - ``"origin"`` - ``(x, y)`` of the top left corner of the matrix
+        - ``"tile_size"`` - size of a tile in pixels
+        - ``"matrix_size"`` - ``(width, height)`` of the matrix in tiles
+
+    Raises
+    ------
+    ValueError
+        If the tile matrix set of the provider has no matrix ``z`` or if it does
+        not use Web Mercator and its ``tile_matrices`` are not known
+    """
+    tile_size = provider.get("tileSize", 256)
+    matrices = provider.get("tile_matrices")
+    if matrices is None:
+        if not _web_mercator(provider):
+            grid = provider.get("crs", provider.get("TileMatrixSet"))
+            raise ValueError(
+                f"The tile matrix set '{grid}' of '{provider.name}' does not use "
+                "Web Mercator and its definition (tile_matrices) is not available."
+            )
+        n = 1 << z
+        return {
+            "crs": provider.get("crs", DEFAULT_CRS),
+            "resolution": 2 * WEB_MERCATOR_HALF_WORLD / (tile_size * n),
+            "origin": (-WEB_MERCATOR_HALF_WORLD, WEB_MERCATOR_HALF_WORLD),
+            "tile_size": tile_size,
+            "matrix_size": (n, n),
+        }
+    for identifier, resolution, x0, y0, width, height in matrices:
+        if identifier == z:
+            return {
+                "crs": provider.get("crs", DEFAULT_CRS),
+                "resolution": resolution,
+                "origin": (x0, y0),
+                "tile_size": tile_size,
+                "matrix_size": (width, height),
+            }
+    raise ValueError(f"The tile matrix set of '{provider.name}' has no matrix {z}.")
+
+
+def xy_to_tile(provider: TileProvider, x, y, z: int):
+    """
+    Return the tiles containing points given in the CRS of the provider
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    x, y : array-like
+        Coordinates in the CRS of the provider (see :func:`tile_matrix`)
+    z : int
+        Zoom level (identifier of the tile matrix)
+
+    Returns
+    -------
+    cols, rows : numpy.ndarray
+        Tile columns and rows (``{x}`` and ``{y}`` of the URL). Points outside of
+        the tile matrix get numbers outside of its ``matrix_size``.
+    """
+    np = _numpy()
+    matrix = tile_matrix(provider, z)
+    x0, y0 = matrix["origin"]
+    span = matrix["resolution"] * matrix["tile_size"]
+    cols = np.floor((np.asarray(x, dtype=float) - x0) / span).astype(np.int64)
+    rows = np.floor((y0 - np.asarray(y, dtype=float)) / span).astype(np.int64)
+    return cols, rows
+
+
+def lonlat_to_tile(provider: TileProvider, lon, lat, z: int):
+    """
+    Return the tiles containing points given in longitude and latitude
+
+    The points are projected to the CRS of the provider (Web Mercator, EPSG:4326 or
+    Lambert-93) and passed to :func:`xy_to_tile`.
+
+    Parameters
+    ----------
+    provider : TileProvider
+        provider of tiles
+    lon, lat : array-like
+        Longitude and latitude (EPSG:4326) in degrees
+    z : int
+        Zoom level (identifier of the tile matrix)
+
+    Returns
+    -------
+    cols, rows : numpy.ndarray
+        Tile columns and rows (``{x}`` and ``{y}`` of the URL)
+
+    Raises
+    ------
+    ValueError
+        If the CRS of the provider is not supported
+
+    Examples
+    --------
+    >>> import xyzservices.providers as xyz
+    >>> from xyzservices.wmts import lonlat_to_tile
+    >>> provider = xyz.GeoportailFrance.Cadastralparcels_Parcels_L93
+    >>> cols, rows = lonlat_to_tile(provider, lon, lat, 14)
+    >>> urls = provider.build_urls(zip(cols, rows, [14] * len(cols)), apikey="...")
+    """
+    x, y = project(provider.get("crs", DEFAULT_CRS), lon, lat)
+    return xy_to_tile(provider, x, y, z)
+
+
+def project(crs: str, lon, lat):
+    """
+    Project longitude and latitude to a supported CRS
+
+    Parameters
+    ----------
+    crs : str
+        ``"EPSG:3857"``, ``"EPSG:4326"`` or ``"EPSG:2154"``
+    lon, lat : array-like
+        Longitude and latitude (EPSG:4326) in degrees
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        Coordinates in ``crs``
+    """
+    np = _numpy()
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    if crs == "EPSG:4326":
+        return lon, lat
+    if crs in ("EPSG:3857", "EPSG:900913"):
+        lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+        x = np.radians(lon) * _EARTH_RADIUS
+        y = np.arcsinh(np.tan(np.radians(lat))) * _EARTH_RADIUS
+        return x, y
+    if crs == "EPSG:2154":
+        return _lambert93(np, lon, lat)
+    raise ValueError(f"Unsupported CRS '{crs}'.")
+
+
+def _lambert93(np, lon, lat):
+    r = _L93_AF * _lcc_t(np.radians(lat), np.sin, np.tan) ** _L93_N
+    theta = _L93_N * (np.radians(lon) - _L93_LON0)
+    x = _L93_FALSE_EASTING + r * np.sin(theta)
+    y = _L93_FALSE_NORTHING + _L93_R0 - r * np.cos(theta)
+    return x, y
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError as err:
+        raise ImportError("xyzservices.wmts requires numpy.") from err
+    return np